@@ -1,3 +1,6 @@
+import os
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from datetime import datetime, timedelta, timezone
 
@@ -6,6 +9,11 @@ SECRET_KEY = "your_secret_key_here"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 15  # Set to 15 seconds for testing purposes
 
+# Shop of the first (bootstrap) user and of data created before shops existed
+DEFAULT_SHOP_ID = os.getenv("DEFAULT_SHOP_ID", "main")
+
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token", auto_error=False)
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -17,4 +25,30 @@ def decode_access_token(token: str):
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload
     except JWTError:
-        return None
\ No newline at end of file
+        return None
+
+def shop_from_token(token: str | None) -> str:
+    """Resolve the shop a request is scoped to from its bearer token (401 without a valid one)."""
+    payload = decode_access_token(token) if token else None
+    if payload is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return payload.get("shop") or DEFAULT_SHOP_ID
+
+async def get_shop_id(token: str | None = Depends(optional_oauth2_scheme)) -> str:
+    return shop_from_token(token)
+
+async def require_admin(token: str | None = Depends(optional_oauth2_scheme)) -> dict:
+    """Token payload of an admin user; 401 without a valid token, 403 for other roles."""
+    payload = decode_access_token(token) if token else None
+    if payload is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+        )
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return payload
@@ -0,0 +1,205 @@
+"""
+Per-request time budgets for Mongo reads.
+
+Each request gets a deadline when it is admitted (LoadSheddingMiddleware).
+Every read issued while serving it - find, find_one, aggregate, count_documents,
+distinct - carries maxTimeMS equal to the time left, so the server abandons a
+query once the client would have given up on the answer anyway. A read
+started after the deadline fails immediately without reaching the server.
+
+Both surface as pymongo.errors.ExecutionTimeout: main.py turns it into a 503,
+and routes that can do without part of their answer (e.g. report rankings)
+catch it and return a response flagged as degraded. Such routes run their
+required reads under `spend_at_most(REQUIRED_SHARE)`, so the optional parts
+still have time left when the required part was slow.
+
+Writes are never cut short, and once a request has written anything its
+remaining reads are no longer budgeted either: failing a checkout after the
+stock has moved would be worse than answering late.
+
+Configuration (environment):
+    BUDGET_CHECKOUT_MS / BUDGET_REPORT_MS / BUDGET_DEFAULT_MS
+        budget per load-shedding lane (default 5000 / 20000 / 5000); 0 disables it
+    BUDGET_ANALYTICS_MS
+        routes that scan long histories on purpose (default 60000)
+    BUDGET_REQUIRED_SHARE
+        share of the budget the required reads of a degradable route may use (default 0.7)
+"""
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from pymongo.collection import Collection
+from pymongo.errors import ExecutionTimeout
+from database.slowqueries import current_scope, route_label
+
+# The server's error code for an exceeded maxTimeMS (MaxTimeMSExpired)
+MAX_TIME_MS_EXPIRED = 50
+
+LANE_BUDGETS_MS = {
+    "checkout": int(os.getenv("BUDGET_CHECKOUT_MS", "5000")),
+    "report": int(os.getenv("BUDGET_REPORT_MS", "20000")),
+    "default": int(os.getenv("BUDGET_DEFAULT_MS", "5000")),
+}
+
+# (method, path regex) -> budget, checked before the lane budgets. First match wins.
+ANALYTICS_BUDGET_MS = int(os.getenv("BUDGET_ANALYTICS_MS", "60000"))
+ROUTE_BUDGETS_MS: List[Tuple[str, re.Pattern, int]] = [
+    ("GET", re.compile(r"^/stock/reorder-suggestions$"), ANALYTICS_BUDGET_MS),
+    ("GET", re.compile(r"^/suppliers/analytics$"), ANALYTICS_BUDGET_MS),
+]
+
+REQUIRED_SHARE = float(os.getenv("BUDGET_REQUIRED_SHARE", "0.7"))
+
+
+class Budget:
+    def __init__(self, milliseconds: int):
+        self.deadline = time.monotonic() + milliseconds / 1000
+        self.cap: Optional[float] = None  # earlier deadline for the block in progress (spend_at_most)
+        self.writing = False
+
+    def remaining_ms(self) -> Optional[int]:
+        """Milliseconds left for the next read; None once the request has started writing."""
+        if self.writing:
+            return None
+        deadline = min(self.deadline, self.cap) if self.cap is not None else self.deadline
+        remaining = int((deadline - time.monotonic()) * 1000)
+        if remaining <= 0:
+            raise ExecutionTimeout("Request time budget exhausted", code=MAX_TIME_MS_EXPIRED)
+        return remaining
+
+
+# Budget of the request being served; set by LoadSheddingMiddleware
+current_budget: ContextVar[Optional[Budget]] = ContextVar("current_budget", default=None)
+
+
+def start_budget(method: str, path: str, lane: str) -> Optional[Budget]:
+    """The budget for a request that has just been admitted, None when budgets are disabled for it."""
+    milliseconds = next(
+        (budget for route_method, pattern, budget in ROUTE_BUDGETS_MS if route_method == method and pattern.match(path)),
+        LANE_BUDGETS_MS.get(lane, 0),
+    )
+    return Budget(milliseconds) if milliseconds > 0 else None
+
+
+@contextmanager
+def spend_at_most(share: float):
+    """
+    Let the reads inside the block use at most `share` of the time the request
+    has left, keeping the rest for what comes after it. No-op without a budget.
+    """
+    budget = current_budget.get()
+    if budget is None:
+        yield
+        return
+    previous = budget.cap
+    now = time.monotonic()
+    budget.cap = now + max(budget.deadline - now, 0) * share
+    try:
+        yield
+    finally:
+        budget.cap = previous
+
+
+def _remaining_ms() -> Optional[int]:
+    budget = current_budget.get()
+    return budget.remaining_ms() if budget else None
+
+
+def _mark_writing():
+    budget = current_budget.get()
+    if budget:
+        budget.writing = True
+
+
+class BudgetedCollection(Collection):
+    """A Collection whose reads carry the current request's remaining budget as maxTimeMS."""
+
+    def with_options(self, codec_options=None, read_preference=None, write_concern=None, read_concern=None):
+        return BudgetedCollection(
+            self.database, self.name, False,
+            codec_options or self.codec_options,
+            read_preference or self.read_preference,
+            write_concern or self.write_concern,
+            read_concern or self.read_concern,
+        )
+
+    def find(self, *args, **kwargs):
+        if "max_time_ms" not in kwargs:
+            remaining = _remaining_ms()
+            if remaining is not None:
+                kwargs["max_time_ms"] = remaining
+        return super().find(*args, **kwargs)
+
+    def aggregate(self, pipeline, *args, **kwargs):
+        if any("$out" in stage or "$merge" in stage for stage in pipeline):
+            _mark_writing()
+        elif "maxTimeMS" not in kwargs:
+            remaining = _remaining_ms()
+            if remaining is not None:
+                kwargs["maxTimeMS"] = remaining
+        return super().aggregate(pipeline, *args, **kwargs)
+
+    def count_documents(self, filter, *args, **kwargs):
+        if "maxTimeMS" not in kwargs:
+            remaining = _remaining_ms()
+            if remaining is not None:
+                kwargs["maxTimeMS"] = remaining
+        return super().count_documents(filter, *args, **kwargs)
+
+    def distinct(self, key, *args, **kwargs):
+        if "maxTimeMS" not in kwargs:
+            remaining = _remaining_ms()
+            if remaining is not None:
+                kwargs["maxTimeMS"] = remaining
+        return super().distinct(key, *args, **kwargs)
+
+
+def _write(name: str):
+    def method(self, *args, **kwargs):
+        _mark_writing()
+        return getattr(Collection, name)(self, *args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+for _name in ("insert_one", "insert_many", "update_one", "update_many", "replace_one", "delete_one",
+              "delete_many", "bulk_write", "find_one_and_update", "find_one_and_replace", "find_one_and_delete"):
+    setattr(BudgetedCollection, _name, _write(_name))
+
+
+class TimeoutMetrics:
+    """Per-route counts of requests that ran out of budget, in this worker since it started."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.since = datetime.now(timezone.utc)
+        self.failed: Counter = Counter()  # answered with 503
+        self.degraded: Counter = Counter()  # answered without the part that timed out
+
+    def record(self, route: str, degraded: bool = False):
+        with self.lock:
+            (self.degraded if degraded else self.failed)[route] += 1
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                "pid": os.getpid(),
+                "since": self.since,
+                "budgets_ms": {**LANE_BUDGETS_MS, "analytics": ANALYTICS_BUDGET_MS},
+                "failed": dict(self.failed),
+                "degraded": dict(self.degraded),
+            }
+
+
+timeout_metrics = TimeoutMetrics()
+
+
+def record_timeout(degraded: bool = False):
+    """Count a timeout against the route being served."""
+    timeout_metrics.record(route_label(current_scope.get()), degraded)
@@ -6,24 +6,124 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+from database.slowqueries import slow_query_listener, SLOW_QUERIES_COLLECTION  # reads its settings from the env
+from database.budget import BudgetedCollection
+
 uri = os.getenv("DATABASE_URL")
 # Create a new client and connect to the server
-client = MongoClient(uri, server_api=ServerApi('1'))
+client = MongoClient(uri, server_api=ServerApi('1'), event_listeners=[slow_query_listener])
 
 database = client['ShopyGenie']
 
-#creating collections
-users_collection = database['users']
-products_collection = database['products']
-purchases_collection = database['purchases']
-sales_collection = database['sales']
-customers_collection = database['customers']
-debts_collection = database['debts']
-expenditures_collection = database['expenditures']
+#creating collections (reads carry the request's time budget, see database/budget.py)
+users_collection = BudgetedCollection(database, 'users')
+products_collection = BudgetedCollection(database, 'products')
+purchases_collection = BudgetedCollection(database, 'purchases')
+sales_collection = BudgetedCollection(database, 'sales')
+customers_collection = BudgetedCollection(database, 'customers')
+debts_collection = BudgetedCollection(database, 'debts')
+expenditures_collection = BudgetedCollection(database, 'expenditures')
+valuation_collection = BudgetedCollection(database, 'stock_valuation')
+versions_collection = BudgetedCollection(database, 'collection_versions')
+movements_collection = BudgetedCollection(database, 'stock_movements')
+snapshots_collection = BudgetedCollection(database, 'stock_snapshots')
+tombstones_collection = BudgetedCollection(database, 'tombstones')
+slow_queries_collection = BudgetedCollection(database, SLOW_QUERIES_COLLECTION)
+profiles_collection = BudgetedCollection(database, 'request_profiles')
+sales_archive_collection = BudgetedCollection(database, 'sales_archive')
+purchases_archive_collection = BudgetedCollection(database, 'purchases_archive')
+debts_archive_collection = BudgetedCollection(database, 'debts_archive')
+expenditures_archive_collection = BudgetedCollection(database, 'expenditures_archive')
+summaries_collection = BudgetedCollection(database, 'monthly_summaries')
+archive_state_collection = BudgetedCollection(database, 'archive_state')
+holds_collection = BudgetedCollection(database, 'stock_holds')
+product_pairs_collection = BudgetedCollection(database, 'product_pairs')
+counters_collection = BudgetedCollection(database, 'id_counters')
+dashboard_events_collection = BudgetedCollection(database, 'dashboard_events')
+
+# Diagnostics are kept this long, then expired by TTL indexes
+SLOW_QUERY_RETENTION_DAYS = int(os.getenv("SLOW_QUERY_RETENTION_DAYS", "7"))
+PROFILE_RETENTION_HOURS = int(os.getenv("PROFILE_RETENTION_HOURS", "24"))
+
+
+def ensure_indexes():
+    """
+    Create the indexes the routes rely on (no-op when they already exist).
+
+    Every compound index leads with shop_id so per-shop queries stay bounded
+    as branches are added. When sharding, use {"shop_id": 1, "id": 1} as the
+    shard key for each collection; it is backed by the first index below.
+    """
+    for collection in (products_collection, customers_collection, sales_collection,
+                       purchases_collection, debts_collection, expenditures_collection):
+        collection.create_index([("shop_id", 1), ("id", 1)])
+
+    users_collection.create_index([("username", 1)])
+    users_collection.create_index([("shop_id", 1), ("id", 1)])
+    products_collection.create_index([("shop_id", 1), ("name", 1)])
+    products_collection.create_index([("shop_id", 1), ("category", 1)])
+    customers_collection.create_index([("shop_id", 1), ("name", 1)])
+    customers_collection.create_index([("shop_id", 1), ("phone", 1)])
+    # Prefix lookups of the search fallback (utils/search.py), matched case-sensitively
+    # against these lowercased copies of name / category
+    products_collection.create_index([("shop_id", 1), ("name_lower", 1)])
+    products_collection.create_index([("shop_id", 1), ("category_lower", 1)])
+    customers_collection.create_index([("shop_id", 1), ("name_lower", 1)])
+    sales_collection.create_index([("shop_id", 1), ("created_at", 1)])
+    sales_collection.create_index([("shop_id", 1), ("customer_id", 1), ("created_at", 1)])
+    # One sale per terminal-side id; sales without one (null or missing) are not indexed
+    legacy = sales_collection.index_information().get("shop_id_1_client_ref_1")
+    if legacy and not legacy.get("unique"):
+        sales_collection.drop_index("shop_id_1_client_ref_1")
+    sales_collection.create_index(
+        [("shop_id", 1), ("client_ref", 1)],
+        unique=True,
+        partialFilterExpression={"client_ref": {"$type": "string"}},
+    )
+    purchases_collection.create_index([("shop_id", 1), ("created_at", 1)])
+    purchases_collection.create_index([("shop_id", 1), ("supplier", 1), ("created_at", 1)])
+    debts_collection.create_index([("shop_id", 1), ("customer_name", 1), ("created_at", 1)])
+    debts_collection.create_index([("shop_id", 1), ("customer_name", 1), ("payment.date", 1)])
+    debts_collection.create_index([("shop_id", 1), ("created_at", 1)])
+    debts_collection.create_index([("shop_id", 1), ("cleared", 1), ("created_at", 1)])
+    debts_collection.create_index([("shop_id", 1), ("customer_name", 1), ("cleared", 1), ("created_at", 1)])
+    debts_collection.create_index([("shop_id", 1), ("payment.payment_id", 1)], sparse=True)
+    expenditures_collection.create_index([("shop_id", 1), ("date", 1)])
+    expenditures_collection.create_index([("shop_id", 1), ("category", 1)])
+    valuation_collection.create_index([("shop_id", 1), ("category", 1)], unique=True)
+    movements_collection.create_index([("shop_id", 1), ("product_id", 1), ("created_at", 1)])
+    snapshots_collection.create_index([("shop_id", 1), ("product_id", 1), ("as_of", -1)])
+    snapshots_collection.create_index("as_of")
+    movements_collection.create_index("created_at")
+    products_collection.create_index([("shop_id", 1), ("change_version", 1)])
+    customers_collection.create_index([("shop_id", 1), ("change_version", 1)])
+    tombstones_collection.create_index([("shop_id", 1), ("collection", 1), ("change_version", 1)])
+    slow_queries_collection.create_index("created_at", expireAfterSeconds=SLOW_QUERY_RETENTION_DAYS * 86400)
+    profiles_collection.create_index("created_at", expireAfterSeconds=PROFILE_RETENTION_HOURS * 3600)
+    profiles_collection.create_index("id", unique=True)
+    for collection in (sales_archive_collection, purchases_archive_collection,
+                       debts_archive_collection, expenditures_archive_collection):
+        collection.create_index([("shop_id", 1), ("id", 1)])
+        collection.create_index([("shop_id", 1), ("created_at", 1)])
+    sales_archive_collection.create_index([("shop_id", 1), ("customer_id", 1), ("created_at", 1)])
+    debts_archive_collection.create_index([("shop_id", 1), ("customer_name", 1), ("created_at", 1)])
+    debts_archive_collection.create_index([("shop_id", 1), ("customer_name", 1), ("payment.date", 1)])
+    purchases_archive_collection.create_index([("shop_id", 1), ("supplier", 1), ("created_at", 1)])
+    summaries_collection.create_index([("shop_id", 1), ("collection", 1), ("month", 1)])
+    holds_collection.create_index([("shop_id", 1), ("id", 1)], unique=True)
+    holds_collection.create_index([("status", 1), ("expires_at", 1)])
+    # finished holds are kept a day for support questions; active ones never have finished_at
+    holds_collection.create_index("finished_at", expireAfterSeconds=86400)
+    product_pairs_collection.create_index([("shop_id", 1), ("product_id", 1), ("related_id", 1)], unique=True)
+    product_pairs_collection.create_index([("shop_id", 1), ("product_id", 1), ("count", -1)])
+    # only read live through the change stream (utils/broker.py)
+    dashboard_events_collection.create_index("created_at", expireAfterSeconds=3600)
+
 
 # Send a ping to confirm a successful connection
 try:
     client.admin.command('ping')
     print("Pinged your deployment. You successfully connected to MongoDB!")
+    ensure_indexes()
 except Exception as e:
     print(e)
\ No newline at end of file
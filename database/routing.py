@@ -0,0 +1,90 @@
+"""
+Per-router data-access settings on top of the shared MongoClient.
+
+    reporting(collection)  reads for reports, exports and plain list endpoints.
+                           Secondary-preferred with bounded staleness by default,
+                           so they stay off the primary that serves checkout.
+    money(collection)      writes that move money or stock (sales, purchases,
+                           debts, payments, expenditures, balances).
+                           Majority write concern by default, and always
+                           primary reads: the checks a write depends on and
+                           the documents read back after it (a debt before a
+                           payment, the updated balance) must never be stale.
+
+Everything else keeps the client defaults (primary reads, w=1).
+
+Configuration (environment):
+    REPORT_READ_PREFERENCE       primary | primaryPreferred | secondary | secondaryPreferred | nearest
+                                 (default secondaryPreferred)
+    REPORT_MAX_STALENESS_SECONDS max replication lag tolerated for reporting reads,
+                                 -1 for no limit, otherwise >= 90 (default 90)
+    MONEY_WRITE_CONCERN          "majority" or a number of nodes (default majority)
+    MONEY_WRITE_TIMEOUT_MS       give up waiting for acknowledgement after this (default 5000)
+
+To try it locally, start a replica set and point DATABASE_URL at it:
+
+    mongod --replSet rs0 --port 27017 --dbpath /tmp/rs0-0
+    mongod --replSet rs0 --port 27018 --dbpath /tmp/rs0-1
+    mongosh --eval 'rs.initiate({_id: "rs0", members: [{_id: 0, host: "localhost:27017"}, {_id: 1, host: "localhost:27018"}]})'
+    DATABASE_URL="mongodb://localhost:27017,localhost:27018/?replicaSet=rs0"
+
+and check where a read went with `reporting(sales_collection).read_preference`
+or mongod's log (`db.setProfilingLevel(2)` on the secondary).
+"""
+import os
+from typing import Dict
+from pymongo.collection import Collection
+from pymongo.read_preferences import (
+    Nearest,
+    Primary,
+    PrimaryPreferred,
+    Secondary,
+    SecondaryPreferred,
+)
+from pymongo.write_concern import WriteConcern
+
+_READ_MODES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def _reporting_read_preference():
+    mode = os.getenv("REPORT_READ_PREFERENCE", "secondaryPreferred")
+    if mode not in _READ_MODES:
+        raise ValueError(f"Unknown REPORT_READ_PREFERENCE: {mode}")
+    if mode == "primary":
+        return Primary()
+    return _READ_MODES[mode](max_staleness=int(os.getenv("REPORT_MAX_STALENESS_SECONDS", "90")))
+
+
+def _money_write_concern() -> WriteConcern:
+    w = os.getenv("MONEY_WRITE_CONCERN", "majority")
+    return WriteConcern(
+        w=int(w) if w.isdigit() else w,
+        wtimeout=int(os.getenv("MONEY_WRITE_TIMEOUT_MS", "5000")),
+    )
+
+
+REPORTING_READ_PREFERENCE = _reporting_read_preference()
+MONEY_WRITE_CONCERN = _money_write_concern()
+
+_reporting: Dict[str, Collection] = {}
+_money: Dict[str, Collection] = {}
+
+
+def reporting(collection: Collection) -> Collection:
+    """The same collection, read with the reporting read preference."""
+    if collection.name not in _reporting:
+        _reporting[collection.name] = collection.with_options(read_preference=REPORTING_READ_PREFERENCE)
+    return _reporting[collection.name]
+
+
+def money(collection: Collection) -> Collection:
+    """The same collection, written with the money write concern and read from the primary."""
+    if collection.name not in _money:
+        _money[collection.name] = collection.with_options(read_preference=Primary(), write_concern=MONEY_WRITE_CONCERN)
+    return _money[collection.name]
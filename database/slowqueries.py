@@ -0,0 +1,126 @@
+#this records slow Mongo commands together with their explain plan and the route that issued them
+import logging
+import os
+import queue
+import threading
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from pymongo import monitoring
+
+# Commands slower than this are recorded (0 disables the logger)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# Also run `explain` (queryPlanner verbosity) for recorded reads/updates/deletes
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "1") == "1"
+SLOW_QUERIES_COLLECTION = "slow_queries"
+
+EXPLAINABLE = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+
+# Added by the driver; explain rejects or ignores them
+_DRIVER_FIELDS = {"lsid", "txnNumber", "$clusterTime", "$db", "$readPreference", "readConcern",
+                  "writeConcern", "apiVersion", "apiStrict", "apiDeprecationErrors"}
+
+# Our own bookkeeping is never recorded, so a slow insert here cannot feed itself
+_IGNORED_COLLECTIONS = {SLOW_QUERIES_COLLECTION, "request_profiles"}
+
+# ASGI scope of the request being served; set by ProfilingMiddleware
+current_scope: ContextVar[Optional[dict]] = ContextVar("current_scope", default=None)
+
+logger = logging.getLogger("shopygenie.slowqueries")
+
+
+def route_label(scope: Optional[dict]) -> str:
+    """The route template (e.g. GET /sales/{sale_id}) once routing has run, the raw path before that."""
+    if not scope:
+        return "-"
+    route = scope.get("route")
+    return f"{scope.get('method', '')} {getattr(route, 'path', None) or scope.get('path', '')}".strip()
+
+
+def explainable_command(command_name: str, command: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if command_name not in EXPLAINABLE:
+        return None
+    if command_name == "aggregate" and any("$out" in stage or "$merge" in stage for stage in command.get("pipeline", [])):
+        return None  # explaining these would still validate the output stage; keep it simple
+    return {key: value for key, value in command.items() if key not in _DRIVER_FIELDS}
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """
+    Times every command; those above SLOW_QUERY_MS are handed to a background
+    thread that runs `explain` and stores the record, so the request that
+    issued the command is not slowed down any further.
+    """
+
+    MAX_PENDING = 1000
+
+    def __init__(self):
+        self.in_flight: Dict[tuple, tuple] = {}
+        self.records: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=self.MAX_PENDING)
+        self.writer: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    def _key(self, event) -> tuple:
+        return event.connection_id, event.request_id
+
+    def started(self, event):
+        if SLOW_QUERY_MS <= 0 or event.command_name == "explain":
+            return
+        collection = event.command.get(event.command_name)
+        if collection in _IGNORED_COLLECTIONS:
+            return
+        self.in_flight[self._key(event)] = (event.command, collection, route_label(current_scope.get()))
+
+    def succeeded(self, event):
+        self._finished(event, None)
+
+    def failed(self, event):
+        self._finished(event, event.failure)
+
+    def _finished(self, event, failure):
+        entry = self.in_flight.pop(self._key(event), None)
+        if entry is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < SLOW_QUERY_MS:
+            return
+        command, collection, route = entry
+        record = {
+            "database": event.database_name,
+            "command_name": event.command_name,
+            "collection": collection,
+            "route": route,
+            "duration_ms": round(duration_ms, 1),
+            "failure": str(failure.get("errmsg", failure)) if failure else None,
+            "created_at": datetime.now(timezone.utc),
+            "_explain": explainable_command(event.command_name, command) if SLOW_QUERY_EXPLAIN else None,
+        }
+        logger.warning("slow %s on %s from %s: %.1f ms", event.command_name, collection, route, duration_ms)
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            return  # under a storm of slow queries, the log line above is enough
+        self._ensure_writer()
+
+    def _ensure_writer(self):
+        with self.lock:
+            if self.writer is None or not self.writer.is_alive():
+                self.writer = threading.Thread(target=self._write_records, daemon=True)
+                self.writer.start()
+
+    def _write_records(self):
+        from database.config import client  # imported late: config builds the client with this listener
+
+        while True:
+            record = self.records.get()
+            command = record.pop("_explain")
+            try:
+                if command is not None:
+                    plan = client[record["database"]].command("explain", command, verbosity="queryPlanner")
+                    record["plan"] = plan.get("queryPlanner", {}).get("winningPlan")
+                client[record["database"]][SLOW_QUERIES_COLLECTION].insert_one(record)
+            except Exception as e:
+                logger.warning("could not record slow %s: %s", record["command_name"], e)
+
+
+slow_query_listener = SlowQueryListener()
@@ -1,5 +1,8 @@
-from fastapi import FastAPI
+import asyncio
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pymongo.errors import ExecutionTimeout
 from routes.user import router as user_router
 from routes.products import router as product_router
 from routes.purchases import router as purchase_router
@@ -8,6 +11,16 @@ from routes.customer import router as customer_router
 from routes.debt import router as debt_router
 from routes.report import router as report_router
 from routes.expenditure import router as expenditure_router
+from routes.dashboard import router as dashboard_router
+from routes.inventory import router as inventory_router
+from routes.sync import router as sync_router
+from routes.admin import router as admin_router
+from utils.limits import LoadSheddingMiddleware
+from utils.profiling import ProfilingMiddleware
+from utils.reservations import sweep_expired_holds
+from utils.broker import relay_shared_events
+from database.budget import timeout_metrics
+from database.slowqueries import route_label
 
 
 app = FastAPI()
@@ -20,8 +33,41 @@ app.include_router(customer_router, tags=["Customers"])
 app.include_router(debt_router, tags=["Debts"])
 app.include_router(report_router, tags=["Reports"])
 app.include_router(expenditure_router, tags=["Expenditures"])
+app.include_router(dashboard_router, tags=["Dashboard"])
+app.include_router(inventory_router, tags=["Inventory"])
+app.include_router(sync_router, tags=["Sync"])
+app.include_router(admin_router, tags=["Admin"])
 
 
+# A query ran past the request's time budget (database/budget.py). No Retry-After:
+# the same request would most likely run out of time again, it needs narrowing down
+@app.exception_handler(ExecutionTimeout)
+async def time_budget_exceeded(request: Request, exc: ExecutionTimeout):
+    timeout_metrics.record(route_label(request.scope))
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The request took too long; narrow it down (e.g. a shorter date range) and retry"},
+    )
+
+
+# Give stock from expired reservations back to the shelf
+@app.on_event("startup")
+async def start_hold_sweeper():
+    app.state.hold_sweeper = asyncio.create_task(sweep_expired_holds())
+
+
+# Bring in the dashboard events published by the other workers
+@app.on_event("startup")
+async def start_dashboard_relay():
+    app.state.dashboard_relay = asyncio.create_task(relay_shared_events())
+
+
+# Opt-in request profiling (admin X-Profile: 1 or PROFILE_SAMPLE_RATE) and the route label for slow-query logs
+app.add_middleware(ProfilingMiddleware)
+
+# Per-client rate limiting and per-route-class concurrency lanes (checkout is never starved by reports)
+app.add_middleware(LoadSheddingMiddleware)
+
 #CORS configuration to allow from all origins
 app.add_middleware(
     CORSMiddleware,
@@ -39,7 +85,7 @@ async def root():
     return {"message": "Hello, this is shopygeinie backend!"}
 
 
-#running the server with reload
+#running the server with reload (development only, use server.py in production)
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8080, reload=True)
@@ -1,60 +1,92 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Dict, List, Literal, Optional, Set
 from datetime import datetime, timezone
 from database.config import sales_collection, products_collection, customers_collection, debts_collection
-from schema.sales import Sale, CreateSale, SaleItem
+from database.routing import money, reporting
+from schema.sales import (
+    Sale, CreateSale, SaleItem, SalesTimeSeries, TimeSeriesPoint,
+    BatchSale, SaleBatchResult, SaleBatchResponse,
+)
 from schema.debts import Debt
 from utils.idincrement import increment_id
+from utils.broker import get_broker
+from utils.valuation import apply_valuation_delta
+from utils.etag import bump_version
+from utils.inventory import movement, record_movements
+from utils.sync import next_change_version, next_change_versions
+from utils.archive import archived_documents, find_archived, reaches_archive, union_archive
+from utils.fields import FIELDS_DESCRIPTION, parse_fields, projection, sparse_response
+from utils.reservations import claim, undo_decrements
+from utils.related import record_baskets
+from utils.timebuckets import DEFAULT_SPANS, bucket_range, date_trunc_expression, to_naive_utc
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 from pymongo.collection import ReturnDocument
+from auth.auth import get_shop_id
 
 router = APIRouter()
 
+MAX_BATCH_SALES = 1000
+
 
 @router.post("/sale", response_model=Sale)
-async def create_sale(sale: CreateSale):
+async def create_sale(sale: CreateSale, shop_id: str = Depends(get_shop_id)):
     new_sale_id = increment_id(sales_collection)
 
     # Fetch customer
-    customer = customers_collection.find_one({"id": sale.customer_id})
+    customer = customers_collection.find_one({"shop_id": shop_id, "id": sale.customer_id})
     if not customer:
         raise HTTPException(status_code=404, detail=f"Customer with ID {sale.customer_id} not found")
 
     total_amount = 0.0
     updated_items = []
+    movements = []
 
-    # Loop through products
-    for item in sale.items:
-        product = products_collection.find_one({"id": item.product_id})
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Product with ID {item.product_id} not found")
-
-        # Stock check
-        current_stock = product.get("current_stock", 0)
-        if current_stock < item.quantity:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Not enough stock for product {product['name']}. "
-                       f"Available: {current_stock}, requested: {item.quantity}"
+    # Fetch all products in one query
+    product_ids = list({item.product_id for item in sale.items})
+    products = {p["id"]: p for p in products_collection.find({"shop_id": shop_id, "id": {"$in": product_ids}})}
+    missing = next((item.product_id for item in sale.items if item.product_id not in products), None)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Product with ID {missing} not found")
+
+    taken = []
+    if not sale.reservation_id:
+        # Conditional decrements: parallel checkouts of the same product can never oversell
+        # (a reserved sale's stock already left the shelf when it was reserved)
+        change_versions = next_change_versions(shop_id, "products", len(sale.items))
+        for item, change_version in zip(sale.items, change_versions):
+            updated = money(products_collection).find_one_and_update(
+                {"shop_id": shop_id, "id": item.product_id, "current_stock": {"$gte": item.quantity}},
+                {"$inc": {"current_stock": -item.quantity},
+                 "$set": {"updated_at": datetime.now(timezone.utc), "change_version": change_version}},
+                projection={"_id": 1},
             )
+            if not updated:
+                undo_decrements(shop_id, taken)
+                current = products_collection.find_one({"shop_id": shop_id, "id": item.product_id}, {"_id": 0, "current_stock": 1})
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Not enough stock for product {products[item.product_id]['name']}. "
+                           f"Available: {(current or {}).get('current_stock', 0)}, requested: {item.quantity}"
+                )
+            taken.append({"product_id": item.product_id, "quantity": item.quantity})
 
-        # Prices with discount
+    # Price each line (with discount) from the product snapshot
+    for item in sale.items:
+        product = products[item.product_id]
         selling_price = product["selling_price"]
         total_price = (selling_price - item.discount) * item.quantity
 
-        # Update stock
-        new_stock = current_stock - item.quantity
-        products_collection.update_one(
-            {"id": item.product_id},
-            {"$set": {"current_stock": new_stock, "updated_at": datetime.now(timezone.utc)}}
-        )
-
         updated_items.append(SaleItem(
             product_id=item.product_id,
             product_name=product["name"],
             quantity=item.quantity,
             selling_price=selling_price,
             discount=item.discount,
-            total_price=total_price
+            total_price=total_price,
+            category=product.get("category"),
+            cost_price=product.get("cost_price"),
+            total_cost=product.get("cost_price", 0) * item.quantity
         ).model_dump())
 
         total_amount += total_price
@@ -62,25 +94,59 @@ async def create_sale(sale: CreateSale):
     # Final Sale Document
     sale_dict = {
         "id": new_sale_id,
+        "shop_id": shop_id,
         "customer_id": sale.customer_id,
         "customer_name": customer["name"],
         "items": updated_items,
         "payment_method": sale.payment_method,
         "total_amount": total_amount,
-        "created_at": datetime.now(timezone.utc)
+        "created_at": datetime.now(timezone.utc),
+        "reservation_id": sale.reservation_id
     }
 
-    # Save sale
-    sales_collection.insert_one(sale_dict)
+    # Save sale; until it is stored nothing refers to the stock taken above, so a failed insert gives it back
+    try:
+        money(sales_collection).insert_one(sale_dict)
+    except Exception:
+        undo_decrements(shop_id, taken)
+        raise
+
+    if sale.reservation_id:
+        # Confirm the hold only once the sale exists; a hold that expired or was used meanwhile voids the sale
+        requested = {}
+        for item in sale.items:
+            requested[item.product_id] = requested.get(item.product_id, 0) + item.quantity
+        try:
+            claim(shop_id, sale.reservation_id, requested, new_sale_id)
+        except HTTPException:
+            money(sales_collection).delete_one({"shop_id": shop_id, "id": new_sale_id})
+            raise
+    else:
+        for item in sale.items:
+            product = products[item.product_id]
+            apply_valuation_delta(shop_id, product.get("category"), -item.quantity * product.get("cost_price", 0))
+            movements.append(movement(shop_id, item.product_id, "sale", -item.quantity, reference_id=new_sale_id))
+
+    record_movements(movements)
+    bump_version(shop_id, "products")
+    record_baskets(shop_id, [[item.product_id for item in sale.items]])
 
     # Handle Debt if payment_method = debt
     if sale.payment_method == "debt":
         new_debt_id = increment_id(debts_collection)
-        previous_balance = customer.get("balance", 0.0)
-        new_balance = previous_balance + total_amount
+
+        # Update customer balance (relative, so concurrent payments and sales are not overwritten)
+        updated_customer = money(customers_collection).find_one_and_update(
+            {"shop_id": shop_id, "id": sale.customer_id},
+            {"$inc": {"balance": total_amount}, "$set": {"change_version": next_change_version(shop_id, "customers")}},
+            projection={"_id": 0, "balance": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        new_balance = (updated_customer or {}).get("balance", customer.get("balance", 0.0) + total_amount)
 
         debt_dict = {
             "id": new_debt_id,
+            "shop_id": shop_id,
             "customer_name": customer["name"],
             "sale_id": new_sale_id,
             "amount": total_amount,
@@ -90,28 +156,353 @@ async def create_sale(sale: CreateSale):
             "created_at": datetime.now(timezone.utc)
         }
 
-        debts_collection.insert_one(debt_dict)
+        money(debts_collection).insert_one(debt_dict)
+        bump_version(shop_id, "customers")
 
-        # Update customer balance
-        customers_collection.update_one(
-            {"id": sale.customer_id},
-            {"$set": {"balance": new_balance}}
-        )
+    get_broker(shop_id).publish("sale", {"sale_id": new_sale_id, "amount": total_amount, "payment_method": sale.payment_method})
 
     return Sale(**sale_dict)
 
 
+def _take_stock(shop_id: str, sold: Dict[str, int]) -> Set[str]:
+    """
+    Decrement the stock of every product, each only if enough is left.
+
+    Returns:
+        set: Products that ran short; empty when every decrement applied.
+        Nothing is taken when any product runs short.
+    """
+    taken, short = [], set()
+    now = datetime.now(timezone.utc)
+    change_versions = next_change_versions(shop_id, "products", len(sold))
+    for (product_id, quantity), change_version in zip(sold.items(), change_versions):
+        updated = money(products_collection).find_one_and_update(
+            {"shop_id": shop_id, "id": product_id, "current_stock": {"$gte": quantity}},
+            {"$inc": {"current_stock": -quantity}, "$set": {"updated_at": now, "change_version": change_version}},
+            projection={"_id": 1},
+        )
+        if updated:
+            taken.append({"product_id": product_id, "quantity": quantity})
+        else:
+            short.add(product_id)
+    if short:
+        undo_decrements(shop_id, taken)
+    return short
+
+
+# Upload of sales queued offline by a terminal: validated together, written with bulk writes
+@router.post("/sales/batch", response_model=SaleBatchResponse)
+async def create_sales_batch(sales: List[BatchSale], shop_id: str = Depends(get_shop_id)):
+    if not sales:
+        raise HTTPException(status_code=400, detail="No sales to upload")
+    if len(sales) > MAX_BATCH_SALES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SALES} sales per batch")
+
+    now = datetime.now(timezone.utc)
+    customer_ids = list({sale.customer_id for sale in sales})
+    product_ids = list({item.product_id for sale in sales for item in sale.items})
+    client_refs = list({sale.client_ref for sale in sales if sale.client_ref})
+
+    # One query per collection instead of one per sale and line item
+    customers = {c["id"]: c for c in customers_collection.find({"shop_id": shop_id, "id": {"$in": customer_ids}})}
+    products = {p["id"]: p for p in products_collection.find({"shop_id": shop_id, "id": {"$in": product_ids}})}
+    already_synced = {
+        doc["client_ref"]: doc["id"]
+        for doc in sales_collection.find(
+            {"shop_id": shop_id, "client_ref": {"$in": client_refs}}, {"_id": 0, "id": 1, "client_ref": 1}
+        )
+    } if client_refs else {}
+
+    # Running stock, so each sale sees what the ones before it left
+    stock = {product_id: product.get("current_stock", 0) for product_id, product in products.items()}
+
+    results: List[SaleBatchResult] = []
+    accepted = []  # (result, requested quantities, sale document without its id yet)
+    batch_refs: Dict[str, SaleBatchResult] = {}
+    repeats = []  # (result, result of the earlier sale in this batch with the same client_ref)
+    for index, sale in enumerate(sales):
+        result = SaleBatchResult(index=index, client_ref=sale.client_ref, status="failed")
+        results.append(result)
+
+        if sale.client_ref and sale.client_ref in already_synced:
+            result.status = "duplicate"
+            result.sale_id = already_synced[sale.client_ref]
+            continue
+        if sale.client_ref and sale.client_ref in batch_refs:
+            repeats.append((result, batch_refs[sale.client_ref]))
+            continue
+
+        if sale.reservation_id:
+            result.detail = "Reserved sales must be confirmed with POST /sale"
+            continue
+
+        customer = customers.get(sale.customer_id)
+        if not customer:
+            result.detail = f"Customer with ID {sale.customer_id} not found"
+            continue
+
+        requested: Dict[str, int] = {}
+        for item in sale.items:
+            requested[item.product_id] = requested.get(item.product_id, 0) + item.quantity
+        missing = next((product_id for product_id in requested if product_id not in products), None)
+        if missing:
+            result.detail = f"Product with ID {missing} not found"
+            continue
+        short = next((product_id for product_id, quantity in requested.items() if stock[product_id] < quantity), None)
+        if short:
+            result.detail = (f"Not enough stock for product {products[short]['name']}. "
+                             f"Available: {stock[short]}, requested: {requested[short]}")
+            continue
+
+        total_amount = 0.0
+        items = []
+        for item in sale.items:
+            product = products[item.product_id]
+            selling_price = product["selling_price"]
+            total_price = (selling_price - item.discount) * item.quantity
+            items.append(SaleItem(
+                product_id=item.product_id,
+                product_name=product["name"],
+                quantity=item.quantity,
+                selling_price=selling_price,
+                discount=item.discount,
+                total_price=total_price,
+                category=product.get("category"),
+                cost_price=product.get("cost_price"),
+                total_cost=product.get("cost_price", 0) * item.quantity
+            ).model_dump())
+            total_amount += total_price
+        for product_id, quantity in requested.items():
+            stock[product_id] -= quantity
+
+        # Terminal clocks are trusted for the sale time, but never into the future
+        created_at = sale.created_at or now
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        created_at = min(created_at, now)
+
+        doc = {
+            "shop_id": shop_id,
+            "customer_id": sale.customer_id,
+            "customer_name": customer["name"],
+            "items": items,
+            "payment_method": sale.payment_method,
+            "total_amount": total_amount,
+            "created_at": created_at,
+        }
+        if sale.client_ref:
+            doc["client_ref"] = sale.client_ref  # left out otherwise, so the unique index skips it
+            batch_refs[sale.client_ref] = result
+        accepted.append((result, requested, doc))
+
+    # Same conditional decrement as POST /sale, once per product: another checkout may have
+    # sold the stock since it was read. Sales needing a product that ran short fail and the
+    # rest is tried again.
+    while accepted:
+        sold: Dict[str, int] = {}
+        for _, requested, _ in accepted:
+            for product_id, quantity in requested.items():
+                sold[product_id] = sold.get(product_id, 0) + quantity
+        short = _take_stock(shop_id, sold)
+        if not short:
+            break
+        remaining = []
+        for entry in accepted:
+            result, requested, _ = entry
+            ran_short = sorted(requested.keys() & short)
+            if ran_short:
+                result.detail = f"Not enough stock for product {products[ran_short[0]]['name']}"
+            else:
+                remaining.append(entry)
+        accepted = remaining
+
+    inserted = []
+    if accepted:
+        first_sale_id = int(increment_id(sales_collection, count=len(accepted)))
+        for offset, (_, _, doc) in enumerate(accepted):
+            doc["id"] = str(first_sale_id + offset)
+
+        # The unique client_ref index settles uploads racing each other: the loser is a duplicate
+        duplicates = set()
+        try:
+            money(sales_collection).insert_many([doc for _, _, doc in accepted], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error["code"] != 11000 for error in errors):
+                raise
+            duplicates = {error["index"] for error in errors}
+        if duplicates:
+            refs = [accepted[i][2]["client_ref"] for i in duplicates]
+            existing = {doc["client_ref"]: doc["id"] for doc in sales_collection.find(
+                {"shop_id": shop_id, "client_ref": {"$in": refs}}, {"_id": 0, "id": 1, "client_ref": 1}
+            )}
+            undo_decrements(shop_id, [
+                {"product_id": product_id, "quantity": quantity}
+                for i in duplicates for product_id, quantity in accepted[i][1].items()
+            ])
+            for i in duplicates:
+                accepted[i][0].status = "duplicate"
+                accepted[i][0].sale_id = existing.get(accepted[i][2]["client_ref"])
+        inserted = [entry for i, entry in enumerate(accepted) if i not in duplicates]
+
+    movements = []
+    valuation_deltas: Dict[Optional[str], float] = {}
+    for result, requested, doc in inserted:
+        result.status = "created"
+        result.sale_id = doc["id"]
+        for product_id, quantity in requested.items():
+            movements.append(movement(shop_id, product_id, "sale", -quantity, reference_id=doc["id"]))
+            category = products[product_id].get("category")
+            valuation_deltas[category] = valuation_deltas.get(category, 0.0) - quantity * products[product_id].get("cost_price", 0)
+    if inserted:
+        for category, delta in valuation_deltas.items():
+            apply_valuation_delta(shop_id, category, delta)
+        record_movements(movements)
+        bump_version(shop_id, "products")
+        record_baskets(shop_id, [[item["product_id"] for item in doc["items"]] for _, _, doc in inserted])
+
+    debt_sales = [doc for _, _, doc in inserted if doc["payment_method"] == "debt"]
+    if debt_sales:
+        balances = {customer_id: customer.get("balance", 0.0) for customer_id, customer in customers.items()}
+        balance_changes: Dict[str, float] = {}
+        first_debt_id = int(increment_id(debts_collection, count=len(debt_sales)))
+        debt_docs = []
+        for offset, doc in enumerate(debt_sales):
+            balances[doc["customer_id"]] += doc["total_amount"]
+            balance_changes[doc["customer_id"]] = balance_changes.get(doc["customer_id"], 0.0) + doc["total_amount"]
+            debt_docs.append({
+                "id": str(first_debt_id + offset),
+                "shop_id": shop_id,
+                "customer_name": doc["customer_name"],
+                "sale_id": doc["id"],
+                "amount": doc["total_amount"],
+                "cleared": False,
+                "balance": balances[doc["customer_id"]],
+                "payment": [],
+                "created_at": doc["created_at"]
+            })
+        money(debts_collection).insert_many(debt_docs, ordered=False)
+        change_versions = next_change_versions(shop_id, "customers", len(balance_changes))
+        money(customers_collection).bulk_write([
+            UpdateOne(
+                {"shop_id": shop_id, "id": customer_id},
+                {"$inc": {"balance": amount}, "$set": {"change_version": change_version}}
+            )
+            for (customer_id, amount), change_version in zip(balance_changes.items(), change_versions)
+        ], ordered=False)
+        bump_version(shop_id, "customers")
+
+    for result, original in repeats:
+        result.status = "duplicate" if original.status == "created" else original.status
+        result.sale_id = original.sale_id
+        result.detail = original.detail
+
+    # Only sales rung up today belong on the live dashboard
+    broker = get_broker(shop_id)
+    for _, _, doc in inserted:
+        if doc["created_at"].date() == now.date():
+            broker.publish("sale", {"sale_id": doc["id"], "amount": doc["total_amount"], "payment_method": doc["payment_method"]})
+
+    return SaleBatchResponse(
+        created=sum(result.status == "created" for result in results),
+        duplicates=sum(result.status == "duplicate" for result in results),
+        failed=sum(result.status == "failed" for result in results),
+        results=results,
+    )
+
+
+# Get all sales. Plain def like the other read-heavy handlers: FastAPI runs it on the
+# threadpool, so its blocking pymongo reads don't hold up checkouts on the event loop
 @router.get("/sales", response_model=List[Sale])
-async def get_all_sales():
-    sales = list(sales_collection.find({}, {"_id": 0}))
+def get_all_sales(
+    include_archived: bool = False,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    shop_id: str = Depends(get_shop_id),
+):
+    selected = parse_fields(fields, Sale)
+    sales = list(reporting(sales_collection).find({"shop_id": shop_id}, projection(selected)))
+    if include_archived:
+        sales += archived_documents("sales", shop_id, projection(selected))
     if not sales:
         raise HTTPException(status_code=404, detail="No sales found")
+    if selected:
+        return sparse_response(Sale, sales, selected)
     return [Sale(**sale) for sale in sales]
 
 
+# Revenue per hour/day/week/month, bucketed in Mongo and zero-filled here
+@router.get("/sales/timeseries", response_model=SalesTimeSeries)
+def get_sales_timeseries(
+    granularity: Literal["hour", "day", "week", "month"] = "day",
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    product_id: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    payment_method: Optional[Literal["cash", "debt"]] = Query(None),
+    shop_id: str = Depends(get_shop_id),
+):
+    end = to_naive_utc(end_date or datetime.now(timezone.utc))
+    start = to_naive_utc(start_date) if start_date else end - DEFAULT_SPANS[granularity]
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start_date must be before end_date")
+
+    try:
+        buckets = bucket_range(start, end, granularity)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    match = {"shop_id": shop_id, "created_at": {"$gte": start, "$lt": end}}
+    if customer_id:
+        match["customer_id"] = customer_id
+    if payment_method:
+        match["payment_method"] = payment_method
+
+    bucket = date_trunc_expression("$created_at", granularity)
+    if product_id:
+        match["items.product_id"] = product_id
+    # Windows reaching back past the archive cut-off read the archived sales as well
+    pipeline = [{"$match": match}]
+    if reaches_archive("sales", shop_id, start):
+        pipeline.append(union_archive("sales", [{"$match": match}]))
+
+    if product_id:
+        # Only the matching line items count towards revenue and units
+        pipeline += [
+            {"$unwind": "$items"},
+            {"$match": {"items.product_id": product_id}},
+            {"$group": {
+                "_id": bucket,
+                "revenue": {"$sum": "$items.total_price"},
+                "sales_count": {"$sum": 1},
+                "units_sold": {"$sum": "$items.quantity"},
+            }},
+        ]
+    else:
+        pipeline += [
+            {"$group": {
+                "_id": bucket,
+                "revenue": {"$sum": "$total_amount"},
+                "sales_count": {"$sum": 1},
+                "units_sold": {"$sum": {"$sum": "$items.quantity"}},
+            }},
+        ]
+
+    rows = {row["_id"]: row for row in reporting(sales_collection).aggregate(pipeline)}
+    points = [
+        TimeSeriesPoint(
+            bucket=b,
+            revenue=rows[b]["revenue"] if b in rows else 0.0,
+            sales_count=rows[b]["sales_count"] if b in rows else 0,
+            units_sold=rows[b]["units_sold"] if b in rows else 0,
+        )
+        for b in buckets
+    ]
+    return SalesTimeSeries(granularity=granularity, start=start, end=end, points=points)
+
+
 @router.get("/sales/{sale_id}", response_model=Sale)
-async def get_sale_by_id(sale_id: str):
-    sale = sales_collection.find_one({"id": sale_id}, {"_id": 0})
+async def get_sale_by_id(sale_id: str, shop_id: str = Depends(get_shop_id)):
+    sale = sales_collection.find_one({"shop_id": shop_id, "id": sale_id}, {"_id": 0}) or find_archived("sales", shop_id, sale_id)
     if not sale:
         raise HTTPException(status_code=404, detail="Sale not found")
     return Sale(**sale)
@@ -0,0 +1,58 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+from database.config import profiles_collection, slow_queries_collection
+from database.budget import timeout_metrics
+from utils.profiling import collapsed
+from auth.auth import require_admin
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+# Recent request profiles (without their stacks)
+@router.get("/admin/profiles")
+async def list_profiles(route: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
+    query = {"route": route} if route else {}
+    return list(profiles_collection.find(query, {"_id": 0, "stacks": 0, "functions": 0}).sort("created_at", -1).limit(limit))
+
+
+# One profile: top functions and sampled stacks
+@router.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    profile = profiles_collection.find_one({"id": profile_id}, {"_id": 0})
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+
+# Download in collapsed-stack format (flamegraph.pl, speedscope)
+@router.get("/admin/profiles/{profile_id}/collapsed", response_class=PlainTextResponse)
+async def download_profile(profile_id: str):
+    profile = profiles_collection.find_one({"id": profile_id}, {"_id": 0, "stacks": 1})
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(
+        collapsed(profile),
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"'},
+    )
+
+
+# Slowest recent Mongo commands, with their plans
+@router.get("/admin/slow-queries")
+async def list_slow_queries(
+    route: Optional[str] = None,
+    collection: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+):
+    query = {}
+    if route:
+        query["route"] = route
+    if collection:
+        query["collection"] = collection
+    return list(slow_queries_collection.find(query, {"_id": 0}).sort("created_at", -1).limit(limit))
+
+
+# Requests that ran out of their time budget, per route (this worker only)
+@router.get("/admin/timeouts")
+async def get_timeout_metrics():
+    return timeout_metrics.snapshot()
@@ -1,60 +1,237 @@
-from fastapi import APIRouter, Depends, HTTPException
-from database.config import customers_collection
-from schema.customers import Customer
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from database.config import customers_collection, sales_collection, debts_collection
+from database.routing import reporting
+from schema.customers import Customer, CustomerStatement, StatementEntry
+from typing import List, Optional, Tuple
 from utils.idincrement import increment_id
+from utils.etag import bump_version, conditional_list_response
+from utils.search import record_search_write, search, search_keys
+from utils.sync import next_change_version, record_tombstone
+from utils.fields import FIELDS_DESCRIPTION, parse_fields, projection, validate_list
+from utils.cursor import encode_cursor, decode_cursor
+from utils.archive import reaches_archive, union_archive
+from auth.auth import get_shop_id
 
 router = APIRouter()
 
 # Create a new customer
 @router.post("/customer", response_model=Customer)
-async def create_customer(customer: Customer):
-    if customers_collection.find_one({"name": customer.name}):
+async def create_customer(customer: Customer, shop_id: str = Depends(get_shop_id)):
+    if customers_collection.find_one({"shop_id": shop_id, "name": customer.name}):
         raise HTTPException(status_code=400, detail="Customer with this email already exists")
 
     new_customer_id = increment_id(customers_collection)
     customer_dict = customer.model_dump()
     customer_dict["id"] = new_customer_id
+    customer_dict["shop_id"] = shop_id
+    customer_dict["change_version"] = next_change_version(shop_id, "customers")
+    customer_dict.update(search_keys("customers", customer_dict))
 
     customers_collection.insert_one(customer_dict)
+    bump_version(shop_id, "customers")
+    record_search_write(shop_id, "customers", doc=customer_dict)
     return Customer(**customer_dict)
 
-# Get all customers
-@router.get("/customers", response_model=List[Customer])
-async def get_all_customers():
-    customers = list(customers_collection.find({}, {"_id": 0}))
+
+def load_all_customers(shop_id: str, fields: Optional[Tuple[str, ...]] = None):
+    customers = list(customers_collection.find({"shop_id": shop_id}, projection(fields)))
     if not customers:
         raise HTTPException(status_code=404, detail="No customers found")
-    return [Customer(**customer) for customer in customers]
+    return validate_list(Customer, customers, fields)
+
+
+# Get all customers (supports If-None-Match)
+@router.get("/customers", response_model=List[Customer])
+async def get_all_customers(
+    request: Request,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    shop_id: str = Depends(get_shop_id),
+):
+    selected = parse_fields(fields, Customer)
+    return conditional_list_response(
+        request, shop_id, "customers", lambda: load_all_customers(shop_id, selected), variant="+".join(selected or ())
+    )
+
+
+# Typeahead: prefix / typo-tolerant match on name and phone
+@router.get("/customers/search")
+async def search_customers(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    fuzzy: bool = True,
+    shop_id: str = Depends(get_shop_id),
+):
+    return search(shop_id, "customers", q, limit, fuzzy)
+
 
 # Get customer by ID
 @router.get("/customers/{customer_id}", response_model=Customer)
-async def get_customer_by_id(customer_id: str):
-    customer = customers_collection.find_one({"id": customer_id}, {"_id": 0})
+async def get_customer_by_id(customer_id: str, shop_id: str = Depends(get_shop_id)):
+    customer = customers_collection.find_one({"shop_id": shop_id, "id": customer_id}, {"_id": 0})
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     return Customer(**customer)
 
 # Update customer
 @router.put("/customers/{customer_id}", response_model=Customer)
-async def update_customer(customer_id: str, customer: Customer):
+async def update_customer(customer_id: str, customer: Customer, shop_id: str = Depends(get_shop_id)):
     update_data = customer.model_dump(exclude_unset=True)
+    update_data.pop("shop_id", None)  # customers cannot move between shops
+    update_data["change_version"] = next_change_version(shop_id, "customers")
+    update_data.update(search_keys("customers", update_data))
 
     updated_customer = customers_collection.find_one_and_update(
-        {"id": customer_id},
+        {"shop_id": shop_id, "id": customer_id},
         {"$set": update_data},
         return_document=True,
         projection={"_id": 0}
     )
     if not updated_customer:
         raise HTTPException(status_code=404, detail="Customer not found")
+    bump_version(shop_id, "customers")
+    record_search_write(shop_id, "customers", doc=updated_customer)
     return Customer(**updated_customer)
 
 # Delete customer
 @router.delete("/customers/{customer_id}")
-async def delete_customer(customer_id: str):
-    result = customers_collection.delete_one({"id": customer_id})
+async def delete_customer(customer_id: str, shop_id: str = Depends(get_shop_id)):
+    result = customers_collection.delete_one({"shop_id": shop_id, "id": customer_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Customer not found")
+    record_tombstone(shop_id, "customers", customer_id)
+    bump_version(shop_id, "customers")
+    record_search_write(shop_id, "customers", removed_id=customer_id)
     return {"detail": "Customer deleted successfully"}
 
+
+def statement_pipeline(shop_id: str, customer: dict, since: Optional[dict], limit: int,
+                       archived: Tuple[str, ...] = ()) -> List[dict]:
+    """
+    Sales, debts and debt payments of one customer as one chronological stream.
+
+    Every branch starts with an indexed match on (shop_id, customer, date) and
+    is cut to one page after the cursor before it is merged, so the union never
+    holds more than a page per branch. `seq` breaks ties between entries with
+    the same timestamp (sale, then debt, then payment). Branches named in
+    `archived` ("sales", "debts", "payments") also read the archive collection.
+    """
+    after = {"$gte": since["date"]} if since else {"$exists": True}
+    page = [
+        # Keyset: strictly after the last entry of the previous page
+        *([{"$match": {"$or": [
+            {"date": {"$gt": since["date"]}},
+            {"date": since["date"], "seq": {"$gt": since["seq"]}},
+        ]}}] if since else []),
+        {"$sort": {"date": 1, "seq": 1}},
+        {"$limit": limit + 1},
+    ]
+    sales = [
+        {"$match": {"shop_id": shop_id, "customer_id": customer["id"], "created_at": after}},
+        {"$project": {
+            "_id": 0,
+            "date": "$created_at",
+            "type": "sale",
+            "reference_id": "$id",
+            "seq": {"$concat": ["0:", "$id"]},
+            "description": {"$concat": ["Sale #", "$id", " (", {"$ifNull": ["$payment_method", "unknown"]}, ")"]},
+            "amount": "$total_amount",
+            "balance_change": {"$literal": 0.0},
+        }},
+        *page,
+    ]
+    debts = [
+        {"$match": {"shop_id": shop_id, "customer_name": customer["name"], "created_at": after}},
+        {"$project": {
+            "_id": 0,
+            "date": "$created_at",
+            "type": "debt",
+            "reference_id": "$id",
+            "seq": {"$concat": ["1:", "$id"]},
+            "description": {"$concat": ["Debt #", "$id", " for sale #", "$sale_id"]},
+            "amount": "$amount",
+            "balance_change": "$amount",
+        }},
+        *page,
+    ]
+    payments = [
+        {"$match": {"shop_id": shop_id, "customer_name": customer["name"], "payment.date": after}},
+        {"$unwind": {"path": "$payment", "includeArrayIndex": "payment_index"}},
+        {"$match": {"payment.date": after}},
+        {"$project": {
+            "_id": 0,
+            "date": "$payment.date",
+            "type": "payment",
+            "reference_id": {"$concat": ["$id", ":", {"$toString": "$payment_index"}]},
+            "seq": {"$concat": ["2:", "$id", ":", {"$toString": "$payment_index"}]},
+            "description": {"$concat": ["Payment on debt #", "$id", " (", {"$ifNull": ["$payment.method", "unknown"]}, ")"]},
+            "amount": "$payment.amount",
+            "balance_change": {"$multiply": [-1, "$payment.amount"]},
+        }},
+        *page,
+    ]
+    return [
+        *sales,
+        *([union_archive("sales", sales)] if "sales" in archived else []),
+        {"$unionWith": {"coll": debts_collection.name, "pipeline": debts}},
+        *([union_archive("debts", debts)] if "debts" in archived else []),
+        {"$unionWith": {"coll": debts_collection.name, "pipeline": payments}},
+        *([union_archive("debts", payments)] if "payments" in archived else []),
+        {"$sort": {"date": 1, "seq": 1}},
+        {"$limit": limit + 1},
+    ]
+
+
+# Chronological statement of sales, debts and payments with a running balance
+@router.get("/customers/{customer_id}/statement", response_model=CustomerStatement)
+def get_customer_statement(
+    customer_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    shop_id: str = Depends(get_shop_id),
+):
+    customer = customers_collection.find_one({"shop_id": shop_id, "id": customer_id}, {"_id": 0})
+    if not customer:
+        raise HTTPException(status_code=404, detail="Customer not found")
+
+    since = None
+    if cursor:
+        try:
+            since = decode_cursor(cursor, datetime_fields=("date",))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if since.get("customer") != customer_id:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # The (signed) cursor carries the running balance, so later pages never re-read earlier entries
+    opening_balance = since["balance"] if since else 0.0
+    # Archived months are only read when the page can reach them. Payments are dated after
+    # their debt, so any archived debt may hold a payment inside the page.
+    start = since["date"] if since else None
+    archived = tuple(branch for branch, reaches in (
+        ("sales", reaches_archive("sales", shop_id, start)),
+        ("debts", reaches_archive("debts", shop_id, start)),
+        ("payments", reaches_archive("debts", shop_id, None)),
+    ) if reaches)
+    rows = list(reporting(sales_collection).aggregate(statement_pipeline(shop_id, customer, since, limit, archived)))
+
+    balance = opening_balance
+    entries = []
+    for row in rows[:limit]:
+        balance += row["balance_change"]
+        entries.append(StatementEntry(balance=balance, **row))
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor({
+            "customer": customer_id, "date": last["date"].isoformat(), "seq": last["seq"], "balance": balance,
+        })
+
+    return CustomerStatement(
+        customer_id=customer_id,
+        customer_name=customer["name"],
+        opening_balance=opening_balance,
+        closing_balance=balance,
+        entries=entries,
+        next_cursor=next_cursor,
+    )
@@ -0,0 +1,92 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime
+from typing import Dict, Optional
+from database.config import sales_collection, purchases_collection, debts_collection, expenditures_collection
+from utils.broker import REFRESH_SECONDS, DashboardBroker, get_broker
+from auth.auth import shop_from_token
+
+router = APIRouter()
+
+
+def _sum(collection, match: Dict, field: str) -> float:
+    result = list(collection.aggregate([
+        {"$match": match},
+        {"$group": {"_id": None, "total": {"$sum": field}}},
+    ]))
+    return float(result[0]["total"]) if result else 0.0
+
+
+def load_today_totals(shop_id: str, start_of_day: datetime) -> Dict[str, float]:
+    """Today's totals for a shop's broker, across every worker (reloaded every REFRESH_SECONDS)."""
+    since = {"shop_id": shop_id, "created_at": {"$gte": start_of_day}}
+
+    sales = list(sales_collection.aggregate([
+        {"$match": since},
+        {"$group": {"_id": "$payment_method", "total": {"$sum": "$total_amount"}, "count": {"$sum": 1}}},
+    ]))
+    by_method = {row["_id"]: row for row in sales}
+
+    return {
+        "sales_total": float(sum(row["total"] for row in sales)),
+        "sales_count": sum(row["count"] for row in sales),
+        "cash_sales_total": float(by_method.get("cash", {}).get("total", 0.0)),
+        "debt_sales_total": float(by_method.get("debt", {}).get("total", 0.0)),
+        "purchases_total": _sum(purchases_collection, since, "$total_amount"),
+        "debt_payments_total": float(next(debts_collection.aggregate([
+            {"$match": {"shop_id": shop_id, "payment.date": {"$gte": start_of_day}}},
+            {"$unwind": "$payment"},
+            {"$match": {"payment.date": {"$gte": start_of_day}}},
+            {"$group": {"_id": None, "total": {"$sum": "$payment.amount"}}},
+        ]), {}).get("total", 0.0)),
+        "expenditures_total": _sum(expenditures_collection, since, "$amount"),
+    }
+
+
+async def refresh(broker: DashboardBroker, shop_id: str) -> bool:
+    """Reload the broker's totals when they are due, off the event loop; True when they changed."""
+    if not broker.needs_reload():
+        return False
+    return await run_in_threadpool(broker.reload, lambda start_of_day: load_today_totals(shop_id, start_of_day))
+
+
+# Live dashboard: one snapshot on connect, then coalesced updates as events arrive.
+# Browsers cannot set headers on WebSockets, so the token comes as ?token=...
+@router.websocket("/ws/dashboard")
+async def dashboard_ws(websocket: WebSocket, token: Optional[str] = None):
+    try:
+        shop_id = shop_from_token(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    broker = get_broker(shop_id)
+    await refresh(broker, shop_id)
+    subscriber = broker.subscribe()
+    # Clients don't send anything, but reading is how a disconnect is noticed
+    # while no events arrive
+    receiving = asyncio.ensure_future(websocket.receive())
+    batching = asyncio.ensure_future(subscriber.next_batch())
+    try:
+        await websocket.send_json(broker.snapshot())
+        while True:
+            await asyncio.wait({receiving, batching}, timeout=REFRESH_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+            if receiving.done():
+                if receiving.result()["type"] == "websocket.disconnect":
+                    break
+                receiving = asyncio.ensure_future(websocket.receive())
+            events = []
+            if batching.done():
+                events = batching.result()
+                batching = asyncio.ensure_future(subscriber.next_batch())
+            # Also picks up what other workers recorded since the last reload
+            if await refresh(broker, shop_id) or events:
+                await websocket.send_json(broker.snapshot(events))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiving.cancel()
+        batching.cancel()
+        broker.unsubscribe(subscriber)
@@ -1,27 +1,119 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import List, Optional
+import uuid
 from datetime import datetime, timezone
+from pymongo import UpdateOne
 from pymongo.collection import ReturnDocument
 from database.config import debts_collection, customers_collection
-from schema.debts import Debt, DebtPayment
+from database.routing import money, reporting
+from schema.debts import (
+    Debt, DebtPayment, DebtAgingReport, AgingBucket, AgingDebtor,
+    CustomerPaymentRequest, CustomerPaymentResult, PaymentAllocation,
+)
 from utils.idincrement import increment_id
+from utils.broker import get_broker
+from utils.etag import bump_version
+from utils.sync import next_change_version
+from utils.archive import archived_documents, find_archived
+from utils.fields import FIELDS_DESCRIPTION, parse_fields, projection, sparse_response
+from auth.auth import get_shop_id
 
 router = APIRouter()
 
 
 # Get all debts
 @router.get("/debts", response_model=List[Debt])
-async def get_all_debts():
-    debts = list(debts_collection.find({}, {"_id": 0}))
+def get_all_debts(
+    include_archived: bool = False,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    shop_id: str = Depends(get_shop_id),
+):
+    selected = parse_fields(fields, Debt)
+    debts = list(reporting(debts_collection).find({"shop_id": shop_id}, projection(selected)))
+    if include_archived:
+        debts += archived_documents("debts", shop_id, projection(selected))
     if not debts:
         raise HTTPException(status_code=404, detail="No debts found")
+    if selected:
+        return sparse_response(Debt, debts, selected)
     return [Debt(**debt) for debt in debts]
 
 
+AGING_BUCKETS = ["0-30", "31-60", "61-90", "90+"]
+
+
+# Outstanding balances by age (0-30 / 31-60 / 61-90 / 90+ days) with the top debtors per bucket
+@router.get("/debts/aging", response_model=DebtAgingReport)
+def get_debt_aging(top: int = Query(10, ge=1, le=100), shop_id: str = Depends(get_shop_id)):
+    now = datetime.now(timezone.utc)
+    age_days = {"$floor": {"$divide": [{"$subtract": [now, "$created_at"]}, 86400000]}}
+
+    pipeline = [
+        # served by the (shop_id, cleared, created_at) index
+        {"$match": {"shop_id": shop_id, "cleared": False}},
+        {"$project": {
+            "_id": 0,
+            "customer_name": 1,
+            # what is still owed on this debt: amount minus its payments
+            "outstanding": {"$subtract": ["$amount", {"$sum": "$payment.amount"}]},
+            "bucket": {"$switch": {
+                "branches": [
+                    {"case": {"$lte": [age_days, 30]}, "then": "0-30"},
+                    {"case": {"$lte": [age_days, 60]}, "then": "31-60"},
+                    {"case": {"$lte": [age_days, 90]}, "then": "61-90"},
+                ],
+                "default": "90+",
+            }},
+        }},
+        {"$match": {"outstanding": {"$gt": 0}}},
+        {"$facet": {
+            "totals": [
+                {"$group": {"_id": "$bucket", "total": {"$sum": "$outstanding"}, "count": {"$sum": 1}}},
+            ],
+            "debtors": [
+                {"$group": {
+                    "_id": {"bucket": "$bucket", "customer_name": "$customer_name"},
+                    "outstanding": {"$sum": "$outstanding"},
+                    "debt_count": {"$sum": 1},
+                }},
+                # Keep only the top debtors while grouping ($topN, MongoDB 5.2+): pushing every
+                # debtor and slicing afterwards could outgrow the 16 MB facet document
+                {"$group": {"_id": "$_id.bucket", "debtors": {"$topN": {
+                    "n": top,
+                    "sortBy": {"outstanding": -1},
+                    "output": {
+                        "customer_name": "$_id.customer_name",
+                        "outstanding": "$outstanding",
+                        "debt_count": "$debt_count",
+                    },
+                }}}},
+            ],
+        }},
+    ]
+    result = next(reporting(debts_collection).aggregate(pipeline, allowDiskUse=True), {"totals": [], "debtors": []})
+
+    totals = {row["_id"]: row for row in result["totals"]}
+    debtors = {row["_id"]: row["debtors"] for row in result["debtors"]}
+    buckets = [
+        AgingBucket(
+            label=label,
+            total_outstanding=totals.get(label, {}).get("total", 0.0),
+            debt_count=totals.get(label, {}).get("count", 0),
+            top_debtors=[AgingDebtor(**debtor) for debtor in debtors.get(label, [])],
+        )
+        for label in AGING_BUCKETS
+    ]
+    return DebtAgingReport(
+        as_of=now,
+        total_outstanding=sum(bucket.total_outstanding for bucket in buckets),
+        buckets=buckets,
+    )
+
+
 # Get debt by ID
 @router.get("/debts/{debt_id}", response_model=Debt)
-async def get_debt_by_id(debt_id: str):
-    debt = debts_collection.find_one({"id": debt_id}, {"_id": 0})
+async def get_debt_by_id(debt_id: str, shop_id: str = Depends(get_shop_id)):
+    debt = debts_collection.find_one({"shop_id": shop_id, "id": debt_id}, {"_id": 0}) or find_archived("debts", shop_id, debt_id)
     if not debt:
         raise HTTPException(status_code=404, detail="Debt not found")
     return Debt(**debt)
@@ -29,11 +121,11 @@ async def get_debt_by_id(debt_id: str):
 
 # Get debts by customer
 @router.get("/debts/customer/{customer_id}", response_model=List[Debt])
-async def get_debts_by_customer(customer_id: str):
-    customer = customers_collection.find_one({"id": customer_id})
+async def get_debts_by_customer(customer_id: str, shop_id: str = Depends(get_shop_id)):
+    customer = customers_collection.find_one({"shop_id": shop_id, "id": customer_id})
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
-    debts = list(debts_collection.find({"customer_name": customer["name"]}, {"_id": 0}))
+    debts = list(debts_collection.find({"shop_id": shop_id, "customer_name": customer["name"]}, {"_id": 0}))
     if not debts:
         raise HTTPException(status_code=404, detail="No debts found for this customer")
     return [Debt(**debt) for debt in debts]
@@ -41,43 +133,134 @@ async def get_debts_by_customer(customer_id: str):
 
 # Partial or full payment
 @router.put("/debts/{debt_id}/pay", response_model=Debt)
-async def pay_debt(debt_id: str, amount: float):
-    debt = debts_collection.find_one({"id": debt_id})
+async def pay_debt(debt_id: str, amount: float, shop_id: str = Depends(get_shop_id)):
+    debt = money(debts_collection).find_one({"shop_id": shop_id, "id": debt_id})
     if not debt:
         raise HTTPException(status_code=404, detail="Debt not found")
 
-    new_balance = max(0, debt["balance"] - amount)
-    cleared = new_balance == 0
+    # What the debt still owes is its amount minus its payments; `balance` is the
+    # customer's running balance when the debt was made and is left as recorded
+    payments = debt.get("payment", [])
+    outstanding = debt["amount"] - sum(p["amount"] for p in payments)
+    if outstanding <= 0:
+        raise HTTPException(status_code=400, detail="Debt is already paid")
+    applied = min(amount, outstanding)
+    now = datetime.now(timezone.utc)
 
     payment_record = DebtPayment(
-        amount=amount,
-        date=datetime.now(timezone.utc),
+        amount=applied,
+        date=now,
         method="cash"
     ).model_dump()
 
-    updated_debt = debts_collection.find_one_and_update(
-        {"id": debt_id},
-        {"$set": {"balance": new_balance, "cleared": cleared, "updated_at": datetime.now(timezone.utc)},
+    # Matching on the payments read above, so a concurrent payment can't make this one overpay
+    updated_debt = money(debts_collection).find_one_and_update(
+        {"shop_id": shop_id, "id": debt_id, "payment": {"$size": len(payments)}},
+        {"$set": {"cleared": outstanding - applied <= 0, "updated_at": now},
          "$push": {"payment": payment_record}},
         return_document=ReturnDocument.AFTER,
         projection={"_id": 0},
     )
+    if not updated_debt:
+        raise HTTPException(status_code=409, detail="Debt was paid concurrently, please retry")
 
-    # Update customer balance
-    customer = customers_collection.find_one({"name": debt["customer_name"]})
+    # Update customer balance (relative, so concurrent payments and sales are not overwritten)
+    customer = customers_collection.find_one({"shop_id": shop_id, "name": debt["customer_name"]})
     if customer:
-        customers_collection.update_one(
-            {"id": customer["id"]},
-            {"$set": {"balance": new_balance}}
+        money(customers_collection).update_one(
+            {"shop_id": shop_id, "id": customer["id"]},
+            {"$inc": {"balance": -applied},
+             "$set": {"change_version": next_change_version(shop_id, "customers")}}
         )
+        bump_version(shop_id, "customers")
+
+    get_broker(shop_id).publish("debt_payment", {"debt_id": debt_id, "amount": applied})
 
     return Debt(**updated_debt)
 
 
+# One payment spread over the customer's oldest open debts first (FIFO)
+@router.post("/customers/{customer_id}/payments", response_model=CustomerPaymentResult)
+async def pay_customer_debts(customer_id: str, payment: CustomerPaymentRequest, shop_id: str = Depends(get_shop_id)):
+    customer = customers_collection.find_one({"shop_id": shop_id, "id": customer_id}, {"_id": 0, "name": 1})
+    if not customer:
+        raise HTTPException(status_code=404, detail="Customer not found")
+
+    open_debts = money(debts_collection).find(
+        {"shop_id": shop_id, "customer_name": customer["name"], "cleared": False},
+        {"_id": 0, "id": 1, "amount": 1, "payment.amount": 1},
+    ).sort([("created_at", 1), ("id", 1)])
+
+    payment_id = uuid.uuid4().hex
+    now = datetime.now(timezone.utc)
+    remaining = payment.amount
+    operations = []
+    for debt in open_debts:
+        if remaining <= 0:
+            break
+        # `balance` is the customer's running balance when the debt was made; what this debt
+        # still owes is its amount minus its payments (as in the aging report)
+        payments = debt.get("payment", [])
+        outstanding = debt["amount"] - sum(p["amount"] for p in payments)
+        portion = min(remaining, outstanding)
+        if portion <= 0:
+            continue
+        remaining -= portion
+        payment_record = DebtPayment(amount=portion, date=now, method=payment.method, payment_id=payment_id).model_dump()
+        # Matching on the payments read above: a debt paid concurrently is left alone rather than overpaid
+        operations.append(UpdateOne(
+            {"shop_id": shop_id, "id": debt["id"], "cleared": False, "payment": {"$size": len(payments)}},
+            {"$set": {"cleared": outstanding - portion <= 0, "updated_at": now},
+             "$push": {"payment": payment_record}},
+        ))
+
+    if not operations:
+        raise HTTPException(status_code=400, detail="Customer has no outstanding debts")
+
+    result = money(debts_collection).bulk_write(operations, ordered=False)
+
+    # What was really applied (all of it unless another payment raced this one)
+    applied_debts = list(debts_collection.find(
+        {"shop_id": shop_id, "payment.payment_id": payment_id},
+        {"_id": 0, "id": 1, "amount": 1, "cleared": 1, "created_at": 1, "payment": 1},
+    ).sort([("created_at", 1), ("id", 1)])) if result.modified_count else []
+    allocations = [
+        PaymentAllocation(
+            debt_id=debt["id"],
+            amount=sum(p["amount"] for p in debt["payment"] if p.get("payment_id") == payment_id),
+            outstanding=debt["amount"] - sum(p["amount"] for p in debt["payment"]),
+            cleared=debt["cleared"],
+        )
+        for debt in applied_debts
+    ]
+    applied = sum(allocation.amount for allocation in allocations)
+
+    updated_customer = money(customers_collection).find_one_and_update(
+        {"shop_id": shop_id, "id": customer_id},
+        {"$inc": {"balance": -applied}, "$set": {"change_version": next_change_version(shop_id, "customers")}},
+        projection={"_id": 0, "balance": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    bump_version(shop_id, "customers")
+
+    if applied:
+        get_broker(shop_id).publish("debt_payment", {"payment_id": payment_id, "amount": applied})
+
+    return CustomerPaymentResult(
+        payment_id=payment_id,
+        customer_id=customer_id,
+        amount=payment.amount,
+        applied=applied,
+        unapplied=payment.amount - applied,
+        customer_balance=(updated_customer or {}).get("balance", 0.0),
+        allocations=allocations,
+    )
+
+
 # Delete debt (only for corrections)
 @router.delete("/debts/{debt_id}")
-async def delete_debt(debt_id: str):
-    result = debts_collection.delete_one({"id": debt_id})
+async def delete_debt(debt_id: str, shop_id: str = Depends(get_shop_id)):
+    result = debts_collection.delete_one({"shop_id": shop_id, "id": debt_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Debt not found")
     return {"detail": "Debt deleted successfully"}
@@ -85,24 +268,28 @@ async def delete_debt(debt_id: str):
 
 # Aggregate totals
 @router.get("/debts/total", response_model=float)
-async def get_total_debt():
-    result = list(debts_collection.aggregate([{"$group": {"_id": None, "total": {"$sum": "$amount"}}}]))
+async def get_total_debt(shop_id: str = Depends(get_shop_id)):
+    result = list(reporting(debts_collection).aggregate([
+        {"$match": {"shop_id": shop_id}},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
+    ]))
     return float(result[0]["total"]) if result else 0.0
 
 
 @router.get("/debts/total/unpaid", response_model=float)
-async def get_total_unpaid_debt():
-    result = list(debts_collection.aggregate([
-        {"$match": {"cleared": False}},
-        {"$group": {"_id": None, "total": {"$sum": "$balance"}}},
+async def get_total_unpaid_debt(shop_id: str = Depends(get_shop_id)):
+    result = list(reporting(debts_collection).aggregate([
+        {"$match": {"shop_id": shop_id, "cleared": False}},
+        # amount minus payments, as in the aging report and the FIFO allocation
+        {"$group": {"_id": None, "total": {"$sum": {"$subtract": ["$amount", {"$sum": "$payment.amount"}]}}}},
     ]))
     return float(result[0]["total"]) if result else 0.0
 
 
 @router.get("/debts/total/paid", response_model=float)
-async def get_total_paid_debt():
-    result = list(debts_collection.aggregate([
-        {"$match": {"cleared": True}},
+async def get_total_paid_debt(shop_id: str = Depends(get_shop_id)):
+    result = list(reporting(debts_collection).aggregate([
+        {"$match": {"shop_id": shop_id, "cleared": True}},
         {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
     ]))
     return float(result[0]["total"]) if result else 0.0
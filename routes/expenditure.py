@@ -1,8 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from utils.idincrement import increment_id
 from database.config import expenditures_collection
+from database.routing import money, reporting
 from schema.expenditure import Expenditure
-from typing import List
+from utils.broker import get_broker
+from utils.archive import archived_documents, find_archived
+from utils.fields import FIELDS_DESCRIPTION, parse_fields, projection, sparse_response
+from auth.auth import get_shop_id
+from typing import List, Optional
+from pymongo.errors import ExecutionTimeout
 from datetime import datetime, timezone
 
 router = APIRouter()
@@ -10,11 +16,11 @@ router = APIRouter()
 # ──────────────────────────────────────────────
 # Create a new expenditure entry
 @router.post("/expenditures", response_model=Expenditure, status_code=201)
-async def create_expenditure(expenditure: Expenditure): 
+async def create_expenditure(expenditure: Expenditure, shop_id: str = Depends(get_shop_id)):
     try:
         # prevent duplicate expenditure entry for same description/amount/date
         if expenditures_collection.find_one(
-            {"description": expenditure.description, "amount": expenditure.amount, "date": expenditure.date}
+            {"shop_id": shop_id, "description": expenditure.description, "amount": expenditure.amount, "date": expenditure.date}
         ):
             raise HTTPException(status_code=400, detail="Expenditure entry already exists")
 
@@ -22,29 +28,43 @@ async def create_expenditure(expenditure: Expenditure):
         expenditure_dict = expenditure.model_dump()
         expenditure_dict.update({
             "id": new_expenditure_id,
+            "shop_id": shop_id,
             "created_at": datetime.now(timezone.utc),
         })
 
-        expenditures_collection.insert_one(expenditure_dict)
+        money(expenditures_collection).insert_one(expenditure_dict)
+        get_broker(shop_id).publish("expenditure", {"expenditure_id": new_expenditure_id, "amount": expenditure.amount})
         return Expenditure(**expenditure_dict)
 
+    except ExecutionTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create expenditure: {str(e)}")
     
 # ──────────────────────────────────────────────
 # Get all expenditures
 @router.get("/expenditures", response_model=List[Expenditure])
-async def get_expenditures():
-    expenditures = list(expenditures_collection.find({}, {"_id": 0}))
+async def get_expenditures(
+    include_archived: bool = False,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    shop_id: str = Depends(get_shop_id),
+):
+    selected = parse_fields(fields, Expenditure)
+    expenditures = list(reporting(expenditures_collection).find({"shop_id": shop_id}, projection(selected)))
+    if include_archived:
+        expenditures += archived_documents("expenditures", shop_id, projection(selected))
     if not expenditures:
         raise HTTPException(status_code=404, detail="No expenditures found")
+    if selected:
+        return sparse_response(Expenditure, expenditures, selected)
     return [Expenditure(**expenditure) for expenditure in expenditures]
 
 # ──────────────────────────────────────────────
 # Get expenditure by ID
 @router.get("/expenditures/{expenditure_id}", response_model=Expenditure)
-async def get_expenditure_by_id(expenditure_id: str):
-    expenditure = expenditures_collection.find_one({"id": expenditure_id}, {"_id": 0})
+async def get_expenditure_by_id(expenditure_id: str, shop_id: str = Depends(get_shop_id)):
+    expenditure = (expenditures_collection.find_one({"shop_id": shop_id, "id": expenditure_id}, {"_id": 0})
+                   or find_archived("expenditures", shop_id, expenditure_id))
     if not expenditure:
         raise HTTPException(status_code=404, detail="Expenditure entry not found")
     return Expenditure(**expenditure)
@@ -52,16 +72,16 @@ async def get_expenditure_by_id(expenditure_id: str):
 # ──────────────────────────────────────────────
 # Delete expenditure by ID
 @router.delete("/expenditures/{expenditure_id}", status_code=204)
-async def delete_expenditure(expenditure_id: str):
-    result = expenditures_collection.delete_one({"id": expenditure_id})
+async def delete_expenditure(expenditure_id: str, shop_id: str = Depends(get_shop_id)):
+    result = expenditures_collection.delete_one({"shop_id": shop_id, "id": expenditure_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Expenditure entry not found")
     return
 # ──────────────────────────────────────────────    
 # Get expenditures by category
 @router.get("/expenditures/category/{category}", response_model=List[Expenditure])
-async def get_expenditures_by_category(category: str):
-    expenditures = list(expenditures_collection.find({"category": category}, {"_id": 0}))
+async def get_expenditures_by_category(category: str, shop_id: str = Depends(get_shop_id)):
+    expenditures = list(expenditures_collection.find({"shop_id": shop_id, "category": category}, {"_id": 0}))
     if not expenditures:
         raise HTTPException(status_code=404, detail="No expenditures found for this category")
     return [Expenditure(**expenditure) for expenditure in expenditures]
@@ -69,9 +89,9 @@ async def get_expenditures_by_category(category: str):
 # ──────────────────────────────────────────────
 # Get expenditures by date range
 @router.get("/expenditures/date-range/", response_model=List[Expenditure])
-async def get_expenditures_by_date_range(start_date: datetime, end_date: datetime):
+async def get_expenditures_by_date_range(start_date: datetime, end_date: datetime, shop_id: str = Depends(get_shop_id)):
     expenditures = list(expenditures_collection.find(
-        {"date": {"$gte": start_date, "$lte": end_date}}, {"_id": 0}
+        {"shop_id": shop_id, "date": {"$gte": start_date, "$lte": end_date}}, {"_id": 0}
     ))
     if not expenditures:
         raise HTTPException(status_code=404, detail="No expenditures found in this date range")
@@ -80,13 +100,14 @@ async def get_expenditures_by_date_range(start_date: datetime, end_date: datetim
 # ──────────────────────────────────────────────
 # Update expenditure entry
 @router.put("/expenditures/{expenditure_id}", response_model=Expenditure)
-async def update_expenditure(expenditure_id: str, expenditure: Expenditure):
+async def update_expenditure(expenditure_id: str, expenditure: Expenditure, shop_id: str = Depends(get_shop_id)):
     update_data = expenditure.model_dump(exclude_unset=True)
+    update_data.pop("shop_id", None)
     update_data["date"] = update_data.get("date", datetime.now(timezone.utc))
     update_data["updated_at"] = datetime.now(timezone.utc)
 
     updated_expenditure = expenditures_collection.find_one_and_update(
-        {"id": expenditure_id},
+        {"shop_id": shop_id, "id": expenditure_id},
         {"$set": update_data},
         return_document=True,
         projection={"_id": 0},
@@ -98,15 +119,16 @@ async def update_expenditure(expenditure_id: str, expenditure: Expenditure):
 # ──────────────────────────────────────────────
 # Delete all expenditures (use with caution)
 @router.delete("/expenditures", status_code=204)
-async def delete_all_expenditures():
-    expenditures_collection.delete_many({})
+async def delete_all_expenditures(shop_id: str = Depends(get_shop_id)):
+    expenditures_collection.delete_many({"shop_id": shop_id})
     return  
 
 # ──────────────────────────────────────────────
 # Get total expenditure amount
 @router.get("/expenditures/total-amount", response_model=float)
-async def get_total_expenditure_amount():
-    total = expenditures_collection.aggregate([
+async def get_total_expenditure_amount(shop_id: str = Depends(get_shop_id)):
+    total = reporting(expenditures_collection).aggregate([
+        {"$match": {"shop_id": shop_id}},
         {"$group": {"_id": None, "total_amount": {"$sum": "$amount"}}}
     ])
     total_amount = next(total, {}).get("total_amount", 0.0)
@@ -115,8 +137,9 @@ async def get_total_expenditure_amount():
 # ──────────────────────────────────────────────
 # Get average expenditure amount
 @router.get("/expenditures/average-amount", response_model=float)
-async def get_average_expenditure_amount():
-    average = expenditures_collection.aggregate([
+async def get_average_expenditure_amount(shop_id: str = Depends(get_shop_id)):
+    average = reporting(expenditures_collection).aggregate([
+        {"$match": {"shop_id": shop_id}},
         {"$group": {"_id": None, "average_amount": {"$avg": "$amount"}}}
     ])
     average_amount = next(average, {}).get("average_amount", 0.0)
@@ -125,16 +148,16 @@ async def get_average_expenditure_amount():
 # ──────────────────────────────────────────────
 # Get expenditure count
 @router.get("/expenditures/count", response_model=int)
-async def get_expenditure_count():
-    count = expenditures_collection.count_documents({})
+async def get_expenditure_count(shop_id: str = Depends(get_shop_id)):
+    count = expenditures_collection.count_documents({"shop_id": shop_id})
     return count
 
 # ──────────────────────────────────────────────
 # Get expenditures sorted by amount
 @router.get("/expenditures/sorted-by-amount", response_model=List[Expenditure])
-async def get_expenditures_sorted_by_amount(descending: bool = False):
+async def get_expenditures_sorted_by_amount(descending: bool = False, shop_id: str = Depends(get_shop_id)):
     sort_order = -1 if descending else 1
-    expenditures = list(expenditures_collection.find({}, {"_id": 0}).sort("amount", sort_order))
+    expenditures = list(expenditures_collection.find({"shop_id": shop_id}, {"_id": 0}).sort("amount", sort_order))
     if not expenditures:
         raise HTTPException(status_code=404, detail="No expenditures found")
     return [Expenditure(**expenditure) for expenditure in expenditures] 
@@ -142,9 +165,9 @@ async def get_expenditures_sorted_by_amount(descending: bool = False):
 # ──────────────────────────────────────────────
 # Get expenditures sorted by date
 @router.get("/expenditures/sorted-by-date", response_model=List[Expenditure])
-async def get_expenditures_sorted_by_date(descending: bool = False):    
+async def get_expenditures_sorted_by_date(descending: bool = False, shop_id: str = Depends(get_shop_id)):
     sort_order = -1 if descending else 1
-    expenditures = list(expenditures_collection.find({}, {"_id": 0}).sort("date", sort_order))
+    expenditures = list(expenditures_collection.find({"shop_id": shop_id}, {"_id": 0}).sort("date", sort_order))
     if not expenditures:
         raise HTTPException(status_code=404, detail="No expenditures found")
     return [Expenditure(**expenditure) for expenditure in expenditures]
@@ -152,8 +175,8 @@ async def get_expenditures_sorted_by_date(descending: bool = False):
 # ──────────────────────────────────────────────
 # Get expenditures with amount greater than a specified value
 @router.get("/expenditures/amount-greater-than/{amount}", response_model=List[Expenditure])
-async def get_expenditures_amount_greater_than(amount: float):
-    expenditures = list(expenditures_collection.find({"amount": {"$gt": amount}}, {"_id": 0}))
+async def get_expenditures_amount_greater_than(amount: float, shop_id: str = Depends(get_shop_id)):
+    expenditures = list(expenditures_collection.find({"shop_id": shop_id, "amount": {"$gt": amount}}, {"_id": 0}))
     if not expenditures:
         raise HTTPException(status_code=404, detail="No expenditures found with amount greater than specified value")
     return [Expenditure(**expenditure) for expenditure in expenditures] 
@@ -161,8 +184,8 @@ async def get_expenditures_amount_greater_than(amount: float):
 # ──────────────────────────────────────────────
 # Get expenditures with amount less than a specified value
 @router.get("/expenditures/amount-less-than/{amount}", response_model=List[Expenditure])
-async def get_expenditures_amount_less_than(amount: float):
-    expenditures = list(expenditures_collection.find({"amount": {"$lt": amount}}, {"_id": 0}))
+async def get_expenditures_amount_less_than(amount: float, shop_id: str = Depends(get_shop_id)):
+    expenditures = list(expenditures_collection.find({"shop_id": shop_id, "amount": {"$lt": amount}}, {"_id": 0}))
     if not expenditures:
         raise HTTPException(status_code=404, detail="No expenditures found with amount less than specified value")
     return [Expenditure(**expenditure) for expenditure in expenditures]
@@ -170,8 +193,8 @@ async def get_expenditures_amount_less_than(amount: float):
 # ──────────────────────────────────────────────
 # Get expenditures with amount equal to a specified value
 @router.get("/expenditures/amount-equal-to/{amount}", response_model=List[Expenditure])
-async def get_expenditures_amount_equal_to(amount: float):
-    expenditures = list(expenditures_collection.find({"amount": amount}, {"_id": 0}))
+async def get_expenditures_amount_equal_to(amount: float, shop_id: str = Depends(get_shop_id)):
+    expenditures = list(expenditures_collection.find({"shop_id": shop_id, "amount": amount}, {"_id": 0}))
     if not expenditures:
         raise HTTPException(status_code=404, detail="No expenditures found with amount equal to specified value")
     return [Expenditure(**expenditure) for expenditure in expenditures]
@@ -179,8 +202,8 @@ async def get_expenditures_amount_equal_to(amount: float):
 # ──────────────────────────────────────────────
 # Get latest expenditure entries (most recent first)
 @router.get("/expenditures/latest", response_model=List[Expenditure])
-async def get_latest_expenditures(limit: int = 5):
-    expenditures = list(expenditures_collection.find({}, {"_id": 0}).sort("date", -1).limit(limit))
+async def get_latest_expenditures(limit: int = 5, shop_id: str = Depends(get_shop_id)):
+    expenditures = list(expenditures_collection.find({"shop_id": shop_id}, {"_id": 0}).sort("date", -1).limit(limit))
     if not expenditures:
         raise HTTPException(status_code=404, detail="No expenditures found")
     return [Expenditure(**expenditure) for expenditure in expenditures]
\ No newline at end of file
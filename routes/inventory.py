@@ -0,0 +1,112 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import List, Optional
+from datetime import datetime, timezone
+from pymongo.collection import ReturnDocument
+from database.config import products_collection, movements_collection, holds_collection
+from schema.inventory import (
+    StockMovement, StockAdjustment, StockAtDate, CreateReservation, Reservation, ReorderSuggestions,
+)
+from utils.inventory import movement, record_movements, stock_at
+from utils.valuation import apply_valuation_delta
+from utils.etag import bump_version
+from utils.sync import next_change_version
+from utils.reservations import reserve, release
+from utils.forecast import reorder_suggestions
+from auth.auth import get_shop_id
+
+router = APIRouter()
+
+
+# Manual stock correction or customer return, recorded in the ledger
+@router.post("/stock/adjustments", response_model=StockMovement, status_code=201)
+async def create_stock_adjustment(adjustment: StockAdjustment, shop_id: str = Depends(get_shop_id)):
+    query = {"shop_id": shop_id, "id": adjustment.product_id}
+    if adjustment.quantity < 0:
+        # never let an adjustment take stock below zero
+        query["current_stock"] = {"$gte": -adjustment.quantity}
+
+    product = products_collection.find_one_and_update(
+        query,
+        {"$inc": {"current_stock": adjustment.quantity},
+         "$set": {"updated_at": datetime.now(timezone.utc), "change_version": next_change_version(shop_id, "products")}},
+        return_document=ReturnDocument.AFTER,
+        projection={"_id": 0},
+    )
+    if not product:
+        if products_collection.find_one({"shop_id": shop_id, "id": adjustment.product_id}):
+            raise HTTPException(status_code=400, detail="Adjustment would make stock negative")
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    apply_valuation_delta(shop_id, product.get("category"), adjustment.quantity * product.get("cost_price", 0))
+    bump_version(shop_id, "products")
+
+    entry = movement(shop_id, adjustment.product_id, adjustment.type, adjustment.quantity, note=adjustment.note)
+    record_movements([entry])
+    return StockMovement(**entry)
+
+
+# Reorder points and quantities from sales velocity, trend and weekday seasonality, per supplier
+@router.get("/stock/reorder-suggestions", response_model=ReorderSuggestions)
+def get_reorder_suggestions(
+    history_days: int = Query(182, ge=28, le=730),
+    velocity_days: int = Query(28, ge=7, le=365),
+    lead_time_days: int = Query(7, ge=1, le=120),
+    cover_days: int = Query(14, ge=0, le=365),
+    service_level: float = Query(0.95, gt=0.5, lt=1),
+    only_needed: bool = True,
+    shop_id: str = Depends(get_shop_id),
+):
+    return reorder_suggestions(shop_id, history_days, velocity_days, lead_time_days, cover_days, service_level, only_needed)
+
+
+# Hold stock for a checkout in progress; confirm it with POST /sale (reservation_id)
+@router.post("/stock/reservations", response_model=Reservation, status_code=201)
+async def create_reservation(reservation: CreateReservation, shop_id: str = Depends(get_shop_id)):
+    if not reservation.items:
+        raise HTTPException(status_code=400, detail="Nothing to reserve")
+    hold = reserve(shop_id, [item.model_dump() for item in reservation.items], reservation.ttl_seconds)
+    return Reservation(**hold)
+
+
+@router.get("/stock/reservations/{reservation_id}", response_model=Reservation)
+async def get_reservation(reservation_id: str, shop_id: str = Depends(get_shop_id)):
+    hold = holds_collection.find_one({"shop_id": shop_id, "id": reservation_id}, {"_id": 0})
+    if not hold:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    return Reservation(**hold)
+
+
+# Cancel a hold (abandoned cart); its stock goes straight back on the shelf
+@router.delete("/stock/reservations/{reservation_id}", response_model=Reservation)
+async def cancel_reservation(reservation_id: str, shop_id: str = Depends(get_shop_id)):
+    hold = release(shop_id, reservation_id)
+    if not hold:
+        if holds_collection.find_one({"shop_id": shop_id, "id": reservation_id}, {"_id": 1}):
+            raise HTTPException(status_code=409, detail="Reservation is no longer active")
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    return Reservation(**hold)
+
+
+# Movement history of one product, newest first
+@router.get("/stock/{product_id}/movements", response_model=List[StockMovement])
+async def get_stock_movements(
+    product_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    before: Optional[datetime] = None,
+    shop_id: str = Depends(get_shop_id),
+):
+    query = {"shop_id": shop_id, "product_id": product_id}
+    if before:
+        query["created_at"] = {"$lt": before}
+    movements = list(movements_collection.find(query, {"_id": 0}).sort("created_at", -1).limit(limit))
+    if not movements:
+        raise HTTPException(status_code=404, detail="No stock movements found")
+    return [StockMovement(**m) for m in movements]
+
+
+# Stock level of a product at a point in time (snapshot + tail of movements)
+@router.get("/stock/{product_id}/at", response_model=StockAtDate)
+async def get_stock_at(product_id: str, date: datetime, shop_id: str = Depends(get_shop_id)):
+    if not products_collection.find_one({"shop_id": shop_id, "id": product_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Product not found")
+    return stock_at(shop_id, product_id, date)
@@ -1,8 +1,18 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from typing import List, Optional, Tuple
 from database.config import products_collection
-from schema.products import ProductSchema
+from database.routing import reporting
+from schema.products import ProductSchema, RelatedProduct
 from utils.idincrement import increment_id
+from utils.valuation import apply_product_change, get_valuation_totals
+from utils.etag import bump_version, conditional_list_response
+from pymongo.collection import ReturnDocument
+from utils.inventory import movement, record_movements
+from utils.search import record_search_write, search, search_keys
+from utils.sync import next_change_version, record_tombstone
+from utils.fields import FIELDS_DESCRIPTION, parse_fields, projection, validate_list
+from utils.related import related_products
+from auth.auth import get_shop_id
 from datetime import datetime, timezone
 
 router = APIRouter()
@@ -10,112 +20,173 @@ router = APIRouter()
 
 # Create a new product
 @router.post("/product", response_model=ProductSchema)
-async def create_product(product: ProductSchema):
-    if products_collection.find_one({"name": product.name}):
+async def create_product(product: ProductSchema, shop_id: str = Depends(get_shop_id)):
+    if products_collection.find_one({"shop_id": shop_id, "name": product.name}):
         raise HTTPException(status_code=400, detail="Product already exists")
 
     new_product_id = increment_id(products_collection)
 
     product_dict = product.model_dump()
     product_dict["id"] = new_product_id
+    product_dict["shop_id"] = shop_id
     product_dict["created_at"] = datetime.now(timezone.utc)
     product_dict["updated_at"] = datetime.now(timezone.utc)
+    product_dict["change_version"] = next_change_version(shop_id, "products")
+    product_dict.update(search_keys("products", product_dict))
 
     products_collection.insert_one(product_dict)
+    apply_product_change(shop_id, None, product_dict)
+    if product_dict.get("current_stock"):
+        record_movements([movement(shop_id, new_product_id, "adjustment", product_dict["current_stock"], note="opening stock")])
+    bump_version(shop_id, "products")
+    record_search_write(shop_id, "products", doc=product_dict)
     return ProductSchema(**product_dict)
 
 
-@router.get("/products", response_model=List[ProductSchema])
-async def get_all_products():
-    products_cursor = products_collection.find({}, {"_id": 0})
-    products = []
-    for product in products_cursor:
-        try:
-            products.append(ProductSchema(**product))
-        except Exception:
-            continue  # skip invalid products (optional)
+def load_all_products(shop_id: str, fields: Optional[Tuple[str, ...]] = None):
+    products = list(products_collection.find({"shop_id": shop_id}, projection(fields)))
+    # one validation pass for the whole list; invalid products are still skipped
+    products = validate_list(ProductSchema, products, fields, skip_invalid=True)
     if not products:
         raise HTTPException(status_code=404, detail="No valid products found")
     return products
 
 
+# Supports If-None-Match: unchanged catalogs return 304 without querying products
+@router.get("/products", response_model=List[ProductSchema])
+async def get_all_products(
+    request: Request,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    shop_id: str = Depends(get_shop_id),
+):
+    selected = parse_fields(fields, ProductSchema)
+    return conditional_list_response(
+        request, shop_id, "products", lambda: load_all_products(shop_id, selected), variant="+".join(selected or ())
+    )
+
+
+
+# Typeahead: prefix / typo-tolerant match on name and category
+@router.get("/products/search")
+async def search_products(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    fuzzy: bool = True,
+    shop_id: str = Depends(get_shop_id),
+):
+    return search(shop_id, "products", q, limit, fuzzy)
+
 
 # Get product by ID
 @router.get("/products/{product_id}", response_model=ProductSchema)
-async def get_product_by_id(product_id: str):
-    product = products_collection.find_one({"id": product_id}, {"_id": 0})
+async def get_product_by_id(product_id: str, shop_id: str = Depends(get_shop_id)):
+    product = products_collection.find_one({"shop_id": shop_id, "id": product_id}, {"_id": 0})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     return ProductSchema(**product)
 
 
+# Products most often bought together with this one
+@router.get("/products/{product_id}/related", response_model=List[RelatedProduct])
+async def get_related_products(
+    product_id: str,
+    limit: int = Query(10, ge=1, le=50),
+    shop_id: str = Depends(get_shop_id),
+):
+    if not products_collection.find_one({"shop_id": shop_id, "id": product_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Product not found")
+    return related_products(shop_id, product_id, limit)
+
+
 # Update product by ID
 @router.put("/products/{product_id}", response_model=ProductSchema)
-async def update_product(product_id: str, product: ProductSchema):
+async def update_product(product_id: str, product: ProductSchema, shop_id: str = Depends(get_shop_id)):
     update_data = product.model_dump(exclude_unset=True)
+    update_data.pop("shop_id", None)  # products cannot move between shops
     update_data["updated_at"] = datetime.now(timezone.utc)
+    update_data["change_version"] = next_change_version(shop_id, "products")
+    update_data.update(search_keys("products", update_data))
 
-    updated_product = products_collection.find_one_and_update(
-        {"id": product_id},
+    previous_product = products_collection.find_one_and_update(
+        {"shop_id": shop_id, "id": product_id},
         {"$set": update_data},
-        return_document=True,
+        return_document=ReturnDocument.BEFORE,
         projection={"_id": 0}
     )
-    if not updated_product:
+    if not previous_product:
         raise HTTPException(status_code=404, detail="Product not found")
 
+    updated_product = {**previous_product, **update_data}
+    apply_product_change(shop_id, previous_product, updated_product)
+    stock_change = updated_product.get("current_stock", 0) - previous_product.get("current_stock", 0)
+    if stock_change:
+        record_movements([movement(shop_id, product_id, "adjustment", stock_change, note="product update")])
+    bump_version(shop_id, "products")
+    record_search_write(shop_id, "products", doc=updated_product)
     return ProductSchema(**updated_product)
 
 
 # Delete product by ID
 @router.delete("/products/{product_id}")
-async def delete_product(product_id: str):
-    result = products_collection.delete_one({"id": product_id})
-    if result.deleted_count == 0:
+async def delete_product(product_id: str, shop_id: str = Depends(get_shop_id)):
+    deleted_product = products_collection.find_one_and_delete({"shop_id": shop_id, "id": product_id}, projection={"_id": 0})
+    if not deleted_product:
         raise HTTPException(status_code=404, detail="Product not found")
+    apply_product_change(shop_id, deleted_product, None)
+    if deleted_product.get("current_stock"):
+        record_movements([movement(shop_id, product_id, "adjustment", -deleted_product["current_stock"], note="product deleted")])
+    record_tombstone(shop_id, "products", product_id)
+    bump_version(shop_id, "products")
+    record_search_write(shop_id, "products", removed_id=product_id)
     return {"detail": "Product deleted successfully"}
 
 
 # Get stock levels
 @router.get("/stock/levels")
-async def get_stock_levels():
-    products = list(products_collection.find({}, {"_id": 0, "name": 1, "current_stock": 1, "low_stock_alert": 1}))
+async def get_stock_levels(shop_id: str = Depends(get_shop_id)):
+    products = list(products_collection.find({"shop_id": shop_id}, {"_id": 0, "name": 1, "current_stock": 1, "low_stock_alert": 1}))
     if not products:
         raise HTTPException(status_code=404, detail="No products found")
     return products
 
 
-# Stock valuation
+# Stock valuation: totals are maintained incrementally, product detail is paginated
 @router.get("/stock/valuation")
-async def get_stock_valuation():
-    products = list(products_collection.find({}, {"_id": 0, "name": 1, "current_stock": 1, "cost_price": 1}))
-    if not products:
+def get_stock_valuation(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=500),
+    shop_id: str = Depends(get_shop_id),
+):
+    totals = get_valuation_totals(shop_id)
+
+    products = reporting(products_collection).find(
+        {"shop_id": shop_id}, {"_id": 0, "id": 1, "name": 1, "category": 1, "current_stock": 1, "cost_price": 1}
+    ).sort("id", 1).skip((page - 1) * page_size).limit(page_size)
+
+    product_valuations = [{
+        "name": product["name"],
+        "category": product.get("category"),
+        "current_stock": product["current_stock"],
+        "cost_price": product["cost_price"],
+        "valuation": product["current_stock"] * product["cost_price"]
+    } for product in products]
+
+    if not product_valuations and page == 1 and not totals["category_valuations"]:
         raise HTTPException(status_code=404, detail="No products found")
 
-    total_valuation = 0.0
-    product_valuations = []
-
-    for product in products:
-        valuation = product["current_stock"] * product["cost_price"]
-        total_valuation += valuation
-        product_valuations.append({
-            "name": product["name"],
-            "current_stock": product["current_stock"],
-            "cost_price": product["cost_price"],
-            "valuation": valuation
-        })
-
     return {
-        "total_valuation": total_valuation,
+        **totals,
+        "page": page,
+        "page_size": page_size,
         "product_valuations": product_valuations
     }
 
 
 # Products below low stock alert
 @router.get("/stock/low")
-async def get_low_stock_products():
+async def get_low_stock_products(shop_id: str = Depends(get_shop_id)):
     products = list(products_collection.find(
-        {"$expr": {"$lt": ["$current_stock", "$low_stock_alert"]}},
+        {"shop_id": shop_id, "$expr": {"$lt": ["$current_stock", "$low_stock_alert"]}},
         {"_id": 0, "name": 1, "current_stock": 1, "low_stock_alert": 1}
     ))
 
@@ -1,41 +1,66 @@
 # routers/purchase_router.py
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Dict, List, Optional
 from datetime import datetime, timezone
-from database.config import purchases_collection, products_collection
-from schema.purchase import Purchase, PurchaseItem
+from pymongo import UpdateOne
+from database.config import purchases_collection, purchases_archive_collection, products_collection
+from database.routing import money, reporting
+from schema.purchase import (
+    Purchase, PurchaseItem, SupplierAnalytics, SupplierSpend, SupplierProductPrices, PricePoint, CostChange,
+)
 from utils.idincrement import increment_id
+from utils.broker import get_broker
+from utils.valuation import apply_valuation_delta
+from utils.etag import bump_version
+from utils.inventory import movement, record_movements
+from utils.sync import next_change_versions
+from utils.archive import archived_documents, find_archived
+from utils.fields import FIELDS_DESCRIPTION, parse_fields, projection, sparse_response
+from auth.auth import get_shop_id
 
 router = APIRouter()
 
 
 @router.post("/purchase", response_model=Purchase)
-async def create_purchase(purchase: Purchase):
+async def create_purchase(purchase: Purchase, shop_id: str = Depends(get_shop_id)):
     new_purchase_id = increment_id(purchases_collection)
     purchase_dict = purchase.model_dump()
     purchase_dict["id"] = new_purchase_id
+    purchase_dict["shop_id"] = shop_id
     purchase_dict["created_at"] = datetime.now(timezone.utc)
 
     total_amount = 0.0
     updated_items = []
-
-    # Process each item
+    movements = []
+    change_versions = next_change_versions(shop_id, "products", len(purchase.items))
+
+    # One read for every product on the purchase, all checked before any stock moves
+    product_ids = list({item.product_id for item in purchase.items})
+    products = {product["id"]: product for product in products_collection.find(
+        {"shop_id": shop_id, "id": {"$in": product_ids}},
+        {"_id": 0, "id": 1, "name": 1, "cost_price": 1, "category": 1},
+    )}
     for item in purchase.items:
-        product = products_collection.find_one({"id": item.product_id})
-        if not product:
+        if item.product_id not in products:
             raise HTTPException(status_code=404, detail=f"Product with ID {item.product_id} not found")
 
+    # Process each item
+    stock_updates = []
+    for item, change_version in zip(purchase.items, change_versions):
+        product = products[item.product_id]
+
         # Auto-fill details
         cost_price = product["cost_price"]
         product_name = product["name"]
         total_cost = cost_price * item.quantity
 
-        # Update stock
-        new_stock = product.get("current_stock", 0) + item.quantity
-        products_collection.update_one(
-            {"id": item.product_id},
-            {"$set": {"current_stock": new_stock, "updated_at": datetime.now(timezone.utc)}}
-        )
+        # Update stock (relative, so concurrent sales and purchases are not overwritten)
+        stock_updates.append(UpdateOne(
+            {"shop_id": shop_id, "id": item.product_id},
+            {"$inc": {"current_stock": item.quantity},
+             "$set": {"updated_at": datetime.now(timezone.utc), "change_version": change_version}}
+        ))
+        movements.append(movement(shop_id, item.product_id, "purchase", item.quantity, reference_id=new_purchase_id))
 
         updated_items.append(PurchaseItem(
             product_id=item.product_id,
@@ -50,29 +75,161 @@ async def create_purchase(purchase: Purchase):
     purchase_dict["items"] = updated_items
     purchase_dict["total_amount"] = total_amount
 
-    purchases_collection.insert_one(purchase_dict)
+    if stock_updates:
+        money(products_collection).bulk_write(stock_updates, ordered=False)
+    for item in updated_items:
+        apply_valuation_delta(shop_id, products[item["product_id"]].get("category"), item["total_cost"])
+
+    money(purchases_collection).insert_one(purchase_dict)
+    record_movements(movements)
+    bump_version(shop_id, "products")
+    get_broker(shop_id).publish("purchase", {"purchase_id": new_purchase_id, "amount": total_amount})
     return Purchase(**purchase_dict)
 
 
 @router.get("/purchases", response_model=List[Purchase])
-async def get_all_purchases():
-    purchases = list(purchases_collection.find({}, {"_id": 0}))
+def get_all_purchases(
+    include_archived: bool = False,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    shop_id: str = Depends(get_shop_id),
+):
+    selected = parse_fields(fields, Purchase)
+    purchases = list(reporting(purchases_collection).find({"shop_id": shop_id}, projection(selected)))
+    if include_archived:
+        purchases += archived_documents("purchases", shop_id, projection(selected))
     if not purchases:
         raise HTTPException(status_code=404, detail="No purchases found")
+    if selected:
+        return sparse_response(Purchase, purchases, selected)
     return [Purchase(**purchase) for purchase in purchases]
 
 
 @router.get("/purchases/{purchase_id}", response_model=Purchase)
-async def get_purchase_by_id(purchase_id: str):
-    purchase = purchases_collection.find_one({"id": purchase_id}, {"_id": 0})
+async def get_purchase_by_id(purchase_id: str, shop_id: str = Depends(get_shop_id)):
+    purchase = (purchases_collection.find_one({"shop_id": shop_id, "id": purchase_id}, {"_id": 0})
+                or find_archived("purchases", shop_id, purchase_id))
     if not purchase:
         raise HTTPException(status_code=404, detail="Purchase not found")
     return Purchase(**purchase)
 
 
 @router.delete("/purchases/{purchase_id}")
-async def delete_purchase(purchase_id: str):
-    result = purchases_collection.delete_one({"id": purchase_id})
+async def delete_purchase(purchase_id: str, shop_id: str = Depends(get_shop_id)):
+    result = purchases_collection.delete_one({"shop_id": shop_id, "id": purchase_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Purchase not found")
     return {"detail": "Purchase deleted successfully"}
+
+
+def supplier_pipeline(match: Dict, include_archived: bool, stages: List[Dict], chronological: bool = False) -> List[Dict]:
+    """
+    `stages` over the matching purchases, optionally including archived ones.
+
+    The match is served by (shop_id, supplier, created_at), or (shop_id, created_at)
+    without a supplier filter; `chronological` sorts by created_at first.
+    """
+    pipeline = [{"$match": match}]
+    if include_archived:
+        pipeline.append({"$unionWith": {"coll": purchases_archive_collection.name, "pipeline": [{"$match": match}]}})
+    if chronological:
+        pipeline.append({"$sort": {"created_at": 1}})
+    return pipeline + [{"$addFields": {"supplier": {"$ifNull": ["$supplier", "Unknown"]}}}] + stages
+
+
+# Spend per supplier, purchase-price history per product and supplier, and cost changes
+@router.get("/suppliers/analytics", response_model=SupplierAnalytics)
+def get_supplier_analytics(
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    supplier: Optional[str] = None,
+    min_change_pct: float = Query(0.0, ge=0, description="Only report cost changes at least this large (percent)"),
+    include_archived: bool = False,
+    shop_id: str = Depends(get_shop_id),
+):
+    match: Dict = {"shop_id": shop_id}
+    if supplier:
+        match["supplier"] = supplier
+    if start_date or end_date:
+        match["created_at"] = {}
+        if start_date:
+            match["created_at"]["$gte"] = start_date
+        if end_date:
+            match["created_at"]["$lte"] = end_date
+
+    suppliers = [
+        SupplierSpend(supplier=row["_id"], product_count=len(row["products"]), **{k: v for k, v in row.items() if k not in ("_id", "products")})
+        for row in reporting(purchases_collection).aggregate(supplier_pipeline(match, include_archived, [
+            {"$group": {
+                "_id": "$supplier",
+                "total_spend": {"$sum": "$total_amount"},
+                "purchase_count": {"$sum": 1},
+                "products": {"$addToSet": "$items.product_id"},
+                "first_purchase": {"$min": "$created_at"},
+                "last_purchase": {"$max": "$created_at"},
+            }},
+            {"$project": {
+                "total_spend": 1, "purchase_count": 1, "first_purchase": 1, "last_purchase": 1,
+                "products": {"$reduce": {"input": "$products", "initialValue": [], "in": {"$setUnion": ["$$value", "$$this"]}}},
+            }},
+            {"$sort": {"total_spend": -1}},
+        ]), allowDiskUse=True)
+    ]
+
+    # Sorted by created_at before grouping, so every pushed history is already chronological
+    rows = reporting(purchases_collection).aggregate(supplier_pipeline(match, include_archived, [
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": {"supplier": "$supplier", "product_id": "$items.product_id"},
+            "product_name": {"$last": "$items.product_name"},
+            "quantity": {"$sum": "$items.quantity"},
+            "total_spend": {"$sum": "$items.total_cost"},
+            "points": {"$push": {"date": "$created_at", "cost_price": "$items.cost_price", "quantity": "$items.quantity"}},
+        }},
+        {"$sort": {"total_spend": -1}},
+    ], chronological=True), allowDiskUse=True)
+
+    prices = []
+    cost_changes = []
+    for row in rows:
+        history: List[PricePoint] = []
+        for point in row["points"]:
+            if point.get("cost_price") is None:
+                continue
+            if history and history[-1].cost_price == point["cost_price"]:
+                history[-1].quantity += point["quantity"]
+                continue
+            if history:
+                old_cost = history[-1].cost_price
+                change_pct = (point["cost_price"] - old_cost) / old_cost * 100 if old_cost else 100.0
+                if abs(change_pct) >= min_change_pct:
+                    cost_changes.append(CostChange(
+                        supplier=row["_id"]["supplier"],
+                        product_id=row["_id"]["product_id"],
+                        product_name=row["product_name"],
+                        date=point["date"],
+                        old_cost=old_cost,
+                        new_cost=point["cost_price"],
+                        change_pct=round(change_pct, 2),
+                    ))
+            history.append(PricePoint(date=point["date"], cost_price=point["cost_price"], quantity=point["quantity"]))
+        if not history:
+            continue
+        prices.append(SupplierProductPrices(
+            supplier=row["_id"]["supplier"],
+            product_id=row["_id"]["product_id"],
+            product_name=row["product_name"],
+            quantity=row["quantity"],
+            total_spend=row["total_spend"],
+            average_cost=row["total_spend"] / row["quantity"] if row["quantity"] else 0.0,
+            latest_cost=history[-1].cost_price,
+            history=history,
+        ))
+
+    cost_changes.sort(key=lambda change: change.date, reverse=True)
+    return SupplierAnalytics(
+        start_date=start_date,
+        end_date=end_date,
+        suppliers=suppliers,
+        prices=prices,
+        cost_changes=cost_changes,
+    )
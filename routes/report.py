@@ -1,6 +1,6 @@
-from fastapi import APIRouter, HTTPException
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import List, Optional, Dict, Any, Tuple, Union, Literal
+from datetime import datetime, timedelta, timezone
 from database.config import (
     sales_collection,
     purchases_collection,
@@ -9,16 +9,22 @@ from database.config import (
     customers_collection,
     expenditures_collection
 )
-from schema.report import ReportSummary, ReportFilters, ReportType
+from database.routing import reporting
+from database.budget import REQUIRED_SHARE, record_timeout, spend_at_most
+from pymongo.errors import ExecutionTimeout
+from schema.report import ReportSummary, ReportFilters, ReportType, ReportComparison, MarginReport, MarginRow
+from utils.timebuckets import shift_months
+from utils.archive import archived_records, reaches_archive, record_count, union_archive
+from auth.auth import get_shop_id
 
 router = APIRouter()
 
-def build_base_queries(filters: ReportFilters):
-    """Build base queries for all collections"""
-    sales_query = {}
-    purchases_query = {}
-    debts_query = {}
-    expenditures_query = {}
+def build_base_queries(filters: ReportFilters, shop_id: str):
+    """Build base queries for all collections, scoped to one shop"""
+    sales_query = {"shop_id": shop_id}
+    purchases_query = {"shop_id": shop_id}
+    debts_query = {"shop_id": shop_id}
+    expenditures_query = {"shop_id": shop_id}
 
     # Date filters
     if filters.start_date:
@@ -55,10 +61,10 @@ def build_base_queries(filters: ReportFilters):
 
     return sales_query, purchases_query, debts_query, expenditures_query
 
-def get_customer_info(customer_id: str) -> Dict[str, Any]:
+def get_customer_info(customer_id: str, shop_id: str) -> Dict[str, Any]:
     """Get customer information by ID"""
     if customer_id and customer_id.strip():
-        customer_doc = customers_collection.find_one({"id": customer_id.strip()})
+        customer_doc = reporting(customers_collection).find_one({"shop_id": shop_id, "id": customer_id.strip()})
         if customer_doc:
             return {
                 "id": customer_doc["id"],
@@ -68,10 +74,10 @@ def get_customer_info(customer_id: str) -> Dict[str, Any]:
             }
     return None
 
-def get_product_info(product_id: int) -> Dict[str, Any]:
+def get_product_info(product_id: int, shop_id: str) -> Dict[str, Any]:
     """Get product information by ID"""
     if product_id:
-        product_doc = products_collection.find_one({"id": product_id})
+        product_doc = reporting(products_collection).find_one({"shop_id": shop_id, "id": product_id})
         if product_doc:
             return {
                 "id": product_doc["id"],
@@ -81,14 +87,14 @@ def get_product_info(product_id: int) -> Dict[str, Any]:
             }
     return None
 
-def apply_entity_filters(filters: ReportFilters, sales_query: Dict, purchases_query: Dict, debts_query: Dict):
+def apply_entity_filters(filters: ReportFilters, sales_query: Dict, purchases_query: Dict, debts_query: Dict, shop_id: str):
     """Apply entity filters and return entity info for report title"""
     entity_info = None
     entity_type = None
     
     # Customer filter
     if filters.customer_id and filters.customer_id.strip():
-        customer_info = get_customer_info(filters.customer_id)
+        customer_info = get_customer_info(filters.customer_id, shop_id)
         if not customer_info:
             raise HTTPException(status_code=404, detail=f"Customer with ID {filters.customer_id} not found")
         
@@ -99,7 +105,7 @@ def apply_entity_filters(filters: ReportFilters, sales_query: Dict, purchases_qu
     
     # Product filter
     elif filters.product_id:
-        product_info = get_product_info(filters.product_id)
+        product_info = get_product_info(filters.product_id, shop_id)
         if not product_info:
             raise HTTPException(status_code=404, detail=f"Product with ID {filters.product_id} not found")
         
@@ -163,7 +169,7 @@ def calculate_financial_metrics(sales_data: List, purchases_data: List, debts_da
     
     return total_sales, total_purchases, total_debts, total_expenditures, net_profit
 
-def calculate_customer_metrics(sales_data: List, is_customer_specific: bool = False):
+def calculate_customer_metrics(sales_data: List, shop_id: str, is_customer_specific: bool = False):
     """Calculate customer-related metrics"""
     # For customer-specific reports, don't calculate best/worst customer
     if is_customer_specific:
@@ -184,15 +190,15 @@ def calculate_customer_metrics(sales_data: List, is_customer_specific: bool = Fa
             best_customer_id = max(customer_totals, key=customer_totals.get)
             worst_customer_id = min(customer_totals, key=customer_totals.get)
             
-            best_customer_doc = customers_collection.find_one({"id": best_customer_id})
-            worst_customer_doc = customers_collection.find_one({"id": worst_customer_id})
+            best_customer_doc = reporting(customers_collection).find_one({"shop_id": shop_id, "id": best_customer_id})
+            worst_customer_doc = reporting(customers_collection).find_one({"shop_id": shop_id, "id": worst_customer_id})
             
             best_customer = best_customer_doc["name"] if best_customer_doc else best_customer_id
             worst_customer = worst_customer_doc["name"] if worst_customer_doc else worst_customer_id
     
     return total_customers, best_customer, worst_customer
 
-def calculate_product_metrics(sales_data: List, is_product_specific: bool = False):
+def calculate_product_metrics(sales_data: List, shop_id: str, is_product_specific: bool = False):
     """Calculate product-related metrics"""
     total_products_sold = sum(
         item.get("quantity", 0) 
@@ -218,8 +224,8 @@ def calculate_product_metrics(sales_data: List, is_product_specific: bool = Fals
             most_pid = max(product_counts, key=product_counts.get)
             least_pid = min(product_counts, key=product_counts.get)
             
-            most_product_doc = products_collection.find_one({"id": int(most_pid)})
-            least_product_doc = products_collection.find_one({"id": int(least_pid)})
+            most_product_doc = reporting(products_collection).find_one({"shop_id": shop_id, "id": int(most_pid)})
+            least_product_doc = reporting(products_collection).find_one({"shop_id": shop_id, "id": int(least_pid)})
             
             most_sold_product = most_product_doc["name"] if most_product_doc else str(most_pid)
             least_sold_product = least_product_doc["name"] if least_product_doc else str(least_pid)
@@ -241,8 +247,249 @@ def determine_report_type(filters: ReportFilters):
     
     return ReportType.CUSTOM
 
-@router.post("/report", response_model=ReportSummary)
-async def generate_report(filters: ReportFilters = ReportFilters()):
+def build_applied_filters(filters: ReportFilters) -> Dict[str, Any]:
+    """Echo back the filters that were actually set"""
+    applied_filters = {}
+    if filters.start_date:
+        applied_filters["start_date"] = filters.start_date
+    if filters.end_date:
+        applied_filters["end_date"] = filters.end_date
+    if filters.category:
+        applied_filters["category"] = filters.category
+    if filters.customer_id:
+        applied_filters["customer_id"] = filters.customer_id
+    if filters.product_id:
+        applied_filters["product_id"] = filters.product_id
+    if filters.min_amount is not None:
+        applied_filters["min_amount"] = filters.min_amount
+    if filters.max_amount is not None:
+        applied_filters["max_amount"] = filters.max_amount
+    return applied_filters
+
+def previous_window(filters: ReportFilters, report_type: ReportType) -> Tuple[datetime, datetime]:
+    """
+    The equivalent window one period earlier (day, week, calendar month, year, or same length).
+
+    The end may touch the current start_date; callers treat it as exclusive then.
+    """
+    start, end = filters.start_date, filters.end_date
+    if report_type == ReportType.DAILY:
+        return start - timedelta(days=1), end - timedelta(days=1)
+    if report_type == ReportType.WEEKLY:
+        return start - timedelta(days=7), end - timedelta(days=7)
+    if report_type == ReportType.MONTHLY:
+        return shift_months(start, -1), shift_months(end, -1)
+    if report_type == ReportType.YEARLY:
+        return shift_months(start, -12), shift_months(end, -12)
+    length = end - start
+    return start - length, start
+
+def period_facets(windows: Dict[str, Dict], pipeline: List[Dict]) -> Dict[str, List[Dict]]:
+    """Run the same sub-pipeline once per period inside a single $facet stage"""
+    return {
+        f"{period}_{name}": [{"$match": {"created_at": window}}] + stages
+        for period, window in windows.items()
+        for name, stages in pipeline
+    }
+
+def summarize_period(period: str, sales: Dict, purchases: Dict, debts: Dict, expenditures: Dict,
+                     is_customer_specific: bool, is_product_specific: bool) -> Dict[str, Any]:
+    """Turn one period's facet results into ReportSummary fields (names resolved later)"""
+    def first(result: Dict, name: str) -> Dict:
+        rows = result.get(f"{period}_{name}", [])
+        return rows[0] if rows else {}
+
+    sales_totals = first(sales, "totals")
+    customers = first(sales, "customers")
+    products = first(sales, "products")
+    sales_count = sales_totals.get("count", 0)
+    purchases_totals = first(purchases, "totals")
+
+    total_sales = sales_totals.get("total", 0.0)
+    total_purchases = purchases_totals.get("total", 0.0)
+    total_debts = first(debts, "totals").get("total", 0.0)
+    # same definition as calculate_financial_metrics
+    total_expenditures = total_purchases + total_debts + first(expenditures, "totals").get("total", 0.0)
+
+    return {
+        "total_sales": total_sales,
+        "total_purchases": total_purchases,
+        "total_debts": total_debts,
+        "total_expenditures": total_expenditures,
+        "net_profit": total_sales - total_expenditures,
+        "total_customers": 1 if is_customer_specific else customers.get("count", 0),
+        "best_customer": None if is_customer_specific else customers.get("best"),
+        "worst_customer": None if is_customer_specific else customers.get("worst"),
+        "total_products_sold": sales_totals.get("units", 0),
+        "most_sold_product": None if is_product_specific else products.get("best"),
+        "least_sold_product": None if is_product_specific else products.get("worst"),
+        "average_sale_amount": total_sales / sales_count if sales_count else 0.0,
+        "total_transactions": sales_count + purchases_totals.get("count", 0),
+    }
+
+COMPARED_METRICS = [
+    "total_sales", "total_purchases", "total_debts", "total_expenditures", "net_profit",
+    "total_products_sold", "total_customers", "average_sale_amount", "total_transactions",
+]
+
+def generate_comparison_report(filters: ReportFilters, shop_id: str) -> ReportComparison:
+    """
+    Current window vs the previous equivalent window.
+
+    Each period reads each collection with one aggregation whose $facet
+    computes all of its sections. The current period is required and runs
+    under REQUIRED_SHARE of the time budget; the previous period and the name
+    lookups are optional and, when they run out of time, the comparison is
+    returned without them and flagged as degraded (like the plain report).
+    """
+    if not (filters.start_date and filters.end_date):
+        raise HTTPException(status_code=400, detail="Comparison reports need both start_date and end_date")
+
+    report_type = determine_report_type(filters)
+    previous_start, previous_end = previous_window(filters, report_type)
+    # The previous window never reaches into the current one: a sale at exactly start_date counts once
+    if previous_end >= filters.start_date:
+        previous_range = {"$gte": previous_start, "$lt": filters.start_date}
+    else:
+        previous_range = {"$gte": previous_start, "$lte": previous_end}
+    windows = {
+        "current": {"$gte": filters.start_date, "$lte": filters.end_date},
+        "previous": previous_range,
+    }
+
+    # Same filters as the plain report, minus the dates which are applied per period
+    undated = filters.model_copy(update={"start_date": None, "end_date": None})
+    sales_query, purchases_query, debts_query, expenditures_query = build_base_queries(undated, shop_id)
+    entity_info, entity_type = apply_entity_filters(undated, sales_query, purchases_query, debts_query, shop_id)
+    is_customer_specific = entity_type == "customer"
+    is_product_specific = entity_type == "product"
+
+    totals = ("totals", [{"$group": {"_id": None, "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}])
+
+    sales_pipeline = [
+        ("totals", [{"$group": {
+            "_id": None,
+            "total": {"$sum": "$total_amount"},
+            "count": {"$sum": 1},
+            "units": {"$sum": {"$sum": "$items.quantity"}},
+        }}]),
+        ("customers", [
+            {"$group": {"_id": "$customer_id", "total": {"$sum": "$total_amount"}}},
+            {"$sort": {"total": -1}},
+            {"$group": {"_id": None, "count": {"$sum": 1}, "best": {"$first": "$_id"}, "worst": {"$last": "$_id"}}},
+        ]),
+        ("products", [
+            {"$unwind": "$items"},
+            {"$group": {"_id": "$items.product_id", "quantity": {"$sum": "$items.quantity"}}},
+            {"$sort": {"quantity": -1}},
+            {"$group": {"_id": None, "best": {"$first": "$_id"}, "worst": {"$last": "$_id"}}},
+        ]),
+    ]
+
+    def run(period: str, name: str, collection, query: Dict, pipeline: List) -> Dict:
+        window = windows[period]
+        match = {"$match": {**query, "created_at": window}}
+        # The window may lie (partly) in archived months; the facets need whole documents
+        archived = [union_archive(name, [match])] if reaches_archive(name, shop_id, window["$gte"]) else []
+        result = list(reporting(collection).aggregate([
+            match,
+            *archived,
+            {"$facet": period_facets({period: window}, pipeline)},
+        ], allowDiskUse=True))
+        return result[0] if result else {}
+
+    def read_period(period: str) -> Dict[str, Any]:
+        sales = run(period, "sales", sales_collection, sales_query, sales_pipeline)
+        purchases = run(period, "purchases", purchases_collection, purchases_query, [
+            ("totals", [{"$group": {"_id": None, "total": {"$sum": "$total_amount"}, "count": {"$sum": 1}}}]),
+        ])
+        debts = run(period, "debts", debts_collection, debts_query, [totals])
+        expenditures = run(period, "expenditures", expenditures_collection, expenditures_query, [totals])
+        return summarize_period(period, sales, purchases, debts, expenditures,
+                                is_customer_specific, is_product_specific)
+
+    # The current period is required; the previous one gets half of what is left, so the
+    # name lookups keep their own share. Without it the comparison has no deltas.
+    missing = []
+    with spend_at_most(REQUIRED_SHARE):
+        periods = {"current": read_period("current")}
+    try:
+        with spend_at_most(0.5):
+            periods["previous"] = read_period("previous")
+    except ExecutionTimeout:
+        record_timeout(degraded=True)
+        missing.append("previous")
+        periods["previous"] = summarize_period("previous", {}, {}, {}, {}, is_customer_specific, is_product_specific)
+
+    # Resolve best/worst ids to names with one query per collection; without them the
+    # comparison still has every total
+    try:
+        customer_ids = {p[key] for p in periods.values() for key in ("best_customer", "worst_customer") if p[key]}
+        product_ids = {p[key] for p in periods.values() for key in ("most_sold_product", "least_sold_product") if p[key]}
+        customer_names = {doc["id"]: doc["name"] for doc in reporting(customers_collection).find(
+            {"shop_id": shop_id, "id": {"$in": list(customer_ids)}}, {"_id": 0, "id": 1, "name": 1})} if customer_ids else {}
+        product_names = {doc["id"]: doc["name"] for doc in reporting(products_collection).find(
+            {"shop_id": shop_id, "id": {"$in": list(product_ids)}}, {"_id": 0, "id": 1, "name": 1})} if product_ids else {}
+        for values in periods.values():
+            for key in ("best_customer", "worst_customer"):
+                if values[key]:
+                    values[key] = customer_names.get(values[key], values[key])
+            for key in ("most_sold_product", "least_sold_product"):
+                if values[key]:
+                    values[key] = product_names.get(values[key], str(values[key]))
+    except ExecutionTimeout:
+        record_timeout(degraded=True)
+        missing.append("rankings")
+        for values in periods.values():
+            for key in ("best_customer", "worst_customer", "most_sold_product", "least_sold_product"):
+                values[key] = None
+
+    generated_at = datetime.now(timezone.utc)
+    previous_filters = filters.model_copy(update={"start_date": previous_start, "end_date": previous_end})
+    current = ReportSummary(
+        **periods["current"],
+        report_type=report_type,
+        report_title=generate_report_title(filters, entity_info, entity_type, report_type),
+        applied_filters=build_applied_filters(filters),
+        generated_at=generated_at,
+    )
+    previous = ReportSummary(
+        **periods["previous"],
+        report_type=report_type,
+        report_title=generate_report_title(previous_filters, entity_info, entity_type, report_type),
+        applied_filters=build_applied_filters(previous_filters),
+        generated_at=generated_at,
+        degraded="previous" in missing,
+        missing=["totals"] if "previous" in missing else [],
+    )
+
+    deltas = {}
+    percent_changes = {}
+    compared = [] if "previous" in missing else COMPARED_METRICS
+    for metric in compared:
+        now, before = getattr(current, metric), getattr(previous, metric)
+        deltas[metric] = now - before
+        percent_changes[metric] = (now - before) / abs(before) * 100 if before else None
+
+    return ReportComparison(
+        current=current,
+        previous=previous,
+        previous_start_date=previous_start,
+        previous_end_date=previous_end,
+        deltas=deltas,
+        percent_changes=percent_changes,
+        degraded=bool(missing),
+        missing=missing,
+    )
+
+# Report handlers are plain def on purpose: FastAPI runs them on the threadpool, so the
+# blocking aggregations don't hold up checkout requests on the event loop
+@router.post("/report", response_model=Union[ReportSummary, ReportComparison])
+def generate_report(
+    filters: ReportFilters = ReportFilters(),
+    compare: bool = False,
+    shop_id: str = Depends(get_shop_id),
+):
     """
     Generate comprehensive business report with optional filters.
     
@@ -258,19 +505,48 @@ async def generate_report(filters: ReportFilters = ReportFilters()):
     - **product_id**: Filter by specific product
     - **min_amount**: Minimum transaction amount
     - **max_amount**: Maximum transaction amount
+    - **compare** (query): also compute the previous equivalent period and return
+      both summaries with deltas and percentage changes
     """
     try:
-        # Build base queries
-        sales_query, purchases_query, debts_query, expenditures_query = build_base_queries(filters)
-        
-        # Apply entity-specific filters and get entity info for report title
-        entity_info, entity_type = apply_entity_filters(filters, sales_query, purchases_query, debts_query)
-        
-        # Fetch data from all collections
-        sales_data = list(sales_collection.find(sales_query, {"_id": 0}))
-        purchases_data = list(purchases_collection.find(purchases_query, {"_id": 0}))
-        debts_data = list(debts_collection.find(debts_query, {"_id": 0}))
-        expenditures_data = list(expenditures_collection.find(expenditures_query, {"_id": 0}))
+        if compare:
+            return generate_comparison_report(filters, shop_id)
+
+        # The hot data is required; it may only use part of the time budget so the
+        # optional sections below get a chance even when it was slow
+        with spend_at_most(REQUIRED_SHARE):
+            # Build base queries
+            sales_query, purchases_query, debts_query, expenditures_query = build_base_queries(filters, shop_id)
+
+            # Apply entity-specific filters and get entity info for report title
+            entity_info, entity_type = apply_entity_filters(filters, sales_query, purchases_query, debts_query, shop_id)
+
+            # Fetch data from all collections
+            sales_data = list(reporting(sales_collection).find(sales_query, {"_id": 0}))
+            purchases_data = list(reporting(purchases_collection).find(purchases_query, {"_id": 0}))
+            debts_data = list(reporting(debts_collection).find(debts_query, {"_id": 0}))
+            expenditures_data = list(reporting(expenditures_collection).find(expenditures_query, {"_id": 0}))
+
+        # Plus whatever the archive holds for the same window (monthly summaries where possible);
+        # if that runs out of time the report covers the hot data only and says so. It gets
+        # half of what is left, so the rankings keep their own share.
+        missing = []
+        try:
+            with spend_at_most(0.5):
+                archived = [
+                    archived_records("sales", shop_id, sales_query),
+                    archived_records("purchases", shop_id, purchases_query),
+                    archived_records("debts", shop_id, debts_query),
+                    archived_records("expenditures", shop_id, expenditures_query),
+                ]
+        except ExecutionTimeout:
+            record_timeout(degraded=True)
+            missing.append("archive")
+        else:
+            sales_data += archived[0]
+            purchases_data += archived[1]
+            debts_data += archived[2]
+            expenditures_data += archived[3]
         
         # Calculate metrics
         total_sales, total_purchases, total_debts, total_expenditures, net_profit = calculate_financial_metrics(
@@ -281,37 +557,32 @@ async def generate_report(filters: ReportFilters = ReportFilters()):
         is_customer_specific = entity_type == "customer"
         is_product_specific = entity_type == "product"
         
-        total_customers, best_customer, worst_customer = calculate_customer_metrics(
-            sales_data, is_customer_specific
-        )
-        total_products_sold, most_sold_product, least_sold_product = calculate_product_metrics(
-            sales_data, is_product_specific
-        )
+        # Rankings need name lookups; without them the report still has every total
+        try:
+            total_customers, best_customer, worst_customer = calculate_customer_metrics(
+                sales_data, shop_id, is_customer_specific
+            )
+            total_products_sold, most_sold_product, least_sold_product = calculate_product_metrics(
+                sales_data, shop_id, is_product_specific
+            )
+        except ExecutionTimeout:
+            record_timeout(degraded=True)
+            missing.append("rankings")
+            best_customer = worst_customer = most_sold_product = least_sold_product = None
+            total_customers = 1 if is_customer_specific else len({sale["customer_id"] for sale in sales_data if sale.get("customer_id")})
+            total_products_sold = sum(item.get("quantity", 0) for sale in sales_data for item in sale.get("items", []))
         
         # Calculate additional metrics
-        average_sale_amount = total_sales / len(sales_data) if sales_data else 0.0
-        total_transactions = len(sales_data) + len(purchases_data)
+        sales_count = record_count(sales_data)
+        average_sale_amount = total_sales / sales_count if sales_count else 0.0
+        total_transactions = sales_count + record_count(purchases_data)
         
         # Determine report type and generate title
         report_type = determine_report_type(filters)
         report_title = generate_report_title(filters, entity_info, entity_type, report_type)
         
         # Build applied filters info
-        applied_filters = {}
-        if filters.start_date:
-            applied_filters["start_date"] = filters.start_date
-        if filters.end_date:
-            applied_filters["end_date"] = filters.end_date
-        if filters.category:
-            applied_filters["category"] = filters.category
-        if filters.customer_id:
-            applied_filters["customer_id"] = filters.customer_id
-        if filters.product_id:
-            applied_filters["product_id"] = filters.product_id
-        if filters.min_amount is not None:
-            applied_filters["min_amount"] = filters.min_amount
-        if filters.max_amount is not None:
-            applied_filters["max_amount"] = filters.max_amount
+        applied_filters = build_applied_filters(filters)
         
         # Construct and return report
         report = ReportSummary(
@@ -331,20 +602,100 @@ async def generate_report(filters: ReportFilters = ReportFilters()):
             report_type=report_type,
             report_title=report_title,
             applied_filters=applied_filters,
-            generated_at=datetime.now(timezone.utc)
+            generated_at=datetime.now(timezone.utc),
+            degraded=bool(missing),
+            missing=missing,
         )
         
         return report
         
-    except HTTPException:
+    except (HTTPException, ExecutionTimeout):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating report: {str(e)}")
 
 @router.get("/report/general", response_model=ReportSummary)
-async def get_general_report():
+def get_general_report(shop_id: str = Depends(get_shop_id)):
     """
     Generate a general overview report without any filters.
     This provides a high-level summary of the entire business.
     """
-    return await generate_report(ReportFilters())
\ No newline at end of file
+    return generate_report(ReportFilters(), shop_id=shop_id)
+
+def margin_percent(revenue: float, cost: float) -> Optional[float]:
+    return (revenue - cost) / revenue * 100 if revenue else None
+
+@router.get("/report/margins", response_model=MarginReport)
+def get_margin_report(
+    group_by: Literal["product", "category"] = "product",
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    shop_id: str = Depends(get_shop_id),
+):
+    """
+    Gross margin per product or per category, from the cost captured on each
+    sale line at sale time (one aggregation, no product lookups).
+    """
+    match = {"shop_id": shop_id}
+    if start_date or end_date:
+        match["created_at"] = {}
+        if start_date:
+            match["created_at"]["$gte"] = start_date
+        if end_date:
+            match["created_at"]["$lte"] = end_date
+
+    key = "$items.product_id" if group_by == "product" else {"$ifNull": ["$items.category", "uncategorized"]}
+    has_cost = {"items.cost_price": {"$ne": None}}
+    sums = {
+        "units_sold": {"$sum": "$items.quantity"},
+        "revenue": {"$sum": "$items.total_price"},
+        "cost": {"$sum": {"$ifNull": ["$items.total_cost", {"$multiply": ["$items.cost_price", "$items.quantity"]}]}},
+    }
+
+    result = next(reporting(sales_collection).aggregate([
+        {"$match": match},
+        {"$unwind": "$items"},
+        {"$facet": {
+            "rows": [
+                {"$match": has_cost},
+                {"$group": {"_id": key, "name": {"$last": "$items.product_name"}, **sums}},
+                {"$addFields": {"gross_profit": {"$subtract": ["$revenue", "$cost"]}}},
+                {"$sort": {"gross_profit": -1}},
+                {"$limit": limit},
+            ],
+            "totals": [
+                {"$match": has_cost},
+                {"$group": {"_id": None, **sums}},
+            ],
+            "missing": [
+                {"$match": {"items.cost_price": None}},
+                {"$count": "lines"},
+            ],
+        }},
+    ], allowDiskUse=True), {"rows": [], "totals": [], "missing": []})
+
+    rows = [
+        MarginRow(
+            key=str(row["_id"]),
+            name=row.get("name") if group_by == "product" else str(row["_id"]),
+            units_sold=row["units_sold"],
+            revenue=row["revenue"],
+            cost=row["cost"],
+            gross_profit=row["gross_profit"],
+            margin_percent=margin_percent(row["revenue"], row["cost"]),
+        )
+        for row in result["rows"]
+    ]
+    totals = result["totals"][0] if result["totals"] else {"revenue": 0.0, "cost": 0.0}
+    return MarginReport(
+        group_by=group_by,
+        start_date=start_date,
+        end_date=end_date,
+        total_revenue=totals["revenue"],
+        total_cost=totals["cost"],
+        gross_profit=totals["revenue"] - totals["cost"],
+        margin_percent=margin_percent(totals["revenue"], totals["cost"]),
+        lines_without_cost=result["missing"][0]["lines"] if result["missing"] else 0,
+        rows=rows,
+    )
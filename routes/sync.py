@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, Query
+from typing import Literal
+from schema.sync import SyncResponse, Tombstone
+from utils.sync import changes_since
+from auth.auth import get_shop_id
+
+router = APIRouter()
+
+
+# Delta sync for terminals: only what was written or deleted after `since`
+@router.get("/sync/{collection}", response_model=SyncResponse)
+def sync_collection(
+    collection: Literal["products", "customers"],
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=5000),
+    shop_id: str = Depends(get_shop_id),
+):
+    changes = changes_since(shop_id, collection, since, limit)
+    return SyncResponse(
+        collection=collection,
+        since=since,
+        version=changes["version"],
+        has_more=changes["has_more"],
+        changed=changes["changed"],
+        deleted=[Tombstone(**doc) for doc in changes["deleted"]],
+    )
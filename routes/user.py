@@ -5,11 +5,11 @@ from typing import List
 from pydantic import BaseModel
 
 from database.config import users_collection
-from schema.user import Usercreate, UserInResponse, Userupdate
+from schema.user import Usercreate, UserInResponse, Userupdate, UserRole
 from schema.token import Token, TokenData
 from utils.hashing import hash_password, verify_password
 from utils.idincrement import increment_id
-from auth.auth import create_access_token, decode_access_token
+from auth.auth import create_access_token, decode_access_token, optional_oauth2_scheme, require_admin, DEFAULT_SHOP_ID
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
@@ -23,7 +23,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> TokenData:
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
         )
-    return TokenData(username=payload.get("sub"))
+    return TokenData(username=payload.get("sub"), role=payload.get("role", "user"), shop_id=payload.get("shop") or DEFAULT_SHOP_ID)
 
 
 # Login
@@ -36,13 +36,15 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     if not verify_password(form_data.password, user["hashed_password"]):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
 
-    access_token = create_access_token(data={"sub": user["username"]})
+    access_token = create_access_token(data={
+        "sub": user["username"],
+        "shop": user.get("shop_id") or DEFAULT_SHOP_ID,
+        "role": user.get("role", "user"),
+    })
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-# Create user
-@router.post("/user", response_model=UserInResponse)
-async def create_user(user: Usercreate):
+def _insert_user(user: Usercreate, shop_id: str, role: str) -> UserInResponse:
     if users_collection.find_one({"username": user.username}):
         raise HTTPException(status_code=400, detail="Username already exists")
 
@@ -51,15 +53,42 @@ async def create_user(user: Usercreate):
     plain_password = user_dict.pop("password")
     user_dict["id"] = new_user_id
     user_dict["hashed_password"] = hash_password(plain_password)
+    user_dict["shop_id"] = shop_id
+    user_dict["role"] = role
 
     users_collection.insert_one(user_dict)
-    return UserInResponse(**{k: v for k, v in user_dict.items() if k != "hashed_password"})
+    return UserInResponse(**{k: v for k, v in user_dict.items() if k not in ("hashed_password", "_id")})
+
+
+# Create user: the very first user becomes admin of the main shop; after that an
+# admin creates users (or further admins) and they join the admin's shop
+@router.post("/user", response_model=UserInResponse)
+async def create_user(user: Usercreate, token: str | None = Depends(optional_oauth2_scheme)):
+    if users_collection.count_documents({}, limit=1) == 0:
+        return _insert_user(user, DEFAULT_SHOP_ID, UserRole.admin.value)
+
+    admin = await require_admin(token)
+    return _insert_user(user, admin.get("shop") or DEFAULT_SHOP_ID, user.role.value)
+
+
+# Create shop: an admin of the main shop opens a new shop together with its first admin
+class ShopCreate(BaseModel):
+    shop_id: str
+    admin: Usercreate
+
+@router.post("/shops", response_model=UserInResponse)
+async def create_shop(shop: ShopCreate, admin: dict = Depends(require_admin)):
+    if (admin.get("shop") or DEFAULT_SHOP_ID) != DEFAULT_SHOP_ID:
+        raise HTTPException(status_code=403, detail="Only admins of the main shop can create shops")
+    if users_collection.find_one({"shop_id": shop.shop_id}):
+        raise HTTPException(status_code=400, detail="Shop already exists")
+    return _insert_user(shop.admin, shop.shop_id, UserRole.admin.value)
 
 
 # Get all users
 @router.get("/users", response_model=List[UserInResponse])
 async def get_users(current_user: TokenData = Depends(get_current_user)):
-    users = users_collection.find({}, {"_id": 0, "hashed_password": 0})
+    users = users_collection.find({"shop_id": current_user.shop_id}, {"_id": 0, "hashed_password": 0})
     user_list = [UserInResponse(**user) for user in users]
     if not user_list:
         raise HTTPException(status_code=404, detail="No users found")
@@ -69,21 +98,32 @@ async def get_users(current_user: TokenData = Depends(get_current_user)):
 # Get user by ID
 @router.get("/users/{user_id}", response_model=UserInResponse)
 async def get_user(user_id: str, current_user: TokenData = Depends(get_current_user)):
-    user = users_collection.find_one({"id": user_id}, {"_id": 0, "hashed_password": 0})
+    user = users_collection.find_one({"shop_id": current_user.shop_id, "id": user_id}, {"_id": 0, "hashed_password": 0})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return UserInResponse(**user)
 
 
+# Admins manage every user of their shop; other users only themselves
+def require_self_or_admin(user_id: str, current_user: TokenData) -> dict:
+    target = users_collection.find_one({"shop_id": current_user.shop_id, "id": user_id})
+    if not target:
+        raise HTTPException(status_code=404, detail="User not found")
+    if current_user.role != UserRole.admin.value and target["username"] != current_user.username:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return target
+
+
 # Update user
 @router.put("/users/{user_id}", response_model=UserInResponse)
 async def update_user(user_id: str, user: Userupdate, current_user: TokenData = Depends(get_current_user)):
+    require_self_or_admin(user_id, current_user)
     update_data = user.model_dump(exclude_unset=True)
     if "password" in update_data:
         update_data.pop("password")
 
     updated_user = users_collection.find_one_and_update(
-        {"id": user_id},
+        {"shop_id": current_user.shop_id, "id": user_id},
         {"$set": update_data},
         return_document=ReturnDocument.AFTER,
         projection={"_id": 0, "hashed_password": 0}
@@ -99,12 +139,11 @@ class PasswordChange(BaseModel):
 
 @router.put("/users/{user_id}/change-password", response_model=UserInResponse)
 async def change_password(user_id: str, payload: PasswordChange, current_user: TokenData = Depends(get_current_user)):
-    if not users_collection.find_one({"id": user_id}):
-        raise HTTPException(status_code=404, detail="User not found")
+    require_self_or_admin(user_id, current_user)
 
     hashed_password = hash_password(payload.new_password)
     updated_user = users_collection.find_one_and_update(
-        {"id": user_id},
+        {"shop_id": current_user.shop_id, "id": user_id},
         {"$set": {"hashed_password": hashed_password}},
         return_document=ReturnDocument.AFTER,
         projection={"_id": 0, "hashed_password": 0}
@@ -115,7 +154,12 @@ async def change_password(user_id: str, payload: PasswordChange, current_user: T
 # Delete user
 @router.delete("/users/{user_id}", response_model=UserInResponse)
 async def delete_user(user_id: str, current_user: TokenData = Depends(get_current_user)):
-    deleted_user = users_collection.find_one_and_delete({"id": user_id}, projection={"_id": 0, "hashed_password": 0})
+    if current_user.role != UserRole.admin.value:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if users_collection.find_one({"shop_id": current_user.shop_id, "id": user_id, "username": current_user.username}):
+        # Keeps at least one admin in the shop
+        raise HTTPException(status_code=400, detail="Admins cannot delete themselves")
+    deleted_user = users_collection.find_one_and_delete({"shop_id": current_user.shop_id, "id": user_id}, projection={"_id": 0, "hashed_password": 0})
     if not deleted_user:
         raise HTTPException(status_code=404, detail="User not found")
     return UserInResponse(**deleted_user)
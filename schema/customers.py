@@ -1,11 +1,30 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Literal, Optional
 from datetime import datetime, timezone
 
 class Customer(BaseModel):
     id: str
+    shop_id: Optional[str] = None  # set from the authenticated user
     name:str
     phone:str
     address: Optional[str]
     balance: float=0
-    created_at: datetime =datetime.now(timezone.utc)
\ No newline at end of file
+    created_at: datetime =datetime.now(timezone.utc)
+
+class StatementEntry(BaseModel):
+    date: datetime
+    type: Literal["sale", "debt", "payment"]
+    reference_id: str  # sale id, debt id, or "<debt id>:<payment index>"
+    description: str
+    amount: float
+    balance_change: float  # what this entry adds to what the customer owes
+    balance: float  # running balance after this entry
+
+
+class CustomerStatement(BaseModel):
+    customer_id: str
+    customer_name: str
+    opening_balance: float
+    closing_balance: float
+    entries: List[StatementEntry]
+    next_cursor: Optional[str] = None
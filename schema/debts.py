@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime, timezone
 
@@ -6,9 +6,11 @@ class DebtPayment(BaseModel):
     amount: float
     date: datetime
     method: str  # e.g., "cash", "transfer"
+    payment_id: Optional[str] = None  # shared by every debt one customer payment was split over
 
 class Debt(BaseModel):
     id: str
+    shop_id: Optional[str] = None  # set from the authenticated user
     customer_name: str
     sale_id: str
     amount: float
@@ -17,3 +19,44 @@ class Debt(BaseModel):
     payment: List[DebtPayment] = []
     created_at: datetime = datetime.now(timezone.utc)
     updated_at: Optional[datetime] = None
+
+
+class AgingDebtor(BaseModel):
+    customer_name: str
+    outstanding: float
+    debt_count: int
+
+
+class AgingBucket(BaseModel):
+    label: str  # "0-30", "31-60", "61-90", "90+" (days since the debt was created)
+    total_outstanding: float = 0.0
+    debt_count: int = 0
+    top_debtors: List[AgingDebtor] = []
+
+
+class DebtAgingReport(BaseModel):
+    as_of: datetime
+    total_outstanding: float
+    buckets: List[AgingBucket]
+
+
+class CustomerPaymentRequest(BaseModel):
+    amount: float = Field(..., gt=0)
+    method: str = "cash"
+
+
+class PaymentAllocation(BaseModel):
+    debt_id: str
+    amount: float  # part of the payment applied to this debt
+    outstanding: float  # what is still owed on the debt afterwards (amount minus payments)
+    cleared: bool
+
+
+class CustomerPaymentResult(BaseModel):
+    payment_id: str
+    customer_id: str
+    amount: float
+    applied: float
+    unapplied: float  # more than the customer owed; nothing is stored for it
+    customer_balance: float
+    allocations: List[PaymentAllocation]
@@ -5,6 +5,7 @@ from datetime import datetime, timezone
 
 class Expenditure(BaseModel):
     id: str  # ID will be a string
+    shop_id: Optional[str] = None  # set from the authenticated user
     description: str
     amount: float
     date: datetime = datetime.now(timezone.utc)
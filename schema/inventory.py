@@ -0,0 +1,76 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional, Literal
+from datetime import datetime, timezone
+
+
+class StockMovement(BaseModel):
+    shop_id: Optional[str] = None
+    product_id: str
+    type: Literal["sale", "purchase", "adjustment", "return", "reservation", "release"]
+    quantity: int  # signed: negative when stock leaves
+    reference_id: Optional[str] = None  # sale / purchase id
+    note: Optional[str] = None
+    created_at: datetime = datetime.now(timezone.utc)
+
+
+class StockAdjustment(BaseModel):
+    product_id: str
+    quantity: int  # signed change, e.g. -2 for breakage, +1 for a recount
+    type: Literal["adjustment", "return"] = "adjustment"
+    note: Optional[str] = None
+
+
+class StockAtDate(BaseModel):
+    product_id: str
+    at: datetime
+    stock: int
+    snapshot_as_of: Optional[datetime] = None
+    movements_applied: int = 0
+
+
+class ReservationItem(BaseModel):
+    product_id: str
+    quantity: int = Field(gt=0)
+
+
+class CreateReservation(BaseModel):
+    items: List[ReservationItem]
+    ttl_seconds: int = Field(300, ge=10, le=3600)  # held stock returns to the shelf after this
+
+
+class Reservation(BaseModel):
+    id: str
+    shop_id: Optional[str] = None
+    items: List[ReservationItem]
+    status: Literal["active", "confirmed", "released", "expired"]
+    expires_at: datetime
+    sale_id: Optional[str] = None  # set once a sale confirms the reservation
+    created_at: datetime = datetime.now(timezone.utc)
+
+
+class ReorderSuggestion(BaseModel):
+    product_id: str
+    name: str
+    current_stock: int
+    low_stock_alert: Optional[int] = None
+    velocity: float  # units per day over the velocity window
+    moving_average_7: float
+    moving_average_28: float
+    trend: float  # 7-day over 28-day moving average, capped to [0.5, 2]
+    days_of_stock: Optional[float] = None  # None when the product is not selling
+    safety_stock: float
+    reorder_point: int
+    suggested_quantity: int
+    estimated_cost: float
+
+
+class SupplierReorder(BaseModel):
+    supplier: str
+    total_cost: float
+    products: List[ReorderSuggestion]
+
+
+class ReorderSuggestions(BaseModel):
+    generated_at: datetime
+    history_days: int
+    suppliers: List[SupplierReorder]
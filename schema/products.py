@@ -5,6 +5,7 @@ from pydantic import BaseModel
 
 class ProductSchema(BaseModel):
     id: str
+    shop_id: Optional[str] = None  # set from the authenticated user
     name: str
     category: str
     unit: str
@@ -19,3 +20,10 @@ class ProductSchema(BaseModel):
     model_config = {
         "arbitrary_types_allowed": True
     }
+
+
+class RelatedProduct(BaseModel):
+    product_id: str
+    name: str
+    count: int  # sales that contained both products
+    confidence: float  # share of this product's sales that also contained the other one
@@ -15,8 +15,53 @@ class PurchaseItem(BaseModel):
 
 class Purchase(BaseModel):
     id: str
+    shop_id: Optional[str] = None  # set from the authenticated user
     supplier: Optional[str] = None
     items: List[PurchaseItem]
     total_amount: Optional[float] = 0.0
     purchased_by: str
     created_at: datetime = datetime.now(timezone.utc)
+
+
+class SupplierSpend(BaseModel):
+    supplier: str  # "Unknown" for purchases recorded without one
+    total_spend: float
+    purchase_count: int
+    product_count: int
+    first_purchase: datetime
+    last_purchase: datetime
+
+
+class PricePoint(BaseModel):
+    date: datetime  # first purchase at this cost
+    cost_price: float
+    quantity: int  # bought at this cost before it changed
+
+
+class CostChange(BaseModel):
+    supplier: str
+    product_id: str
+    product_name: Optional[str] = None
+    date: datetime
+    old_cost: float
+    new_cost: float
+    change_pct: float
+
+
+class SupplierProductPrices(BaseModel):
+    supplier: str
+    product_id: str
+    product_name: Optional[str] = None
+    quantity: int
+    total_spend: float
+    average_cost: float
+    latest_cost: float
+    history: List[PricePoint]
+
+
+class SupplierAnalytics(BaseModel):
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    suppliers: List[SupplierSpend]
+    prices: List[SupplierProductPrices]
+    cost_changes: List[CostChange]  # newest first
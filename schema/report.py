@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime, timezone
 from enum import Enum
 
@@ -40,6 +40,10 @@ class ReportSummary(BaseModel):
     # Filter information
     applied_filters: Dict[str, Any] = {}
 
+    # Parts left out because their queries ran out of time ("rankings", "archive")
+    degraded: bool = False
+    missing: List[str] = []
+
 class ReportFilters(BaseModel):
     start_date: Optional[datetime] = None
     end_date: Optional[datetime] = None
@@ -47,4 +51,39 @@ class ReportFilters(BaseModel):
     customer_id: Optional[str] = None
     product_id: Optional[int] = None
     min_amount: Optional[float] = None
-    max_amount: Optional[float] = None
\ No newline at end of file
+    max_amount: Optional[float] = None
+
+class MarginRow(BaseModel):
+    key: str  # product id or category
+    name: Optional[str] = None
+    units_sold: int = 0
+    revenue: float = 0.0
+    cost: float = 0.0
+    gross_profit: float = 0.0
+    margin_percent: Optional[float] = None  # gross_profit / revenue × 100
+
+class MarginReport(BaseModel):
+    group_by: str
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    total_revenue: float = 0.0
+    total_cost: float = 0.0
+    gross_profit: float = 0.0
+    margin_percent: Optional[float] = None
+    # sale lines written before cost was captured are left out of the figures
+    lines_without_cost: int = 0
+    rows: List[MarginRow] = []
+
+class ReportComparison(BaseModel):
+    current: ReportSummary
+    previous: ReportSummary
+    previous_start_date: datetime
+    previous_end_date: datetime
+    # current - previous, per numeric metric
+    deltas: Dict[str, float] = {}
+    # (current - previous) / previous × 100; None when the previous value is 0
+    percent_changes: Dict[str, Optional[float]] = {}
+    # Parts left out because their queries ran out of time ("previous", "rankings");
+    # without the previous period there are no deltas
+    degraded: bool = False
+    missing: List[str] = []
@@ -10,19 +10,61 @@ class SaleItem(BaseModel):
     selling_price: float
     discount: float = 0.0
     total_price: float  # (selling_price - discount) × quantity
+    # snapshot of the product at sale time, for margin reporting
+    category: Optional[str] = None
+    cost_price: Optional[float] = None
+    total_cost: Optional[float] = None  # cost_price × quantity
 
 
 class CreateSale(BaseModel):
     customer_id: str
     items: List[SaleItem]
     payment_method: Literal["cash", "debt"]  # only two accepted values
+    reservation_id: Optional[str] = None  # stock held with POST /stock/reservations
 
 
 class Sale(BaseModel):
     id: str
+    shop_id: Optional[str] = None  # set from the authenticated user
     customer_id: str
     customer_name: Optional[str] = None
     items: List[SaleItem]
     payment_method: Literal["cash", "debt"]
     total_amount: float
     created_at: datetime = datetime.now(timezone.utc)
+    client_ref: Optional[str] = None  # terminal-side id of an offline sale
+    reservation_id: Optional[str] = None
+
+
+class TimeSeriesPoint(BaseModel):
+    bucket: datetime  # start of the bucket (UTC)
+    revenue: float = 0.0
+    sales_count: int = 0
+    units_sold: int = 0
+
+
+class SalesTimeSeries(BaseModel):
+    granularity: Literal["hour", "day", "week", "month"]
+    start: datetime
+    end: datetime
+    points: List[TimeSeriesPoint]
+
+
+class BatchSale(CreateSale):
+    client_ref: Optional[str] = None  # terminal-side id, makes re-uploads idempotent
+    created_at: Optional[datetime] = None  # when the terminal rang it up; defaults to now
+
+
+class SaleBatchResult(BaseModel):
+    index: int  # position in the uploaded array
+    client_ref: Optional[str] = None
+    status: Literal["created", "duplicate", "failed"]
+    sale_id: Optional[str] = None
+    detail: Optional[str] = None
+
+
+class SaleBatchResponse(BaseModel):
+    created: int
+    duplicates: int
+    failed: int
+    results: List[SaleBatchResult]
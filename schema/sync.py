@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+from typing import Any, Dict, List
+from datetime import datetime
+
+
+class Tombstone(BaseModel):
+    id: str
+    change_version: int
+    deleted_at: datetime
+
+
+class SyncResponse(BaseModel):
+    collection: str
+    since: int
+    version: int  # send back as `since` on the next call
+    has_more: bool  # call again right away with the new version
+    changed: List[Dict[str, Any]]  # full documents, upsert by id
+    deleted: List[Tombstone]  # remove these ids
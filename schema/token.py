@@ -6,4 +6,5 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: str
-    role: str | None = "user"
\ No newline at end of file
+    role: str | None = "user"
+    shop_id: str | None = None
\ No newline at end of file
@@ -12,6 +12,8 @@ class Usercreate(BaseModel):
     username: str
     email: EmailStr
     password: str   # plain password from client
+    role: UserRole = UserRole.user   # set by the creating admin; ignored for the bootstrap user
+    # no shop_id: new users join the shop of the admin creating them
 
 
 # ──────────────────────────────────────────────
@@ -29,6 +31,7 @@ class UserInDB(BaseModel):
     email: EmailStr
     hashed_password: str
     role: UserRole = UserRole.user
+    shop_id: str | None = None
 
 
 # ──────────────────────────────────────────────
@@ -38,6 +41,7 @@ class UserInResponse(BaseModel):
     username: str
     email: EmailStr
     role: UserRole = UserRole.user
+    shop_id: str | None = None
 
 
 # ──────────────────────────────────────────────
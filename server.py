@@ -0,0 +1,73 @@
+"""
+Production entrypoint: python server.py
+
+Everything is configured from the environment (a .env file works too):
+
+    HOST                      bind address (default 0.0.0.0)
+    PORT                      bind port (default 8080)
+    WEB_CONCURRENCY           worker processes (default: number of CPU cores)
+    LIMIT_CONCURRENCY         max concurrent connections per worker before 503 (default 200)
+    BACKLOG                   pending TCP connections the socket will queue (default 2048)
+    GRACEFUL_SHUTDOWN_TIMEOUT seconds to drain in-flight requests on SIGTERM (default 30)
+    KEEP_ALIVE_TIMEOUT        idle keep-alive seconds (default 5)
+    TRUSTED_PROXIES           reverse proxies (IPs/CIDRs, comma separated) whose
+                              X-Forwarded-For / X-Forwarded-Proto are honoured; the
+                              same setting the rate limiter uses (utils/limits.py).
+                              Unset: forwarded headers are ignored.
+
+Sizing workers:
+    Each worker is one event loop. The async routes call pymongo synchronously
+    on that loop, so they serve one Mongo round-trip at a time per worker (the
+    plain def report handlers run on the threadpool beside it). Start with one
+    worker per core and raise WEB_CONCURRENCY while p99 latency keeps
+    dropping under load; stop when CPU is saturated or Mongo becomes the
+    bottleneck. Going past 2x cores usually only adds memory and connection
+    pool pressure (every worker opens its own MongoClient pool).
+    Measure on the target box rather than copying numbers, e.g.
+
+        WEB_CONCURRENCY=4 python server.py &
+        wrk -t4 -c128 -d30s http://127.0.0.1:8080/products
+
+    and repeat for 1, 2, 4, 8 workers, keeping the count where requests/sec
+    stops improving. No reference figures are given here on purpose: they
+    depend on the box, the Mongo deployment and the data set.
+
+Graceful drain:
+    On SIGTERM uvicorn stops accepting connections, lets in-flight requests
+    finish for up to GRACEFUL_SHUTDOWN_TIMEOUT seconds, then exits; the
+    supervisor process waits for every worker before exiting itself.
+"""
+import os
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _int_env(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def main():
+    trusted_proxies = os.getenv("TRUSTED_PROXIES", "").strip()
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=_int_env("PORT", 8080),
+        workers=_int_env("WEB_CONCURRENCY", os.cpu_count() or 1),
+        loop="uvloop",
+        http="httptools",
+        limit_concurrency=_int_env("LIMIT_CONCURRENCY", 200),
+        backlog=_int_env("BACKLOG", 2048),
+        timeout_graceful_shutdown=_int_env("GRACEFUL_SHUTDOWN_TIMEOUT", 30),
+        timeout_keep_alive=_int_env("KEEP_ALIVE_TIMEOUT", 5),
+        # Only a listed proxy may rewrite the client address and scheme
+        proxy_headers=bool(trusted_proxies),
+        forwarded_allow_ips=trusted_proxies or None,
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
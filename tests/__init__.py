@@ -0,0 +1,188 @@
+"""
+Test package.
+
+    python -m pytest -q        (or python -m unittest discover tests)
+
+Without DATABASE_URL the suite runs against mongomock: MongoClient is swapped
+for mongomock's before database.config is imported, and the collections are
+plain mongomock collections (no time budgets, see tests/test_budget.py for
+those). $unionWith, which mongomock lacks, is emulated by running each union's
+pipeline on its own collection, a $group using $topN as $sort + $push +
+$slice, and timezone-aware datetimes in a pipeline are made naive UTC as
+they would be stored. find_one_and_update with `_id` projected out re-reads
+the document by its _id, as the server does, and $reduce is evaluated like $filter. A few tests need other server features and
+only run with DATABASE_URL pointing at a real deployment (tests/test_sync.py).
+"""
+import os
+import uuid
+import unittest
+from datetime import datetime, timezone
+from bson import ObjectId
+
+
+def _as_stored(value):
+    # BSON dates are UTC; mongomock keeps datetimes naive and cannot compare them with aware ones
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    if isinstance(value, dict):
+        return {k: _as_stored(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_as_stored(v) for v in value]
+    return value
+
+
+def _without_top_n(pipeline):
+    # {"$group": {..., "x": {"$topN": {n, sortBy, output}}}} -> $sort, $group with $push, $slice
+    rewritten = []
+    for stage in pipeline:
+        if "$facet" in stage:
+            stage = {"$facet": {name: _without_top_n(stages) for name, stages in stage["$facet"].items()}}
+        elif "$group" in stage and any(isinstance(v, dict) and "$topN" in v for v in stage["$group"].values()):
+            group, sliced = dict(stage["$group"]), {}
+            for field, accumulator in stage["$group"].items():
+                if isinstance(accumulator, dict) and "$topN" in accumulator:
+                    top = accumulator["$topN"]
+                    rewritten.append({"$sort": top["sortBy"]})
+                    group[field] = {"$push": top["output"]}
+                    sliced[field] = {"$slice": [f"${field}", top["n"]]}
+            rewritten += [{"$group": group}, {"$addFields": sliced}]
+            continue
+        rewritten.append(stage)
+    return rewritten
+
+
+def _aggregate_with_unions(aggregate):
+    def run(collection, pipeline, *args, **kwargs):
+        pipeline = _without_top_n(_as_stored(pipeline))
+        if not any("$unionWith" in stage for stage in pipeline):
+            return aggregate(collection, pipeline, *args, **kwargs)
+        first = next(i for i, stage in enumerate(pipeline) if "$unionWith" in stage)
+        docs = list(aggregate(collection, pipeline[:first]))
+        stages = pipeline[first:]
+        while stages:
+            if "$unionWith" in stages[0]:
+                union = stages.pop(0)["$unionWith"]
+                docs += list(collection.database[union["coll"]].aggregate(union.get("pipeline", [])))
+                continue
+            run_length = next((i for i, stage in enumerate(stages) if "$unionWith" in stage), len(stages))
+            docs = _over(collection, docs, stages[:run_length], aggregate)
+            stages = stages[run_length:]
+        return iter(docs)
+    return run
+
+
+def _over(collection, docs, stages, aggregate):
+    # Run `stages` over documents that are already in memory, via a scratch collection
+    scratch = collection.database[f"scratch_{uuid.uuid4().hex}"]
+    added = set()
+    for doc in docs:
+        if "_id" not in doc:
+            doc = {**doc, "_id": ObjectId()}
+            added.add(doc["_id"])
+        scratch.insert_one(doc)
+    try:
+        result = list(aggregate(scratch, stages))
+    finally:
+        scratch.drop()
+    return [{k: v for k, v in doc.items() if k != "_id"} if isinstance(doc.get("_id"), ObjectId) and doc["_id"] in added
+            else doc for doc in result]
+
+
+def _find_and_modify_by_id(find_and_modify):
+    # mongomock re-reads the modified document with the original filter unless `_id` is projected
+    def run(collection, query, projection=None, *args, **kwargs):
+        if not isinstance(projection, dict) or projection.get("_id", 1):
+            return find_and_modify(collection, query, projection, *args, **kwargs)
+        with_id = {k: v for k, v in projection.items() if k != "_id"} or None
+        doc = find_and_modify(collection, query, with_id, *args, **kwargs)
+        return {k: v for k, v in doc.items() if k != "_id"} if doc else doc
+    return run
+
+
+def _with_reduce(handle_array_operator):
+    def run(parser, operator, value):
+        if operator != "$reduce":
+            return handle_array_operator(parser, operator, value)
+        accumulated = parser.parse(value["initialValue"])
+        for item in parser.parse(value["input"]) or []:
+            accumulated = type(parser)(
+                parser._doc_dict, dict(parser._user_vars, value=accumulated, this=item),
+                ignore_missing_keys=parser._ignore_missing_keys,
+            ).parse(value["in"])
+        return accumulated
+    return run
+
+
+import database.budget
+
+# The class itself, for tests/test_budget.py (database.config's collections may be plain mongomock ones)
+BudgetedCollection = database.budget.BudgetedCollection
+
+if not os.getenv("DATABASE_URL"):
+    import mongomock
+    import pymongo.mongo_client
+
+    pymongo.mongo_client.MongoClient = mongomock.MongoClient
+    database.budget.BudgetedCollection = lambda database, name: database[name]
+    mongomock.collection.Collection.aggregate = _aggregate_with_unions(mongomock.collection.Collection.aggregate)
+    mongomock.collection.Collection._find_and_modify = _find_and_modify_by_id(mongomock.collection.Collection._find_and_modify)
+    mongomock.aggregate._Parser._handle_array_operator = _with_reduce(mongomock.aggregate._Parser._handle_array_operator)
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from auth.auth import create_access_token
+from database import config
+
+def parts_trunc(field: str, granularity: str) -> dict:
+    """$dateTrunc for hour/day/month, spelled with operators mongomock implements (patch date_trunc_expression)."""
+    parts = {"year": {"$year": field}, "month": {"$month": field}}
+    if granularity in ("hour", "day"):
+        parts["day"] = {"$dayOfMonth": field}
+    if granularity == "hour":
+        parts["hour"] = {"$hour": field}
+    return {"$dateFromParts": parts}
+
+
+# Counters increment_id would otherwise seed with $convert (not in mongomock)
+ID_COUNTERS = ("users", "products", "purchases", "sales", "customers", "debts", "expenditures", "stock_holds")
+
+
+class ShopTestCase(unittest.TestCase):
+    """A fresh shop per test; everything it wrote is deleted afterwards."""
+
+    def setUp(self):
+        self.shop_id = f"test-{uuid.uuid4().hex}"
+        for name in ID_COUNTERS:
+            config.counters_collection.update_one({"_id": f"{name}.id"}, {"$max": {"seq": 0}}, upsert=True)
+        self.addCleanup(self._drop_shop)
+
+    def _drop_shop(self):
+        for name in config.database.list_collection_names():
+            config.database[name].delete_many({"shop_id": self.shop_id})
+
+    def client(self, *routers, role: str = "admin") -> TestClient:
+        """A TestClient for an app made of `routers`, authenticated as a user of this shop."""
+        app = FastAPI()
+        for router in routers:
+            app.include_router(router)
+        token = create_access_token({"sub": f"{self.shop_id}-user", "shop": self.shop_id, "role": role})
+        return TestClient(app, headers={"Authorization": f"Bearer {token}"})
+
+    def add_product(self, product_id: str, stock: int = 10, cost_price: float = 5.0, selling_price: float = 8.0,
+                    **fields) -> dict:
+        product = {
+            "shop_id": self.shop_id, "id": product_id, "name": f"Product {product_id}", "category": "general",
+            "unit": "pcs", "cost_price": cost_price, "selling_price": selling_price, "current_stock": stock,
+            **fields,
+        }
+        config.products_collection.insert_one(dict(product))
+        return product
+
+    def add_customer(self, customer_id: str, name: str = None, balance: float = 0.0) -> dict:
+        customer = {"shop_id": self.shop_id, "id": customer_id, "name": name or f"Customer {customer_id}",
+                    "phone": "0700000000", "address": None, "balance": balance}
+        config.customers_collection.insert_one(dict(customer))
+        return customer
+
+    def stock(self, product_id: str) -> int:
+        return config.products_collection.find_one({"shop_id": self.shop_id, "id": product_id})["current_stock"]
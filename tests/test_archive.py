@@ -0,0 +1,112 @@
+"""Archiving old transactions, the monthly summaries, and reads across hot and archived data (utils/archive.py)."""
+from datetime import datetime
+from unittest import mock
+from database.config import (
+    archive_state_collection, counters_collection, debts_archive_collection, debts_collection,
+    sales_archive_collection, sales_collection, summaries_collection,
+)
+from routes import Sales, report
+from utils import archive
+from utils.idincrement import increment_id
+from tests import ShopTestCase
+
+
+class ArchiveTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(archive_state_collection.delete_many, {"_id": {"$regex": f"^{self.shop_id}:"}})
+        self.api = self.client(Sales.router, report.router)
+
+    def add_sale(self, sale_id: str, created_at: datetime, amount: float, customer_id: str = "c1"):
+        sales_collection.insert_one({
+            "shop_id": self.shop_id, "id": sale_id, "customer_id": customer_id, "customer_name": customer_id,
+            "created_at": created_at, "total_amount": amount, "payment_method": "cash",
+            "items": [{"product_id": "1", "product_name": "P", "quantity": 1, "selling_price": amount,
+                       "total_price": amount, "category": "general", "cost_price": 1.0, "total_cost": 1.0}],
+        })
+
+    def report(self, start: str, end: str) -> dict:
+        response = self.api.post("/report", json={"start_date": start, "end_date": end})
+        self.assertEqual(response.status_code, 200, response.text)
+        return response.json()
+
+    def test_old_months_move_and_are_summarised(self):
+        self.add_sale("1", datetime(2024, 1, 5), 10.0)
+        self.add_sale("2", datetime(2024, 1, 20), 15.0)
+        self.add_sale("3", datetime(2024, 2, 3), 7.0, customer_id="c2")
+        recent = datetime.utcnow().replace(microsecond=0)
+        self.add_sale("4", recent, 3.0)
+
+        archive.archive_old_records(older_than_days=30)
+
+        self.assertEqual([s["id"] for s in sales_collection.find({"shop_id": self.shop_id})], ["4"])
+        self.assertEqual(sales_archive_collection.count_documents({"shop_id": self.shop_id}), 3)
+        summaries = {(s["month"], s["customer_id"]): (s["total_amount"], s["record_count"])
+                     for s in summaries_collection.find({"shop_id": self.shop_id, "collection": "sales"})}
+        self.assertEqual(summaries, {(datetime(2024, 1, 1), "c1"): (25.0, 2), (datetime(2024, 2, 1), "c2"): (7.0, 1)})
+
+        # running it again moves nothing and leaves the summaries as they are
+        archive.archive_old_records(older_than_days=30)
+        self.assertEqual(summaries_collection.count_documents({"shop_id": self.shop_id, "collection": "sales"}), 2)
+
+    def test_open_debts_stay_hot(self):
+        for debt_id, cleared in (("1", True), ("2", False)):
+            debts_collection.insert_one({"shop_id": self.shop_id, "id": debt_id, "customer_name": "Alice",
+                                         "amount": 5.0, "created_at": datetime(2024, 1, 5), "cleared": cleared})
+        archive.archive_old_records(older_than_days=30)
+        self.assertEqual([d["id"] for d in debts_collection.find({"shop_id": self.shop_id})], ["2"])
+        self.assertEqual([d["id"] for d in debts_archive_collection.find({"shop_id": self.shop_id})], ["1"])
+
+    def test_reports_read_the_same_before_and_after(self):
+        self.add_sale("1", datetime(2024, 1, 5), 10.0)
+        self.add_sale("2", datetime(2024, 2, 10), 20.0)
+        self.add_sale("3", datetime(2024, 2, 25), 5.0)
+        self.add_sale("4", datetime(2024, 3, 15), 40.0)
+        windows = [("2024-01-01T00:00:00", "2024-03-31T00:00:00"),  # whole months from the summaries
+                   ("2024-02-15T00:00:00", "2024-03-20T00:00:00")]  # partial months from the archived documents
+        before = [self.report(*window) for window in windows]
+
+        archive.archive_old_records(older_than_days=30)
+        after = [self.report(*window) for window in windows]
+        for b, a in zip(before, after):
+            self.assertEqual((a["total_sales"], a["total_products_sold"]), (b["total_sales"], b["total_products_sold"]))
+        self.assertEqual([a["total_sales"] for a in after], [75.0, 45.0])
+
+    def test_archived_records_mixes_summaries_and_edge_documents(self):
+        self.add_sale("1", datetime(2024, 1, 5), 10.0)
+        self.add_sale("2", datetime(2024, 2, 10), 20.0)
+        self.add_sale("3", datetime(2024, 3, 25), 5.0)
+        archive.archive_old_records(older_than_days=30)
+
+        records = archive.archived_records("sales", self.shop_id, {
+            "shop_id": self.shop_id, "created_at": {"$gte": datetime(2024, 1, 20), "$lte": datetime(2024, 3, 31)}})
+        self.assertEqual(sorted((r["total_amount"], r.get("record_count")) for r in records), [(5.0, None), (20.0, 1)])
+        self.assertEqual(archive.record_count(records), 2)
+        # filtering on a field the summaries don't keep needs the documents themselves
+        records = archive.archived_records("sales", self.shop_id, {"shop_id": self.shop_id, "payment_method": "cash"})
+        self.assertEqual(len(records), 3)
+        self.assertTrue(all("record_count" not in r for r in records))
+
+    def test_by_id_and_list_reads_reach_the_archive(self):
+        self.add_sale("1", datetime(2024, 1, 5), 10.0)
+        self.add_sale("2", datetime.utcnow(), 4.0)
+        archive.archive_old_records(older_than_days=30)
+
+        self.assertEqual(self.api.get("/sales/1").json()["total_amount"], 10.0)
+        self.assertEqual(len(self.api.get("/sales").json()), 1)
+        self.assertEqual(len(self.api.get("/sales", params={"include_archived": "true"}).json()), 2)
+
+    def test_counter_is_seeded_before_ids_leave(self):
+        self.add_sale("41", datetime(2024, 1, 5), 10.0)
+        counters_collection.delete_one({"_id": "sales.id"})
+        seeded_with = []
+
+        def seed(collection):
+            seeded_with.append(collection.count_documents({"shop_id": self.shop_id, "id": "41"}))
+            counters_collection.update_one({"_id": f"{collection.name}.id"}, {"$max": {"seq": 41}}, upsert=True)
+
+        with mock.patch.object(archive, "seed_counter", seed):
+            archive.archive_old_records(older_than_days=30)
+            archive.archive_old_records(older_than_days=30)
+        self.assertEqual(seeded_with, [1])  # once, while sale 41 was still hot
+        self.assertEqual(increment_id(sales_collection), "42")
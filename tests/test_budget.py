@@ -0,0 +1,200 @@
+"""Per-request time budgets for Mongo reads and the degraded reports built on them (database/budget.py)."""
+from datetime import datetime
+from unittest import TestCase, mock
+import pymongo
+import pymongo.mongo_client
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pymongo.collection import Collection
+from pymongo.errors import ExecutionTimeout
+import database.budget as budget
+import main
+from database.config import sales_collection
+from database.routing import reporting
+from routes import report
+from tests import BudgetedCollection, ShopTestCase
+
+
+class BudgetTest(TestCase):
+    def setUp(self):
+        self.clock = 100.0
+        patcher = mock.patch.object(budget.time, "monotonic", lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use(self, request_budget):
+        token = budget.current_budget.set(request_budget)
+        self.addCleanup(budget.current_budget.reset, token)
+        return request_budget
+
+    def test_reads_get_what_is_left_then_fail(self):
+        request_budget = budget.Budget(1000)
+        self.assertEqual(request_budget.remaining_ms(), 1000)
+        self.clock += 0.75
+        self.assertEqual(request_budget.remaining_ms(), 250)
+        self.clock += 0.25
+        with self.assertRaises(ExecutionTimeout):
+            request_budget.remaining_ms()
+
+    def test_nothing_is_cut_short_once_writing(self):
+        request_budget = budget.Budget(1000)
+        request_budget.writing = True
+        self.clock += 5
+        self.assertIsNone(request_budget.remaining_ms())
+
+    def test_spend_at_most_caps_the_block_and_restores(self):
+        request_budget = self.use(budget.Budget(1000))
+        with budget.spend_at_most(0.7):
+            self.assertEqual(request_budget.remaining_ms(), 700)
+            with budget.spend_at_most(0.5):
+                self.assertEqual(request_budget.remaining_ms(), 500)  # half of the whole time left, under the outer cap
+            self.clock += 0.7
+            with self.assertRaises(ExecutionTimeout):
+                request_budget.remaining_ms()
+        self.assertAlmostEqual(request_budget.remaining_ms(), 300, delta=1)
+
+    def test_spend_at_most_without_a_budget(self):
+        with budget.spend_at_most(0.5):
+            self.assertIsNone(budget.current_budget.get())
+
+    def test_budget_per_lane_and_route(self):
+        self.assertEqual(budget.start_budget("POST", "/report", "report").deadline, 100 + budget.LANE_BUDGETS_MS["report"] / 1000)
+        self.assertEqual(budget.start_budget("GET", "/suppliers/analytics", "report").deadline,
+                         100 + budget.ANALYTICS_BUDGET_MS / 1000)
+        with mock.patch.dict(budget.LANE_BUDGETS_MS, {"default": 0}):
+            self.assertIsNone(budget.start_budget("GET", "/products", "default"))
+
+
+class BudgetedCollectionTest(TestCase):
+    def setUp(self):
+        # A real pymongo collection that never connects; the Collection methods underneath are mocks
+        patcher = mock.patch.object(pymongo.mongo_client, "MongoClient", pymongo.MongoClient)  # tests/__init__.py swaps it
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        client = pymongo.MongoClient("mongodb://localhost:1", connect=False)
+        self.addCleanup(client.close)
+        patcher = mock.patch.object(budget, "BudgetedCollection", BudgetedCollection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.collection = BudgetedCollection(client["shop"], "sales")
+        self.calls = {}
+        for name in ("find", "aggregate", "count_documents", "distinct", "insert_one"):
+            patcher = mock.patch.object(Collection, name, autospec=True)
+            self.calls[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+        token = budget.current_budget.set(budget.Budget(2000))
+        self.addCleanup(budget.current_budget.reset, token)
+
+    def test_reads_carry_the_remaining_budget(self):
+        self.collection.find({"shop_id": "s"})
+        self.collection.aggregate([{"$match": {}}])
+        self.collection.count_documents({})
+        self.collection.distinct("shop_id")
+        self.assertLessEqual(self.calls["find"].call_args.kwargs["max_time_ms"], 2000)
+        self.assertGreater(self.calls["find"].call_args.kwargs["max_time_ms"], 1000)
+        for name in ("aggregate", "count_documents", "distinct"):
+            self.assertIn("maxTimeMS", self.calls[name].call_args.kwargs, name)
+
+    def test_explicit_limits_are_kept(self):
+        self.collection.find({}, max_time_ms=50)
+        self.assertEqual(self.calls["find"].call_args.kwargs["max_time_ms"], 50)
+
+    def test_reads_after_a_write_are_not_budgeted(self):
+        self.collection.insert_one({"a": 1})
+        self.collection.find({})
+        self.assertNotIn("max_time_ms", self.calls["find"].call_args.kwargs)
+
+    def test_with_options_stays_budgeted(self):
+        routed = self.collection.with_options(read_preference=pymongo.ReadPreference.SECONDARY_PREFERRED)
+        self.assertIsInstance(routed, BudgetedCollection)
+        routed.find({})
+        self.assertIn("max_time_ms", self.calls["find"].call_args.kwargs)
+
+    def test_spent_budget_fails_before_reaching_the_server(self):
+        budget.current_budget.get().deadline = 0
+        with self.assertRaises(ExecutionTimeout):
+            self.collection.find({})
+        self.calls["find"].assert_not_called()
+
+
+class DegradedReportTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = self.client(report.router)
+        self.add_customer("c1", name="Alice")
+        self.add_product("1")
+        for sale_id, created_at, amount in (("1", datetime(2024, 4, 10), 100.0), ("2", datetime(2024, 5, 5), 150.0)):
+            sales_collection.insert_one({
+                "shop_id": self.shop_id, "id": sale_id, "customer_id": "c1", "created_at": created_at,
+                "total_amount": amount, "payment_method": "cash",
+                "items": [{"product_id": "1", "quantity": 1, "total_price": amount}],
+            })
+        self.degraded_before = sum(budget.timeout_metrics.degraded.values())
+
+    def post(self, **params) -> dict:
+        response = self.api.post("/report", params=params,
+                                 json={"start_date": "2024-05-01T00:00:00", "end_date": "2024-05-31T00:00:00"})
+        self.assertEqual(response.status_code, 200, response.text)
+        return response.json()
+
+    def assertDegradedCount(self, count: int):
+        self.assertEqual(sum(budget.timeout_metrics.degraded.values()) - self.degraded_before, count)
+
+    def timing_out(self, method: str, when):
+        """reporting() whose `method` raises ExecutionTimeout when `when(collection name, first argument)` says so."""
+        def routed(collection):
+            real = reporting(collection)
+            wrapped = mock.Mock(wraps=real)
+
+            def call(argument, *args, **kwargs):
+                if when(collection.name, argument):
+                    raise ExecutionTimeout("operation exceeded time limit", code=budget.MAX_TIME_MS_EXPIRED)
+                return getattr(real, method)(argument, *args, **kwargs)
+            getattr(wrapped, method).side_effect = call
+            return wrapped
+        return mock.patch.object(report, "reporting", routed)
+
+    def test_report_without_the_archive(self):
+        with mock.patch.object(report, "archived_records", side_effect=ExecutionTimeout("timed out")):
+            result = self.post()
+        self.assertEqual((result["degraded"], result["missing"]), (True, ["archive"]))
+        self.assertEqual(result["total_sales"], 150.0)
+        self.assertDegradedCount(1)
+
+    def test_report_without_rankings(self):
+        with mock.patch.object(report, "calculate_customer_metrics", side_effect=ExecutionTimeout("timed out")):
+            result = self.post()
+        self.assertEqual(result["missing"], ["rankings"])
+        self.assertIsNone(result["best_customer"])
+        self.assertEqual((result["total_customers"], result["total_products_sold"]), (1, 1))
+
+    def test_comparison_without_the_previous_period(self):
+        previous = lambda name, pipeline: pipeline[0]["$match"]["created_at"]["$gte"] < datetime(2024, 5, 1)
+        with self.timing_out("aggregate", previous):
+            result = self.post(compare="true")
+        self.assertEqual((result["degraded"], result["missing"]), (True, ["previous"]))
+        self.assertEqual(result["current"]["total_sales"], 150.0)
+        self.assertEqual((result["previous"]["degraded"], result["previous"]["missing"]), (True, ["totals"]))
+        self.assertEqual(result["previous"]["total_sales"], 0.0)
+        self.assertEqual((result["deltas"], result["percent_changes"]), ({}, {}))
+        self.assertEqual(result["current"]["best_customer"], "Alice")
+        self.assertDegradedCount(1)
+
+    def test_comparison_without_rankings(self):
+        with self.timing_out("find", lambda name, query: name == "customers"):
+            result = self.post(compare="true")
+        self.assertEqual(result["missing"], ["rankings"])
+        self.assertIsNone(result["current"]["best_customer"])
+        self.assertEqual(result["deltas"]["total_sales"], 50.0)
+
+    def test_required_part_timing_out_is_a_503(self):
+        app = FastAPI()
+        app.include_router(report.router)
+        app.add_exception_handler(ExecutionTimeout, main.time_budget_exceeded)
+        api = TestClient(app, headers=self.api.headers)
+        failed_before = sum(budget.timeout_metrics.failed.values())
+        with self.timing_out("aggregate", lambda name, pipeline: True):
+            response = api.post("/report", params={"compare": "true"},
+                                json={"start_date": "2024-05-01T00:00:00", "end_date": "2024-05-31T00:00:00"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(sum(budget.timeout_metrics.failed.values()) - failed_before, 1)
@@ -0,0 +1,59 @@
+"""Debt aging buckets (GET /debts/aging)."""
+from datetime import datetime, timedelta
+from database.config import debts_collection
+from routes.debt import router as debt_router
+from tests import ShopTestCase
+
+
+class DebtAgingTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = self.client(debt_router)
+        self.next_id = 0
+
+    def add_debt(self, customer_name: str, amount: float, age_days: int, paid: float = 0.0, cleared: bool = False):
+        self.next_id += 1
+        payments = [{"amount": paid, "date": datetime.utcnow()}] if paid else []
+        debts_collection.insert_one({
+            "shop_id": self.shop_id, "id": str(self.next_id), "customer_name": customer_name, "amount": amount,
+            "created_at": datetime.utcnow() - timedelta(days=age_days, hours=1), "cleared": cleared, "payment": payments,
+        })
+
+    def aging(self, **params) -> dict:
+        response = self.api.get("/debts/aging", params=params)
+        self.assertEqual(response.status_code, 200, response.text)
+        return response.json()
+
+    def buckets(self, **params) -> dict:
+        return {bucket["label"]: bucket for bucket in self.aging(**params)["buckets"]}
+
+    def test_outstanding_is_bucketed_by_age(self):
+        self.add_debt("Alice", 50.0, age_days=3, paid=20.0)
+        self.add_debt("Bob", 10.0, age_days=30)
+        self.add_debt("Alice", 40.0, age_days=45)
+        self.add_debt("Carol", 25.0, age_days=75)
+        self.add_debt("Dave", 100.0, age_days=200)
+
+        aging = self.aging()
+        totals = {bucket["label"]: (bucket["total_outstanding"], bucket["debt_count"]) for bucket in aging["buckets"]}
+        self.assertEqual(totals, {"0-30": (40.0, 2), "31-60": (40.0, 1), "61-90": (25.0, 1), "90+": (100.0, 1)})
+        self.assertEqual(aging["total_outstanding"], 205.0)
+
+    def test_paid_off_and_cleared_debts_are_left_out(self):
+        self.add_debt("Alice", 30.0, age_days=5, paid=30.0)
+        self.add_debt("Bob", 20.0, age_days=5, cleared=True)
+        self.add_debt("Carol", 15.0, age_days=5)
+
+        bucket = self.buckets()["0-30"]
+        self.assertEqual((bucket["total_outstanding"], bucket["debt_count"]), (15.0, 1))
+        self.assertEqual([d["customer_name"] for d in bucket["top_debtors"]], ["Carol"])
+
+    def test_top_debtors_per_bucket(self):
+        self.add_debt("Alice", 10.0, age_days=1)
+        self.add_debt("Alice", 15.0, age_days=2)
+        self.add_debt("Bob", 20.0, age_days=3)
+        self.add_debt("Carol", 5.0, age_days=4)
+
+        debtors = self.buckets(top=2)["0-30"]["top_debtors"]
+        self.assertEqual([(d["customer_name"], d["outstanding"], d["debt_count"]) for d in debtors],
+                         [("Alice", 25.0, 2), ("Bob", 20.0, 1)])
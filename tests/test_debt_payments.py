@@ -0,0 +1,99 @@
+"""Debt payments: single debts, FIFO allocation across a customer's debts, and the unpaid total (routes/debt.py)."""
+from datetime import datetime
+from unittest import mock
+from database.config import customers_collection, debts_collection
+from database.routing import money
+from routes import debt
+from tests import ShopTestCase
+
+
+class DebtPaymentTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = self.client(debt.router)
+        self.add_customer("c1", name="Alice", balance=60.0)
+
+    def add_debt(self, debt_id: str, amount: float, created_at: datetime, paid: float = 0.0):
+        debts_collection.insert_one({
+            "shop_id": self.shop_id, "id": debt_id, "customer_name": "Alice", "sale_id": debt_id, "amount": amount,
+            "balance": amount, "created_at": created_at, "cleared": False,
+            "payment": [{"amount": paid, "date": created_at, "method": "cash"}] if paid else [],
+        })
+
+    def outstanding(self, debt_id: str) -> float:
+        found = debts_collection.find_one({"shop_id": self.shop_id, "id": debt_id})
+        return found["amount"] - sum(p["amount"] for p in found["payment"])
+
+    def balance(self) -> float:
+        return customers_collection.find_one({"shop_id": self.shop_id, "id": "c1"})["balance"]
+
+    def racing(self, method: str, debt_id: str, amount: float):
+        """money() for debts, with another payment of `amount` landing just before `method` runs."""
+        real = money(debts_collection)
+        wrapped = mock.Mock(wraps=real)
+
+        def pay_first(*args, **kwargs):
+            debts_collection.update_one({"shop_id": self.shop_id, "id": debt_id},
+                                        {"$push": {"payment": {"amount": amount, "date": datetime(2024, 6, 1)}}})
+            return getattr(real, method)(*args, **kwargs)
+        getattr(wrapped, method).side_effect = pay_first
+        return mock.patch.object(debt, "money", lambda collection: wrapped if collection.name == "debts" else money(collection))
+
+    def test_pay_debt_is_capped_at_what_is_owed(self):
+        self.add_debt("1", 30.0, datetime(2024, 5, 1), paid=10.0)
+        response = self.api.put("/debts/1/pay", params={"amount": 50})
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertTrue(response.json()["cleared"])
+        self.assertEqual(response.json()["payment"][-1]["amount"], 20.0)
+        self.assertEqual(self.balance(), 40.0)
+        self.assertEqual(self.api.put("/debts/1/pay", params={"amount": 5}).status_code, 400)
+
+    def test_partial_payment_leaves_the_debt_open(self):
+        self.add_debt("1", 30.0, datetime(2024, 5, 1))
+        response = self.api.put("/debts/1/pay", params={"amount": 12})
+        self.assertFalse(response.json()["cleared"])
+        self.assertEqual(response.json()["balance"], 30.0)  # the balance recorded with the debt is left alone
+        self.assertEqual(self.outstanding("1"), 18.0)
+
+    def test_concurrent_payment_is_not_overpaid(self):
+        self.add_debt("1", 30.0, datetime(2024, 5, 1))
+        with self.racing("find_one_and_update", "1", 25.0):
+            response = self.api.put("/debts/1/pay", params={"amount": 30})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.outstanding("1"), 5.0)
+        self.assertEqual(self.balance(), 60.0)
+
+    def test_fifo_allocation_oldest_first(self):
+        self.add_debt("1", 20.0, datetime(2024, 5, 1), paid=5.0)
+        self.add_debt("2", 30.0, datetime(2024, 5, 3))
+        self.add_debt("3", 10.0, datetime(2024, 5, 2))
+        response = self.api.post("/customers/c1/payments", json={"amount": 30})
+        self.assertEqual(response.status_code, 200, response.text)
+        result = response.json()
+        self.assertEqual([(a["debt_id"], a["amount"], a["outstanding"], a["cleared"]) for a in result["allocations"]],
+                         [("1", 15.0, 0.0, True), ("3", 10.0, 0.0, True), ("2", 5.0, 25.0, False)])
+        self.assertEqual((result["applied"], result["unapplied"], result["customer_balance"]), (30.0, 0.0, 30.0))
+
+    def test_overpayment_is_reported_not_stored(self):
+        self.add_debt("1", 20.0, datetime(2024, 5, 1))
+        result = self.api.post("/customers/c1/payments", json={"amount": 50}).json()
+        self.assertEqual((result["applied"], result["unapplied"]), (20.0, 30.0))
+        self.assertEqual(self.balance(), 40.0)
+        self.assertEqual(self.api.post("/customers/c1/payments", json={"amount": 5}).status_code, 400)
+
+    def test_fifo_skips_a_debt_paid_concurrently(self):
+        self.add_debt("1", 20.0, datetime(2024, 5, 1))
+        self.add_debt("2", 20.0, datetime(2024, 5, 2))
+        with self.racing("bulk_write", "1", 20.0):
+            result = self.api.post("/customers/c1/payments", json={"amount": 30}).json()
+        self.assertEqual([(a["debt_id"], a["amount"]) for a in result["allocations"]], [("2", 10.0)])
+        self.assertEqual((result["applied"], result["unapplied"]), (10.0, 20.0))
+        self.assertEqual(self.outstanding("1"), 0.0)  # not overpaid
+        self.assertEqual(self.balance(), 50.0)
+
+    def test_unpaid_total_is_amount_minus_payments(self):
+        self.add_debt("1", 20.0, datetime(2024, 5, 1), paid=5.0)
+        self.add_debt("2", 30.0, datetime(2024, 5, 2))
+        self.assertEqual(self.api.get("/debts/total/unpaid").json(), 45.0)
+        self.api.post("/customers/c1/payments", json={"amount": 25})
+        self.assertEqual(self.api.get("/debts/total/unpaid").json(), 20.0)
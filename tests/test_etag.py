@@ -0,0 +1,82 @@
+"""ETags and cached list bodies of GET /products (utils/etag.py)."""
+import gzip
+import orjson
+from routes.products import router as products_router
+from utils import etag
+from tests import ShopTestCase
+
+
+class ConditionalListTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_product("1")
+        self.api = self.client(products_router)
+
+    def test_matching_etag_returns_304(self):
+        first = self.api.get("/products")
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual([product["id"] for product in first.json()], ["1"])
+
+        again = self.api.get("/products", headers={"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.headers["ETag"], first.headers["ETag"])
+
+    def test_write_changes_the_etag_and_the_body(self):
+        first = self.api.get("/products")
+        created = self.api.post("/product", json={
+            "id": "0", "name": "Soap", "category": "home", "unit": "pcs",
+            "cost_price": 1.0, "selling_price": 2.0, "current_stock": 3,
+        })
+        self.assertEqual(created.status_code, 200)
+
+        after = self.api.get("/products", headers={"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(after.status_code, 200)
+        self.assertNotEqual(after.headers["ETag"], first.headers["ETag"])
+        self.assertIn("Soap", [product["name"] for product in after.json()])
+
+    def test_sparse_fieldsets_have_their_own_etag(self):
+        full = self.api.get("/products")
+        sparse = self.api.get("/products", params={"fields": "id,name"})
+        self.assertNotEqual(full.headers["ETag"], sparse.headers["ETag"])
+        self.assertEqual(sparse.json(), [{"id": "1", "name": "Product 1"}])
+
+    def test_gzip_copy_is_served_when_accepted(self):
+        response = self.api.get("/products", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers.get("Content-Encoding"), "gzip")
+        self.assertEqual(response.json()[0]["id"], "1")
+
+
+class BodyCacheTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.limit = etag.LIST_CACHE_MAX_BYTES
+        self.addCleanup(setattr, etag, "LIST_CACHE_MAX_BYTES", self.limit)
+        etag.LIST_CACHE_MAX_BYTES = 100
+        saved = dict(etag._bodies), etag._bodies_size
+        self.addCleanup(self.restore, *saved)
+        etag._bodies.clear()
+        etag._bodies_size = 0
+
+    def restore(self, bodies, size):
+        etag._bodies.clear()
+        etag._bodies.update(bodies)
+        etag._bodies_size = size
+
+    def test_least_recently_served_body_is_evicted(self):
+        etag._store_body("a", 1, b"x" * 40, b"")
+        etag._store_body("b", 1, b"x" * 40, b"")
+        self.assertIsNotNone(etag._cached_body("a", 1))  # "a" is now the most recent
+        etag._store_body("c", 1, b"x" * 40, b"")
+
+        self.assertIsNotNone(etag._cached_body("a", 1))
+        self.assertIsNone(etag._cached_body("b", 1))
+        self.assertIsNotNone(etag._cached_body("c", 1))
+        self.assertLessEqual(etag._bodies_size, etag.LIST_CACHE_MAX_BYTES)
+
+    def test_stale_version_is_a_miss(self):
+        etag._store_body("a", 1, b"[]", gzip.compress(b"[]"))
+        self.assertIsNone(etag._cached_body("a", 2))
+
+    def test_body_larger_than_the_cache_is_not_stored(self):
+        etag._store_body("big", 1, orjson.dumps("x" * 200), b"")
+        self.assertIsNone(etag._cached_body("big", 1))
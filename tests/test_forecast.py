@@ -0,0 +1,85 @@
+"""Demand history, weekday seasonality and reorder suggestions (utils/forecast.py)."""
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase, mock
+import numpy as np
+from database.config import sales_collection
+from routes import inventory
+from utils import forecast
+from utils.timebuckets import to_naive_utc, truncate
+from tests import ShopTestCase, parts_trunc
+
+
+class WeekdayFactorsTest(TestCase):
+    MONDAY = datetime(2024, 1, 1)
+
+    def test_flat_history_has_flat_factors(self):
+        factors = forecast.weekday_factors(np.full((1, 28), 3, dtype=np.float32), self.MONDAY)
+        np.testing.assert_allclose(factors, np.ones((1, 7)), rtol=1e-6)
+
+    def test_product_with_enough_history_keeps_its_own_pattern(self):
+        history = np.zeros((1, 28), dtype=np.float32)
+        history[0, ::7] = 10  # Mondays only
+        factors = forecast.weekday_factors(history, self.MONDAY)
+        np.testing.assert_allclose(factors[0], [7, 0, 0, 0, 0, 0, 0], atol=1e-5)
+
+    def test_thin_history_leans_on_the_shop(self):
+        history = np.zeros((2, 28), dtype=np.float32)
+        history[0, ::7] = 1  # 4 units, far below SEASONALITY_MIN_UNITS
+        factors = forecast.weekday_factors(history, self.MONDAY)
+        self.assertLess(factors[0, 0], 7)
+        self.assertGreater(factors[0, 1], 0)
+        # no sales at all: the shop pattern, itself close to flat while the shop sells little
+        self.assertGreater(factors[1, 0], 1)
+        self.assertLess(factors[1, 0], 1.5)
+        self.assertLess(factors[1, 1], 1)
+
+
+@mock.patch.object(forecast, "date_trunc_expression", parts_trunc)
+class ReorderSuggestionsTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = self.client(inventory.router)
+        self.today = truncate(to_naive_utc(datetime.now(timezone.utc)), "day")
+
+    def sell_daily(self, product_id: str, quantity: int, days: int = 28):
+        sales_collection.insert_many([{
+            "shop_id": self.shop_id, "id": f"{product_id}-{day}", "created_at": self.today - timedelta(days=day, hours=-12),
+            "items": [{"product_id": product_id, "quantity": quantity}],
+        } for day in range(1, days + 1)])
+
+    def test_daily_units_matrix(self):
+        self.sell_daily("p", 2, days=3)
+        sales_collection.insert_one({"shop_id": self.shop_id, "id": "x", "created_at": self.today + timedelta(hours=1),
+                                     "items": [{"product_id": "p", "quantity": 50}, {"product_id": "gone", "quantity": 1}]})
+        start = self.today - timedelta(days=4)
+        matrix = forecast.daily_units(self.shop_id, {"q": 0, "p": 1}, start, 4)
+        np.testing.assert_array_equal(matrix, [[0, 0, 0, 0], [0, 2, 2, 2]])  # today is not history yet
+
+    def test_steady_seller_is_reordered_up_to_cover(self):
+        self.add_product("p", stock=10, cost_price=2.0, supplier="Acme")
+        self.sell_daily("p", 2)
+        response = self.api.get("/stock/reorder-suggestions", params={"history_days": 28, "lead_time_days": 7,
+                                                                     "cover_days": 14})
+        self.assertEqual(response.status_code, 200, response.text)
+        [supplier] = response.json()["suppliers"]
+        [product] = supplier["products"]
+        self.assertEqual(supplier["supplier"], "Acme")
+        self.assertEqual((product["velocity"], product["trend"], product["safety_stock"]), (2.0, 1.0, 0.0))
+        self.assertEqual((product["reorder_point"], product["suggested_quantity"]), (14, 32))  # 14 + 28 - 10
+        self.assertEqual((product["days_of_stock"], product["estimated_cost"]), (5.0, 64.0))
+
+    def test_only_needed_products_are_listed(self):
+        self.add_product("p", stock=500)
+        self.add_product("idle", stock=0, low_stock_alert=5)  # never sold, the alert is the floor
+        self.sell_daily("p", 1)
+
+        suggestions = forecast.reorder_suggestions(self.shop_id, 28, 28, 7, 14, 0.95)
+        products = [product for supplier in suggestions["suppliers"] for product in supplier["products"]]
+        self.assertEqual([(p["product_id"], p["reorder_point"], p["suggested_quantity"], p["days_of_stock"])
+                          for p in products], [("idle", 5, 5, None)])
+
+        everything = forecast.reorder_suggestions(self.shop_id, 28, 28, 7, 14, 0.95, only_needed=False)
+        self.assertEqual(sum(len(s["products"]) for s in everything["suppliers"]), 2)
+
+    def test_empty_catalogue(self):
+        self.assertEqual(forecast.reorder_suggestions(self.shop_id, 28, 28, 7, 14, 0.95)["suppliers"], [])
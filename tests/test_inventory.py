@@ -0,0 +1,75 @@
+"""Stock movement ledger, point-in-time stock and snapshots (utils/inventory.py, routes/inventory.py)."""
+from datetime import datetime, timedelta, timezone
+from database.config import movements_collection, snapshots_collection
+from routes.inventory import router as inventory_router
+from utils import inventory
+from tests import ShopTestCase
+
+
+class AdjustmentTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_product("p", stock=5)
+        self.api = self.client(inventory_router)
+
+    def test_adjustment_moves_stock_and_is_recorded(self):
+        response = self.api.post("/stock/adjustments", json={"product_id": "p", "quantity": -2, "note": "broken"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stock("p"), 3)
+
+        history = self.api.get("/stock/p/movements").json()
+        self.assertEqual([(m["type"], m["quantity"], m["note"]) for m in history], [("adjustment", -2, "broken")])
+
+    def test_adjustment_never_makes_stock_negative(self):
+        response = self.api.post("/stock/adjustments", json={"product_id": "p", "quantity": -6})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stock("p"), 5)
+        self.assertEqual(movements_collection.count_documents({"shop_id": self.shop_id}), 0)
+
+    def test_unknown_product(self):
+        response = self.api.post("/stock/adjustments", json={"product_id": "nope", "quantity": 1})
+        self.assertEqual(response.status_code, 404)
+
+
+class StockAtTest(ShopTestCase):
+    def move(self, quantity: int, at: datetime):
+        movements_collection.insert_one({"shop_id": self.shop_id, "product_id": "p", "type": "sale",
+                                         "quantity": quantity, "created_at": at})
+
+    def snapshot(self, stock: int, as_of: datetime):
+        snapshots_collection.insert_one({"shop_id": self.shop_id, "product_id": "p", "stock": stock, "as_of": as_of})
+
+    def test_replays_movements_after_the_latest_snapshot(self):
+        self.snapshot(10, datetime(2024, 1, 1))
+        self.move(-3, datetime(2024, 1, 2))
+        self.move(+5, datetime(2024, 1, 3))
+        self.move(-1, datetime(2024, 1, 5))  # after the requested time
+
+        result = inventory.stock_at(self.shop_id, "p", datetime(2024, 1, 4))
+        self.assertEqual((result.stock, result.movements_applied), (12, 2))
+        self.assertEqual(result.snapshot_as_of, datetime(2024, 1, 1))
+
+    def test_rewinds_from_a_later_snapshot(self):
+        self.move(-2, datetime(2024, 1, 2))
+        self.move(-1, datetime(2024, 1, 3))
+        self.snapshot(7, datetime(2024, 1, 4))
+
+        result = inventory.stock_at(self.shop_id, "p", datetime(2024, 1, 1))
+        self.assertEqual(result.stock, 10)
+
+    def test_without_snapshots_sums_the_ledger(self):
+        self.move(+4, datetime(2024, 1, 1))
+        self.move(-1, datetime(2024, 1, 2))
+        self.assertEqual(inventory.stock_at(self.shop_id, "p", datetime(2024, 1, 2)).stock, 3)
+
+
+class SnapshotTest(ShopTestCase):
+    def test_first_snapshot_subtracts_movements_after_the_cut_off(self):
+        self.add_product("p", stock=8)
+        recent = datetime.now(timezone.utc) - timedelta(seconds=inventory.SNAPSHOT_SETTLE_SECONDS / 2)
+        movements_collection.insert_one({"shop_id": self.shop_id, "product_id": "p", "type": "sale",
+                                         "quantity": -3, "created_at": recent})
+
+        self.assertGreaterEqual(inventory.take_snapshots(), 1)
+        snapshot = snapshots_collection.find_one({"shop_id": self.shop_id, "product_id": "p"})
+        self.assertEqual(snapshot["stock"], 11)  # the sale after the cut-off is not in the snapshot yet
@@ -0,0 +1,97 @@
+"""Route-class concurrency lanes and per-client rate limiting (utils/limits.py)."""
+import asyncio
+import unittest
+from unittest import IsolatedAsyncioTestCase, mock
+from auth.auth import create_access_token
+from utils.limits import ConcurrencyLane, LoadSheddingMiddleware, TokenBucket, classify
+
+
+class ClassifyTest(unittest.TestCase):
+    def test_route_classes(self):
+        self.assertEqual(classify("POST", "/sale"), "checkout")
+        self.assertEqual(classify("PUT", "/debts/7/pay"), "checkout")
+        self.assertEqual(classify("POST", "/report"), "report")
+        self.assertEqual(classify("GET", "/debts/aging"), "report")
+        self.assertEqual(classify("GET", "/debts/7"), "default")
+        self.assertEqual(classify("GET", "/sale"), "default")
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_wait(self):
+        with mock.patch("utils.limits.time.monotonic", return_value=100.0):
+            bucket = TokenBucket(rate=2.0, capacity=2)
+            self.assertEqual((bucket.take(), bucket.take()), (0.0, 0.0))
+            self.assertAlmostEqual(bucket.take(), 0.5)
+        with mock.patch("utils.limits.time.monotonic", return_value=100.5):
+            self.assertEqual(bucket.take(), 0.0)
+
+
+class ConcurrencyLaneTest(IsolatedAsyncioTestCase):
+    async def test_queue_then_shed(self):
+        lane = ConcurrencyLane("report", max_concurrent=1, max_queue=1, queue_timeout=0.2)
+        self.assertTrue(await lane.acquire())
+
+        queued = asyncio.create_task(lane.acquire())
+        await asyncio.sleep(0)
+        self.assertFalse(await lane.acquire())  # slot taken and the queue is full
+
+        lane.release()
+        self.assertTrue(await queued)
+        lane.release()
+
+    async def test_waiting_times_out(self):
+        lane = ConcurrencyLane("report", max_concurrent=1, max_queue=4, queue_timeout=0.05)
+        await lane.acquire()
+        self.assertFalse(await lane.acquire())
+        self.assertEqual(lane.waiting, 0)
+
+
+class MiddlewareTest(IsolatedAsyncioTestCase):
+    ENV = {"LANE_REPORT_CONCURRENCY": "1", "LANE_REPORT_QUEUE": "0", "LANE_REPORT_TIMEOUT": "0.05",
+           "RATE_LIMIT_PER_SECOND": "0", "TRUSTED_PROXIES": "10.0.0.0/8"}
+
+    def setUp(self):
+        self.release = asyncio.Event()
+
+        async def app(scope, receive, send):
+            if scope["path"].startswith("/report"):
+                await self.release.wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        with mock.patch.dict("os.environ", self.ENV):
+            self.middleware = LoadSheddingMiddleware(app)
+
+    async def call(self, method: str, path: str, client=("1.2.3.4", 5000), headers=()) -> int:
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": method, "path": path, "client": client, "headers": list(headers)}
+        await self.middleware(scope, None, send)
+        return sent[0]["status"]
+
+    async def test_reports_cannot_take_checkout_slots(self):
+        running = asyncio.create_task(self.call("POST", "/report"))
+        await asyncio.sleep(0)
+        self.assertEqual(await self.call("GET", "/debts/aging"), 503)
+        self.assertEqual(await self.call("POST", "/sale"), 200)
+        self.release.set()
+        self.assertEqual(await running, 200)
+
+    async def test_rate_limit_per_client(self):
+        self.middleware.rate, self.middleware.burst = 1.0, 1.0
+        self.assertEqual(await self.call("GET", "/products"), 200)
+        self.assertEqual(await self.call("GET", "/products"), 429)
+        self.assertEqual(await self.call("GET", "/products", client=("5.6.7.8", 5000)), 200)
+
+    def test_client_key(self):
+        key = self.middleware.client_key
+        forwarded = [(b"x-forwarded-for", b"6.6.6.6, 9.9.9.9, 10.0.0.2")]
+        self.assertEqual(key({"client": ("10.0.0.1", 1), "headers": forwarded}), "ip:9.9.9.9")
+        # an untrusted peer cannot pick its own key
+        self.assertEqual(key({"client": ("1.2.3.4", 1), "headers": forwarded}), "ip:1.2.3.4")
+        token = create_access_token({"sub": "alice", "shop": "s", "role": "user"})
+        self.assertEqual(key({"client": ("1.2.3.4", 1), "headers": [(b"authorization", f"Bearer {token}".encode())]}),
+                         "user:alice")
@@ -0,0 +1,78 @@
+"""Cost captured on sale lines and the margin report (GET /report/margins)."""
+from datetime import datetime
+from database.config import sales_collection
+from routes.Sales import router as sales_router
+from routes.report import margin_percent, router as report_router
+from tests import ShopTestCase
+
+
+class MarginReportTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = self.client(report_router)
+
+    def add_sale(self, sale_id: str, created_at: datetime, *items):
+        sales_collection.insert_one({
+            "shop_id": self.shop_id, "id": sale_id, "customer_id": "c1", "created_at": created_at,
+            "payment_method": "cash", "total_amount": sum(item["total_price"] for item in items), "items": list(items),
+        })
+
+    @staticmethod
+    def line(product_id: str, quantity: int, total_price: float, cost_price: float = None, category: str = None):
+        line = {"product_id": product_id, "product_name": f"Product {product_id}", "quantity": quantity,
+                "selling_price": total_price / quantity, "total_price": total_price, "category": category}
+        if cost_price is not None:
+            line.update(cost_price=cost_price, total_cost=cost_price * quantity)
+        return line
+
+    def margins(self, **params) -> dict:
+        response = self.api.get("/report/margins", params=params)
+        self.assertEqual(response.status_code, 200, response.text)
+        return response.json()
+
+    def test_per_product_margins_and_totals(self):
+        self.add_sale("1", datetime(2024, 5, 1), self.line("p", 2, 20.0, cost_price=6.0, category="drinks"),
+                      self.line("q", 1, 10.0, cost_price=9.0, category="food"))
+        self.add_sale("2", datetime(2024, 5, 2), self.line("p", 1, 10.0, cost_price=6.0, category="drinks"))
+
+        report = self.margins()
+        rows = [(r["key"], r["units_sold"], r["revenue"], r["cost"], r["gross_profit"]) for r in report["rows"]]
+        self.assertEqual(rows, [("p", 3, 30.0, 18.0, 12.0), ("q", 1, 10.0, 9.0, 1.0)])
+        self.assertEqual(report["rows"][0]["margin_percent"], 40.0)
+        self.assertEqual((report["total_revenue"], report["total_cost"], report["gross_profit"]), (40.0, 27.0, 13.0))
+
+    def test_per_category_with_uncategorized_lines(self):
+        self.add_sale("1", datetime(2024, 5, 1), self.line("p", 1, 10.0, cost_price=4.0, category="drinks"),
+                      self.line("q", 1, 5.0, cost_price=5.0))
+        keys = {r["key"]: r["gross_profit"] for r in self.margins(group_by="category")["rows"]}
+        self.assertEqual(keys, {"drinks": 6.0, "uncategorized": 0.0})
+
+    def test_lines_without_cost_are_counted_not_summed(self):
+        self.add_sale("1", datetime(2024, 5, 1), self.line("p", 1, 10.0, cost_price=4.0), self.line("old", 3, 30.0))
+        report = self.margins()
+        self.assertEqual(report["lines_without_cost"], 1)
+        self.assertEqual(report["total_revenue"], 10.0)
+
+    def test_date_range(self):
+        self.add_sale("1", datetime(2024, 4, 30), self.line("p", 1, 10.0, cost_price=4.0))
+        self.add_sale("2", datetime(2024, 5, 2), self.line("p", 1, 12.0, cost_price=4.0))
+        report = self.margins(start_date="2024-05-01T00:00:00", end_date="2024-05-31T00:00:00")
+        self.assertEqual(report["total_revenue"], 12.0)
+
+    def test_margin_percent_of_nothing_sold(self):
+        self.assertIsNone(margin_percent(0.0, 0.0))
+        self.assertIsNone(self.margins()["margin_percent"])
+
+
+class SaleCostCaptureTest(ShopTestCase):
+    def test_sale_lines_carry_cost_and_category(self):
+        self.add_customer("c1")
+        self.add_product("p", stock=5, cost_price=3.0, selling_price=7.0, category="snacks")
+        response = self.client(sales_router).post("/sale", json={
+            "customer_id": "c1", "payment_method": "cash",
+            "items": [{"product_id": "p", "quantity": 2, "selling_price": 0, "total_price": 0}],
+        })
+        self.assertEqual(response.status_code, 200, response.text)
+        line = sales_collection.find_one({"shop_id": self.shop_id})["items"][0]
+        self.assertEqual((line["cost_price"], line["total_cost"], line["category"]), (3.0, 6.0, "snacks"))
+        self.assertEqual(line["total_price"], 14.0)
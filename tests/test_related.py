@@ -0,0 +1,76 @@
+"""Frequently bought together: pair counters, their rebuild, and GET /products/{id}/related (utils/related.py)."""
+from datetime import datetime
+from unittest import mock
+from database.config import product_pairs_collection, products_collection, sales_archive_collection, sales_collection
+from routes import Sales, products
+from utils import related
+from tests import ShopTestCase
+
+
+class RelatedProductsTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = self.client(Sales.router, products.router)
+        self.add_customer("c1")
+        for product_id in ("a", "b", "c", "d"):
+            self.add_product(product_id, stock=100)
+
+    def sell(self, *product_ids):
+        response = self.api.post("/sale", json={"customer_id": "c1", "payment_method": "cash", "items": [
+            {"product_id": product_id, "quantity": 1, "selling_price": 0, "total_price": 0} for product_id in product_ids]})
+        self.assertEqual(response.status_code, 200, response.text)
+
+    def related(self, product_id: str, **params):
+        response = self.api.get(f"/products/{product_id}/related", params=params)
+        self.assertEqual(response.status_code, 200, response.text)
+        return [(p["product_id"], p["count"], p["confidence"]) for p in response.json()]
+
+    def pairs(self) -> dict:
+        return {(p["product_id"], p["related_id"]): p["count"]
+                for p in product_pairs_collection.find({"shop_id": self.shop_id})}
+
+    def test_checkouts_count_pairs(self):
+        self.sell("a", "b")
+        self.sell("a", "b", "c")
+        self.sell("a", "c", "a")  # a product twice on one sale is one basket
+        self.sell("d")
+        self.assertEqual(self.related("a"), [("b", 2, 0.6667), ("c", 2, 0.6667)])
+        self.assertEqual(self.related("c", limit=1), [("a", 2, 1.0)])
+        self.assertEqual(self.related("d"), [])
+        self.assertEqual(self.api.get("/products/nope/related").status_code, 404)
+
+    def test_batch_uploads_count_pairs(self):
+        line = {"quantity": 1, "selling_price": 0, "total_price": 0}
+        self.api.post("/sales/batch", json=[
+            {"customer_id": "c1", "payment_method": "cash", "items": [{"product_id": "a", **line}, {"product_id": "b", **line}]},
+            {"customer_id": "c1", "payment_method": "cash", "items": [{"product_id": "b", **line}]},
+        ])
+        self.assertEqual(self.related("b"), [("a", 1, 0.5)])
+
+    def test_deleted_products_are_not_suggested(self):
+        self.sell("a", "b", "c")
+        products_collection.delete_one({"shop_id": self.shop_id, "id": "b"})
+        self.assertEqual([p for p, _, _ in self.related("a")], ["c"])
+
+    def test_bulk_orders_are_left_out(self):
+        with mock.patch.object(related, "MAX_BASKET_PRODUCTS", 2):
+            self.sell("a", "b", "c")
+            self.sell("a", "b")
+        self.assertEqual(self.pairs(), {("a", "a"): 1, ("a", "b"): 1, ("b", "a"): 1, ("b", "b"): 1})
+
+    def test_rebuild_matches_the_live_counters_and_reads_the_archive(self):
+        self.sell("a", "b")
+        self.sell("a", "b", "c")
+        self.sell("c", "d")
+        live = self.pairs()
+
+        self.assertEqual(related.rebuild_pairs(self.shop_id), len(live))
+        self.assertEqual(self.pairs(), live)
+
+        old = sales_collection.find_one({"shop_id": self.shop_id, "items.product_id": "d"})
+        sales_archive_collection.insert_one({**old, "created_at": datetime(2020, 1, 1)})
+        sales_collection.delete_one({"_id": old["_id"]})
+        product_pairs_collection.update_one({"shop_id": self.shop_id, "product_id": "a", "related_id": "b"},
+                                            {"$inc": {"count": 40}})  # drifted
+        related.rebuild_pairs(self.shop_id)
+        self.assertEqual(self.pairs(), live)
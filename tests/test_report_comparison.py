@@ -0,0 +1,87 @@
+"""Period-over-period comparison reports (POST /report?compare=true)."""
+from datetime import datetime, timedelta
+from unittest import TestCase
+from database.config import expenditures_collection, sales_collection
+from routes.report import previous_window, router as report_router
+from schema.report import ReportFilters, ReportType
+from tests import ShopTestCase
+
+
+class PreviousWindowTest(TestCase):
+    def window(self, start: datetime, end: datetime, report_type: ReportType):
+        return previous_window(ReportFilters(start_date=start, end_date=end), report_type)
+
+    def test_calendar_month(self):
+        self.assertEqual(
+            self.window(datetime(2024, 3, 1), datetime(2024, 3, 31), ReportType.MONTHLY),
+            (datetime(2024, 2, 1), datetime(2024, 2, 29)),
+        )
+
+    def test_year(self):
+        self.assertEqual(
+            self.window(datetime(2024, 1, 1), datetime(2024, 12, 31), ReportType.YEARLY),
+            (datetime(2023, 1, 1), datetime(2023, 12, 31)),
+        )
+
+    def test_custom_range_ends_where_the_current_one_starts(self):
+        start, end = datetime(2024, 5, 1), datetime(2024, 6, 10)
+        self.assertEqual(self.window(start, end, ReportType.CUSTOM), (start - (end - start), start))
+
+
+class ComparisonReportTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = self.client(report_router)
+        self.add_customer("c1", name="Alice")
+        self.add_customer("c2", name="Bob")
+        self.add_product("p1")
+
+    def add_sale(self, sale_id: str, created_at: datetime, amount: float, customer_id: str = "c1", quantity: int = 1):
+        sales_collection.insert_one({
+            "shop_id": self.shop_id, "id": sale_id, "customer_id": customer_id, "created_at": created_at,
+            "total_amount": amount, "payment_method": "cash",
+            "items": [{"product_id": "p1", "quantity": quantity, "total_price": amount}],
+        })
+
+    def compare(self, start: datetime, end: datetime) -> dict:
+        response = self.api.post("/report", params={"compare": "true"},
+                                 json={"start_date": start.isoformat(), "end_date": end.isoformat()})
+        self.assertEqual(response.status_code, 200, response.text)
+        return response.json()
+
+    def test_month_over_month(self):
+        self.add_sale("1", datetime(2024, 4, 10), 100.0, customer_id="c1", quantity=2)
+        self.add_sale("2", datetime(2024, 5, 5), 150.0, customer_id="c2", quantity=3)
+        self.add_sale("3", datetime(2024, 5, 20), 50.0, customer_id="c1", quantity=1)
+        expenditures_collection.insert_one({"shop_id": self.shop_id, "id": "e1", "amount": 20.0,
+                                            "created_at": datetime(2024, 5, 7)})
+
+        report = self.compare(datetime(2024, 5, 1), datetime(2024, 5, 31))
+        current, previous = report["current"], report["previous"]
+        self.assertEqual(current["report_type"], "monthly")
+        self.assertEqual((current["total_sales"], previous["total_sales"]), (200.0, 100.0))
+        self.assertEqual((current["total_products_sold"], previous["total_products_sold"]), (4, 2))
+        self.assertEqual(current["net_profit"], 180.0)
+        self.assertEqual(current["best_customer"], "Bob")
+        self.assertEqual(report["deltas"]["total_sales"], 100.0)
+        self.assertEqual(report["percent_changes"]["total_sales"], 100.0)
+        self.assertFalse(report["degraded"])
+
+    def test_sale_on_the_shared_boundary_counts_once(self):
+        start, end = datetime(2024, 5, 1), datetime(2024, 6, 10)  # custom range, previous ends at start
+        self.add_sale("1", start, 30.0)
+        self.add_sale("2", start - timedelta(days=1), 10.0)
+
+        report = self.compare(start, end)
+        self.assertEqual(report["current"]["total_sales"], 30.0)
+        self.assertEqual(report["previous"]["total_sales"], 10.0)
+
+    def test_empty_previous_period_has_no_percent_change(self):
+        self.add_sale("1", datetime(2024, 5, 5), 40.0)
+        report = self.compare(datetime(2024, 5, 1), datetime(2024, 5, 31))
+        self.assertEqual(report["previous"]["total_sales"], 0.0)
+        self.assertIsNone(report["percent_changes"]["total_sales"])
+
+    def test_both_dates_are_required(self):
+        response = self.api.post("/report", params={"compare": "true"}, json={"start_date": "2024-05-01T00:00:00"})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,126 @@
+"""Oversell-safe checkout: conditional decrements, their rollback, and stock holds (utils/reservations.py)."""
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+from database.config import holds_collection, products_collection, purchases_collection, sales_collection
+from database.routing import money
+from routes import Sales, inventory, purchases
+from utils.reservations import release_expired
+from tests import ShopTestCase
+
+
+class CheckoutTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = self.client(Sales.router, inventory.router)
+        self.add_customer("c1")
+        self.add_product("p", stock=5)
+        self.add_product("q", stock=1)
+
+    @staticmethod
+    def lines(**quantities):
+        return [{"product_id": product_id, "quantity": quantity, "selling_price": 0, "total_price": 0}
+                for product_id, quantity in quantities.items()]
+
+    def sell(self, reservation_id: str = None, **quantities):
+        return self.api.post("/sale", json={"customer_id": "c1", "payment_method": "cash",
+                                            "items": self.lines(**quantities), "reservation_id": reservation_id})
+
+    def reserve(self, **quantities):
+        return self.api.post("/stock/reservations", json={"items": [
+            {"product_id": product_id, "quantity": quantity} for product_id, quantity in quantities.items()]})
+
+    def test_short_line_rolls_back_the_lines_before_it(self):
+        response = self.sell(p=2, q=3)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Available: 1, requested: 3", response.json()["detail"])
+        self.assertEqual((self.stock("p"), self.stock("q")), (5, 1))
+        self.assertEqual(sales_collection.count_documents({"shop_id": self.shop_id}), 0)
+
+    def test_failed_sale_insert_gives_the_stock_back(self):
+        sales = mock.Mock(wraps=money(sales_collection))
+        sales.insert_one.side_effect = RuntimeError("primary stepped down")
+
+        def routed(collection):
+            return sales if collection.name == "sales" else money(collection)
+
+        with mock.patch.object(Sales, "money", routed), self.assertRaises(RuntimeError):
+            self.sell(p=2)
+        self.assertEqual(self.stock("p"), 5)
+
+    def test_stock_never_goes_negative(self):
+        self.assertEqual(self.sell(q=1).status_code, 200)
+        self.assertEqual(self.sell(q=1).status_code, 400)
+        self.assertEqual(self.stock("q"), 0)
+
+    def test_reserved_stock_is_sold_once(self):
+        hold = self.reserve(p=3).json()
+        self.assertEqual(self.stock("p"), 2)
+        self.assertEqual(self.reserve(p=3).status_code, 409)  # only 2 left on the shelf
+
+        sale = self.sell(reservation_id=hold["id"], p=2)
+        self.assertEqual(sale.status_code, 200, sale.text)
+        self.assertEqual(self.stock("p"), 3)  # the unused unit went back
+        confirmed = self.api.get(f"/stock/reservations/{hold['id']}").json()
+        self.assertEqual((confirmed["status"], confirmed["sale_id"]), ("confirmed", sale.json()["id"]))
+
+        again = self.sell(reservation_id=hold["id"], p=1)
+        self.assertEqual(again.status_code, 409)
+        self.assertEqual(sales_collection.count_documents({"shop_id": self.shop_id}), 1)  # the second sale was voided
+        self.assertEqual(self.stock("p"), 3)
+
+    def test_sale_cannot_use_more_than_was_held(self):
+        hold = self.reserve(p=1).json()
+        self.assertEqual(self.sell(reservation_id=hold["id"], p=2).status_code, 400)
+        self.assertEqual(self.api.get(f"/stock/reservations/{hold['id']}").json()["status"], "active")
+
+    def test_short_reservation_holds_nothing(self):
+        response = self.reserve(p=2, q=2)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual((self.stock("p"), self.stock("q")), (5, 1))
+        self.assertEqual(holds_collection.count_documents({"shop_id": self.shop_id}), 0)
+
+    def test_cancel_returns_the_stock_once(self):
+        hold = self.reserve(p=4).json()
+        self.assertEqual(self.api.delete(f"/stock/reservations/{hold['id']}").json()["status"], "released")
+        self.assertEqual(self.stock("p"), 5)
+        self.assertEqual(self.api.delete(f"/stock/reservations/{hold['id']}").status_code, 409)
+        self.assertEqual(self.stock("p"), 5)
+
+    def test_expired_holds_are_released_and_cannot_be_sold(self):
+        hold = self.reserve(p=4).json()
+        holds_collection.update_one({"shop_id": self.shop_id, "id": hold["id"]},
+                                    {"$set": {"expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+        self.assertEqual(self.sell(reservation_id=hold["id"], p=4).status_code, 409)
+
+        self.assertGreaterEqual(release_expired(), 1)
+        self.assertEqual(self.stock("p"), 5)
+        self.assertEqual(self.api.get(f"/stock/reservations/{hold['id']}").json()["status"], "expired")
+        self.assertEqual(release_expired(), 0)
+
+
+class PurchaseStockTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = self.client(purchases.router)
+        self.add_product("p", stock=2, cost_price=4.0)
+        self.add_product("q", stock=0, cost_price=1.5)
+
+    def purchase(self, *items):
+        return self.api.post("/purchase", json={"id": "0", "purchased_by": "me", "items": [
+            {"product_id": product_id, "quantity": quantity} for product_id, quantity in items]})
+
+    def test_stock_is_incremented(self):
+        response = self.purchase(("p", 3), ("q", 4), ("p", 1))
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(response.json()["total_amount"], 22.0)
+        self.assertEqual((self.stock("p"), self.stock("q")), (6, 4))
+
+    def test_concurrent_changes_are_not_overwritten(self):
+        products_collection.update_one({"shop_id": self.shop_id, "id": "p"}, {"$inc": {"current_stock": -1}})
+        self.purchase(("p", 3))
+        self.assertEqual(self.stock("p"), 4)
+
+    def test_unknown_product_changes_nothing(self):
+        self.assertEqual(self.purchase(("p", 3), ("nope", 1)).status_code, 404)
+        self.assertEqual(self.stock("p"), 2)
+        self.assertEqual(purchases_collection.count_documents({"shop_id": self.shop_id}), 0)
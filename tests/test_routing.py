@@ -0,0 +1,87 @@
+"""Read preference and write concern per router (database/routing.py)."""
+from datetime import datetime
+from unittest import TestCase, mock
+from pymongo.read_preferences import Primary, SecondaryPreferred
+from database import routing
+from database.config import debts_collection, purchases_collection, sales_collection
+from routes import Sales, customer, debt, purchases, report
+from tests import ShopTestCase
+
+
+class HelpersTest(TestCase):
+    def test_reporting_reads_secondaries_with_bounded_staleness(self):
+        collection = routing.reporting(sales_collection)
+        self.assertEqual(collection.read_preference, SecondaryPreferred(max_staleness=90))
+        self.assertIs(routing.reporting(sales_collection), collection)
+
+    def test_money_writes_majority_and_reads_the_primary(self):
+        collection = routing.money(sales_collection)
+        self.assertEqual(collection.write_concern.document, {"w": "majority", "wtimeout": 5000})
+        self.assertEqual(collection.read_preference, Primary())
+
+
+class RouteRoutingTest(ShopTestCase):
+    """Which helper each route goes through, and the options of what it got back."""
+
+    def setUp(self):
+        super().setUp()
+        self.used = []
+        for module in (Sales, customer, debt, purchases, report):
+            for name in ("money", "reporting"):
+                if hasattr(module, name):
+                    patcher = mock.patch.object(module, name, self.recorder(name))
+                    patcher.start()
+                    self.addCleanup(patcher.stop)
+        self.api = self.client(Sales.router, customer.router, debt.router, purchases.router, report.router)
+        self.add_customer("c1", name="Alice")
+        self.add_product("p", stock=10)
+
+    def recorder(self, name: str):
+        helper = getattr(routing, name)
+
+        def record(collection):
+            routed = helper(collection)
+            self.used.append((name, collection.name, routed))
+            return routed
+        return record
+
+    def assertRouted(self, response, expected: set):
+        self.assertLess(response.status_code, 300, response.text)
+        self.assertEqual({(name, collection) for name, collection, _ in self.used}, expected)
+        for name, _, routed in self.used:
+            if name == "money":
+                self.assertEqual(routed.read_preference, Primary())
+                self.assertEqual(routed.write_concern.document["w"], "majority")
+            else:
+                self.assertEqual(routed.read_preference, SecondaryPreferred(max_staleness=90))
+
+    def test_checkout_writes_are_money(self):
+        response = self.api.post("/sale", json={"customer_id": "c1", "payment_method": "cash", "items": [
+            {"product_id": "p", "quantity": 1, "selling_price": 0, "total_price": 0}]})
+        self.assertRouted(response, {("money", "products"), ("money", "sales")})
+
+    def test_purchase_writes_are_money(self):
+        response = self.api.post("/purchase", json={"id": "0", "purchased_by": "me", "items": [
+            {"product_id": "p", "quantity": 3}]})
+        self.assertRouted(response, {("money", "products"), ("money", "purchases")})
+
+    def test_debt_payment_reads_back_from_the_primary(self):
+        debts_collection.insert_one({"shop_id": self.shop_id, "id": "7", "customer_name": "Alice", "sale_id": "1",
+                                     "amount": 20.0, "balance": 20.0, "created_at": datetime(2024, 5, 1),
+                                     "cleared": False, "payment": []})
+        response = self.api.put("/debts/7/pay", params={"amount": 5})
+        self.assertRouted(response, {("money", "debts"), ("money", "customers")})
+
+    def test_reports_read_with_the_reporting_preference(self):
+        self.assertRouted(self.api.post("/report", json={}), {
+            ("reporting", "sales"), ("reporting", "expenditures"), ("reporting", "purchases"), ("reporting", "debts")})
+
+    def test_aging_and_statement_read_with_the_reporting_preference(self):
+        self.assertRouted(self.api.get("/debts/aging"), {("reporting", "debts")})
+        self.used.clear()
+        self.assertRouted(self.api.get("/customers/c1/statement"), {("reporting", "sales")})
+
+    def test_list_endpoints_read_with_the_reporting_preference(self):
+        purchases_collection.insert_one({"shop_id": self.shop_id, "id": "1", "purchased_by": "me", "items": [],
+                                         "created_at": datetime(2024, 5, 1)})
+        self.assertRouted(self.api.get("/purchases"), {("reporting", "purchases")})
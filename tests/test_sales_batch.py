@@ -0,0 +1,95 @@
+"""Offline sales uploaded in batches (POST /sales/batch)."""
+from unittest import mock
+from database.config import customers_collection, debts_collection, ensure_indexes, sales_collection
+from routes import Sales
+from tests import ShopTestCase
+
+
+class SalesBatchTest(ShopTestCase):
+    @classmethod
+    def setUpClass(cls):
+        ensure_indexes()  # the unique client_ref index settles racing uploads
+
+    def setUp(self):
+        super().setUp()
+        self.api = self.client(Sales.router)
+        self.add_customer("c1", name="Alice", balance=0.0)
+        self.add_product("p", stock=5, selling_price=10.0)
+
+    @staticmethod
+    def sale(client_ref=None, quantity: int = 1, payment_method: str = "cash", product_id: str = "p", **fields):
+        return {"customer_id": "c1", "payment_method": payment_method, "client_ref": client_ref,
+                "items": [{"product_id": product_id, "quantity": quantity, "selling_price": 0, "total_price": 0}],
+                **fields}
+
+    def upload(self, *sales) -> dict:
+        response = self.api.post("/sales/batch", json=list(sales))
+        self.assertEqual(response.status_code, 200, response.text)
+        return response.json()
+
+    def test_reupload_is_idempotent(self):
+        first = self.upload(self.sale("t1-1"), self.sale("t1-2", quantity=2))
+        self.assertEqual((first["created"], first["duplicates"], first["failed"]), (2, 0, 0))
+
+        again = self.upload(self.sale("t1-1"), self.sale("t1-2", quantity=2))
+        self.assertEqual((again["created"], again["duplicates"]), (0, 2))
+        self.assertEqual([r["sale_id"] for r in again["results"]], [r["sale_id"] for r in first["results"]])
+        self.assertEqual(self.stock("p"), 2)
+        self.assertEqual(sales_collection.count_documents({"shop_id": self.shop_id}), 2)
+
+    def test_repeat_within_a_batch_is_a_duplicate(self):
+        batch = self.upload(self.sale("t1-1"), self.sale("t1-1"))
+        self.assertEqual([r["status"] for r in batch["results"]], ["created", "duplicate"])
+        self.assertEqual(batch["results"][1]["sale_id"], batch["results"][0]["sale_id"])
+        self.assertEqual(self.stock("p"), 4)
+
+    def test_sales_without_client_ref_are_always_created(self):
+        self.assertEqual(self.upload(self.sale(), self.sale())["created"], 2)
+
+    def test_later_sales_see_the_stock_earlier_ones_took(self):
+        batch = self.upload(self.sale("a", quantity=3), self.sale("b", quantity=3), self.sale("c", quantity=2))
+        self.assertEqual([r["status"] for r in batch["results"]], ["created", "failed", "created"])
+        self.assertIn("Not enough stock", batch["results"][1]["detail"])
+        self.assertEqual(self.stock("p"), 0)
+
+    def test_invalid_sales_fail_alone(self):
+        batch = self.upload(self.sale("a", product_id="nope"), self.sale("b", reservation_id="h1"), self.sale("c"))
+        self.assertEqual([r["status"] for r in batch["results"]], ["failed", "failed", "created"])
+
+    def test_stock_sold_meanwhile_fails_only_the_sales_needing_it(self):
+        self.add_product("q", stock=5)
+        take_stock = Sales._take_stock
+
+        def checkout_first(shop_id, sold):
+            if "p" in sold:  # another till sells p between the read and the decrement
+                self.assertFalse(take_stock(shop_id, {"p": 4}))
+            return take_stock(shop_id, sold)
+
+        with mock.patch.object(Sales, "_take_stock", checkout_first):
+            batch = self.upload(self.sale("a", quantity=2), self.sale("b", product_id="q"))
+        self.assertEqual([r["status"] for r in batch["results"]], ["failed", "created"])
+        self.assertEqual((self.stock("p"), self.stock("q")), (1, 4))
+
+    def test_racing_upload_loses_on_the_unique_index(self):
+        take_stock = Sales._take_stock
+
+        def other_upload_first(shop_id, sold):
+            sales_collection.insert_one({"shop_id": shop_id, "id": "999", "client_ref": "t1-1", "items": []})
+            return take_stock(shop_id, sold)
+
+        with mock.patch.object(Sales, "_take_stock", other_upload_first):
+            batch = self.upload(self.sale("t1-1", quantity=2))
+        self.assertEqual(batch["results"][0]["status"], "duplicate")
+        self.assertEqual(batch["results"][0]["sale_id"], "999")
+        self.assertEqual(self.stock("p"), 5)  # its decrement was given back
+
+    def test_debt_sales_open_debts_and_move_the_balance(self):
+        self.upload(self.sale("a", quantity=1, payment_method="debt"), self.sale("b", quantity=2, payment_method="debt"))
+        debts = list(debts_collection.find({"shop_id": self.shop_id}).sort("id", 1))
+        self.assertEqual([(d["amount"], d["balance"]) for d in debts], [(10.0, 10.0), (20.0, 30.0)])
+        self.assertEqual(customers_collection.find_one({"shop_id": self.shop_id, "id": "c1"})["balance"], 30.0)
+
+    def test_batch_limits(self):
+        self.assertEqual(self.api.post("/sales/batch", json=[]).status_code, 400)
+        with mock.patch.object(Sales, "MAX_BATCH_SALES", 1):
+            self.assertEqual(self.api.post("/sales/batch", json=[self.sale(), self.sale()]).status_code, 400)
@@ -0,0 +1,85 @@
+"""Customer statements with a running balance (GET /customers/{id}/statement) and signed cursors."""
+from datetime import datetime
+from unittest import TestCase
+from database.config import debts_collection, sales_collection
+from routes.customer import router as customer_router
+from utils.cursor import decode_cursor, encode_cursor
+from tests import ShopTestCase
+
+
+class CursorTest(TestCase):
+    def test_round_trip(self):
+        cursor = encode_cursor({"date": "2024-05-01T10:00:00", "seq": "0:1", "balance": 12.5})
+        self.assertEqual(decode_cursor(cursor, datetime_fields=("date",)),
+                         {"date": datetime(2024, 5, 1, 10), "seq": "0:1", "balance": 12.5})
+
+    def test_altered_cursor_is_rejected(self):
+        body, signature = encode_cursor({"balance": 12.5}).split(".")
+        forged = encode_cursor({"balance": -1000}).split(".")[0]
+        with self.assertRaises(ValueError):
+            decode_cursor(f"{forged}.{signature}")
+        with self.assertRaises(ValueError):
+            decode_cursor(body)
+
+
+class StatementTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = self.add_customer("c1", name="Alice")
+        self.api = self.client(customer_router)
+        sales_collection.insert_many([
+            {"shop_id": self.shop_id, "id": "1", "customer_id": "c1", "created_at": datetime(2024, 5, 1, 9),
+             "total_amount": 30.0, "payment_method": "debt"},
+            {"shop_id": self.shop_id, "id": "2", "customer_id": "c1", "created_at": datetime(2024, 5, 3, 9),
+             "total_amount": 5.0, "payment_method": "cash"},
+        ])
+        debts_collection.insert_one({
+            "shop_id": self.shop_id, "id": "7", "customer_name": "Alice", "sale_id": "1", "amount": 30.0,
+            "created_at": datetime(2024, 5, 1, 9), "cleared": False,
+            "payment": [
+                {"amount": 10.0, "date": datetime(2024, 5, 2, 12), "method": "cash"},
+                {"amount": 5.0, "date": datetime(2024, 5, 4, 12)},
+            ],
+        })
+
+    def statement(self, **params) -> dict:
+        response = self.api.get("/customers/c1/statement", params=params)
+        self.assertEqual(response.status_code, 200, response.text)
+        return response.json()
+
+    def test_entries_in_order_with_running_balance(self):
+        statement = self.statement()
+        entries = [(e["type"], e["reference_id"], e["balance"]) for e in statement["entries"]]
+        self.assertEqual(entries, [
+            ("sale", "1", 0.0),
+            ("debt", "7", 30.0),  # same timestamp as its sale, listed after it
+            ("payment", "7:0", 20.0),
+            ("sale", "2", 20.0),
+            ("payment", "7:1", 15.0),
+        ])
+        self.assertEqual(statement["closing_balance"], 15.0)
+        self.assertIn("(unknown)", statement["entries"][-1]["description"])
+        self.assertIsNone(statement["next_cursor"])
+
+    def test_pages_carry_the_balance(self):
+        first = self.statement(limit=2)
+        self.assertEqual([e["reference_id"] for e in first["entries"]], ["1", "7"])
+
+        second = self.statement(limit=2, cursor=first["next_cursor"])
+        self.assertEqual(second["opening_balance"], 30.0)
+        self.assertEqual([(e["reference_id"], e["balance"]) for e in second["entries"]], [("7:0", 20.0), ("2", 20.0)])
+
+        third = self.statement(limit=2, cursor=second["next_cursor"])
+        self.assertEqual([e["reference_id"] for e in third["entries"]], ["7:1"])
+        self.assertEqual(third["closing_balance"], 15.0)
+
+    def test_forged_or_foreign_cursor_is_rejected(self):
+        cursor = self.statement(limit=2)["next_cursor"]
+        signature = cursor.split(".")[1]
+        forged = encode_cursor({"customer": "c1", "date": "2024-05-01T09:00:00", "seq": "1:7", "balance": 0.0})
+        response = self.api.get("/customers/c1/statement", params={"cursor": f"{forged.split('.')[0]}.{signature}"})
+        self.assertEqual(response.status_code, 400)
+
+        self.add_customer("c2", name="Bob")
+        response = self.api.get("/customers/c2/statement", params={"cursor": cursor})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,76 @@
+"""Supplier spend, purchase-price history and cost changes (GET /suppliers/analytics)."""
+from datetime import datetime
+from database.config import purchases_archive_collection, purchases_collection
+from routes import purchases
+from tests import ShopTestCase
+
+
+class SupplierAnalyticsTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = self.client(purchases.router)
+        self.next_id = 0
+
+    def add_purchase(self, created_at: datetime, supplier, *lines, collection=purchases_collection):
+        """lines: (product_id, quantity, cost_price)"""
+        self.next_id += 1
+        items = [{"product_id": product_id, "product_name": f"Product {product_id}", "quantity": quantity,
+                  "cost_price": cost, "total_cost": None if cost is None else quantity * cost}
+                 for product_id, quantity, cost in lines]
+        doc = {"shop_id": self.shop_id, "id": str(self.next_id), "purchased_by": "me", "created_at": created_at,
+               "items": items, "total_amount": sum(item["total_cost"] or 0 for item in items)}
+        if supplier:
+            doc["supplier"] = supplier
+        collection.insert_one(doc)
+
+    def analytics(self, **params) -> dict:
+        response = self.api.get("/suppliers/analytics", params=params)
+        self.assertEqual(response.status_code, 200, response.text)
+        return response.json()
+
+    def test_spend_per_supplier(self):
+        self.add_purchase(datetime(2024, 1, 5), "Acme", ("p", 10, 2.0), ("q", 5, 1.0))
+        self.add_purchase(datetime(2024, 2, 5), "Acme", ("p", 10, 2.5))
+        self.add_purchase(datetime(2024, 3, 1), None, ("r", 1, 4.0))
+
+        suppliers = [(s["supplier"], s["total_spend"], s["purchase_count"], s["product_count"])
+                     for s in self.analytics()["suppliers"]]
+        self.assertEqual(suppliers, [("Acme", 50.0, 2, 2), ("Unknown", 4.0, 1, 1)])
+        acme = self.analytics()["suppliers"][0]
+        self.assertEqual((acme["first_purchase"][:10], acme["last_purchase"][:10]), ("2024-01-05", "2024-02-05"))
+
+    def test_price_history_and_cost_changes(self):
+        self.add_purchase(datetime(2024, 1, 5), "Acme", ("p", 10, 2.0))
+        self.add_purchase(datetime(2024, 2, 5), "Acme", ("p", 5, 2.0))  # same cost: same price point
+        self.add_purchase(datetime(2024, 3, 5), "Acme", ("p", 4, 2.5))
+        self.add_purchase(datetime(2024, 4, 5), "Acme", ("p", 1, 2.4), ("legacy", 3, None))
+
+        report = self.analytics()
+        [prices] = report["prices"]
+        self.assertEqual([(point["cost_price"], point["quantity"]) for point in prices["history"]],
+                         [(2.0, 15), (2.5, 4), (2.4, 1)])
+        self.assertEqual((prices["quantity"], prices["latest_cost"], prices["average_cost"]), (20, 2.4, 42.4 / 20))
+        self.assertEqual([(c["old_cost"], c["new_cost"], c["change_pct"]) for c in report["cost_changes"]],
+                         [(2.5, 2.4, -4.0), (2.0, 2.5, 25.0)])  # newest first
+
+        large = self.analytics(min_change_pct=10)["cost_changes"]
+        self.assertEqual([c["new_cost"] for c in large], [2.5])
+
+    def test_filters(self):
+        self.add_purchase(datetime(2024, 1, 5), "Acme", ("p", 1, 2.0))
+        self.add_purchase(datetime(2024, 2, 5), "Bolt", ("p", 1, 3.0))
+        self.add_purchase(datetime(2024, 3, 5), "Acme", ("p", 1, 4.0))
+
+        self.assertEqual([s["supplier"] for s in self.analytics(supplier="Bolt")["suppliers"]], ["Bolt"])
+        windowed = self.analytics(start_date="2024-02-01T00:00:00", end_date="2024-03-31T00:00:00")
+        self.assertEqual(sorted(s["supplier"] for s in windowed["suppliers"]), ["Acme", "Bolt"])
+        self.assertEqual([s["total_spend"] for s in windowed["suppliers"] if s["supplier"] == "Acme"], [4.0])
+
+    def test_archived_purchases_on_request(self):
+        self.add_purchase(datetime(2022, 1, 5), "Acme", ("p", 10, 1.5), collection=purchases_archive_collection)
+        self.add_purchase(datetime(2024, 1, 5), "Acme", ("p", 10, 2.0))
+
+        self.assertEqual(self.analytics()["suppliers"][0]["total_spend"], 20.0)
+        report = self.analytics(include_archived="true")
+        self.assertEqual(report["suppliers"][0]["total_spend"], 35.0)
+        self.assertEqual([(c["old_cost"], c["new_cost"]) for c in report["cost_changes"]], [(1.5, 2.0)])
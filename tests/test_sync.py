@@ -0,0 +1,64 @@
+"""
+Delta sync against a real MongoDB (DATABASE_URL); skipped when none is configured.
+
+    python -m unittest tests.test_sync
+"""
+import os
+import time
+import unittest
+import uuid
+
+try:
+    import pymongo  # noqa: F401
+except ImportError:
+    pymongo = None
+
+
+@unittest.skipUnless(pymongo and os.getenv("DATABASE_URL"), "needs pymongo and DATABASE_URL")
+class InterleavedWritersTest(unittest.TestCase):
+    def setUp(self):
+        from database.config import products_collection, tombstones_collection, versions_collection
+        from utils import sync
+
+        self.sync = sync
+        self.products = products_collection
+        self.shop_id = f"test-{uuid.uuid4().hex}"
+        self.grace = sync.SYNC_GRACE_SECONDS
+        sync.SYNC_GRACE_SECONDS = 0.5
+        self.addCleanup(setattr, sync, "SYNC_GRACE_SECONDS", self.grace)
+        self.addCleanup(products_collection.delete_many, {"shop_id": self.shop_id})
+        self.addCleanup(tombstones_collection.delete_many, {"shop_id": self.shop_id})
+        self.addCleanup(versions_collection.delete_many, {"_id": {"$regex": f"^{self.shop_id}:"}})
+
+    def write(self, product_id: str, version: int):
+        self.products.insert_one({"shop_id": self.shop_id, "id": product_id, "name": product_id,
+                                  "change_version": version})
+
+    def pull(self, since: int) -> dict:
+        return self.sync.changes_since(self.shop_id, "products", since, 100)
+
+    def test_later_version_stored_first_is_held_back(self):
+        version_a = self.sync.next_change_version(self.shop_id, "products")  # writer A reserves...
+        version_b = self.sync.next_change_version(self.shop_id, "products")
+        self.write("b", version_b)  # ...writer B reserves after it but stores first
+
+        early = self.pull(0)
+        self.assertEqual(early["changed"], [])
+        self.assertEqual(early["version"], 0)
+
+        self.write("a", version_a)
+        time.sleep(self.sync.SYNC_GRACE_SECONDS + 0.2)
+        synced = self.pull(early["version"])
+        self.assertEqual([doc["id"] for doc in synced["changed"]], ["a", "b"])
+        self.assertEqual(synced["version"], version_b)
+
+    def test_nothing_in_flight_serves_everything(self):
+        version = self.sync.next_change_version(self.shop_id, "products")
+        self.write("a", version)
+        time.sleep(self.sync.SYNC_GRACE_SECONDS + 0.2)
+        self.assertEqual(self.sync.safe_version(self.shop_id, "products"), version)
+        self.assertEqual([doc["id"] for doc in self.pull(0)["changed"]], ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
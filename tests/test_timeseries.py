@@ -0,0 +1,92 @@
+"""Revenue time series (GET /sales/timeseries) and the bucketing helpers behind it."""
+from datetime import datetime
+from unittest import TestCase, mock
+from database.config import sales_collection
+from routes import Sales
+from utils.timebuckets import bucket_range, next_bucket, shift_months, truncate
+from tests import ShopTestCase, parts_trunc
+
+
+class BucketHelpersTest(TestCase):
+    def test_truncate(self):
+        value = datetime(2024, 3, 7, 15, 42, 10)  # a Thursday
+        self.assertEqual(truncate(value, "hour"), datetime(2024, 3, 7, 15))
+        self.assertEqual(truncate(value, "day"), datetime(2024, 3, 7))
+        self.assertEqual(truncate(value, "week"), datetime(2024, 3, 4))
+        self.assertEqual(truncate(value, "month"), datetime(2024, 3, 1))
+
+    def test_next_bucket_rolls_the_year(self):
+        self.assertEqual(next_bucket(datetime(2023, 12, 1), "month"), datetime(2024, 1, 1))
+
+    def test_bucket_range_excludes_the_end(self):
+        self.assertEqual(
+            bucket_range(datetime(2024, 1, 30, 6), datetime(2024, 2, 2), "day"),
+            [datetime(2024, 1, 30), datetime(2024, 1, 31), datetime(2024, 2, 1)],
+        )
+
+    def test_bucket_range_is_bounded(self):
+        with self.assertRaises(ValueError):
+            bucket_range(datetime(2000, 1, 1), datetime(2024, 1, 1), "hour")
+
+    def test_shift_months_clamps_the_day(self):
+        self.assertEqual(shift_months(datetime(2024, 3, 31), -1), datetime(2024, 2, 29))
+        self.assertEqual(shift_months(datetime(2024, 1, 15), -12), datetime(2023, 1, 15))
+
+
+@mock.patch.object(Sales, "date_trunc_expression", parts_trunc)
+class TimeSeriesRouteTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = self.client(Sales.router)
+
+    def add_sale(self, sale_id: str, created_at: datetime, amount: float, items, **fields):
+        sales_collection.insert_one({
+            "shop_id": self.shop_id, "id": sale_id, "created_at": created_at, "total_amount": amount,
+            "payment_method": "cash", "items": items, **fields,
+        })
+
+    def test_daily_buckets_are_zero_filled(self):
+        self.add_sale("1", datetime(2024, 5, 1, 9), 10.0, [{"product_id": "p", "quantity": 2, "total_price": 10.0}])
+        self.add_sale("2", datetime(2024, 5, 1, 17), 5.0, [{"product_id": "q", "quantity": 1, "total_price": 5.0}])
+        self.add_sale("3", datetime(2024, 5, 3, 8), 7.0, [{"product_id": "p", "quantity": 1, "total_price": 7.0}])
+
+        response = self.api.get("/sales/timeseries", params={
+            "granularity": "day", "start_date": "2024-05-01T00:00:00", "end_date": "2024-05-04T00:00:00",
+        })
+        self.assertEqual(response.status_code, 200)
+        points = [(p["bucket"][:10], p["revenue"], p["sales_count"], p["units_sold"]) for p in response.json()["points"]]
+        self.assertEqual(points, [
+            ("2024-05-01", 15.0, 2, 3),
+            ("2024-05-02", 0.0, 0, 0),
+            ("2024-05-03", 7.0, 1, 1),
+        ])
+
+    def test_product_filter_counts_only_its_lines(self):
+        self.add_sale("1", datetime(2024, 5, 1, 9), 15.0, [
+            {"product_id": "p", "quantity": 2, "total_price": 10.0},
+            {"product_id": "q", "quantity": 1, "total_price": 5.0},
+        ])
+        response = self.api.get("/sales/timeseries", params={
+            "granularity": "month", "start_date": "2024-05-01T00:00:00", "end_date": "2024-06-01T00:00:00",
+            "product_id": "p",
+        })
+        point = response.json()["points"][0]
+        self.assertEqual((point["revenue"], point["units_sold"]), (10.0, 2))
+
+    def test_end_is_exclusive_and_other_shops_are_ignored(self):
+        self.add_sale("1", datetime(2024, 5, 1, 10), 4.0, [])
+        self.add_sale("2", datetime(2024, 5, 1, 11), 6.0, [])  # at the end bound
+        sales_collection.insert_one({"shop_id": f"{self.shop_id}-other", "id": "3", "total_amount": 100.0,
+                                     "created_at": datetime(2024, 5, 1, 10, 30), "items": []})
+        self.addCleanup(sales_collection.delete_many, {"shop_id": f"{self.shop_id}-other"})
+
+        response = self.api.get("/sales/timeseries", params={
+            "granularity": "hour", "start_date": "2024-05-01T10:00:00", "end_date": "2024-05-01T11:00:00",
+        })
+        self.assertEqual([p["revenue"] for p in response.json()["points"]], [4.0])
+
+    def test_reversed_range_is_rejected(self):
+        response = self.api.get("/sales/timeseries", params={
+            "start_date": "2024-05-02T00:00:00", "end_date": "2024-05-01T00:00:00",
+        })
+        self.assertEqual(response.status_code, 400)
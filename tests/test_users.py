@@ -0,0 +1,76 @@
+"""User management: roles, shops and the upgrade migration (routes/user.py, utils/shop_migration.py)."""
+import uuid
+from auth.auth import DEFAULT_SHOP_ID, create_access_token
+from database.config import users_collection
+from routes.user import router as user_router
+from utils.shop_migration import promote_admins
+from tests import ShopTestCase
+
+
+class UserRoutesTest(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = self.client(user_router, role="admin")
+        self.member = self.client(user_router, role="user")
+        self.addCleanup(users_collection.delete_many, {"shop_id": f"{self.shop_id}-branch"})
+        # Past the bootstrap: with no users at all the first one becomes admin of the main shop
+        users_collection.insert_one({"shop_id": self.shop_id, "id": "1", "username": f"{self.shop_id}-admin",
+                                     "email": "admin@example.com", "role": "admin"})
+
+    def new_user(self, api, role: str = "user"):
+        name = f"u-{uuid.uuid4().hex[:8]}"
+        return api.post("/user", json={"username": name, "email": f"{name}@example.com", "password": "pw", "role": role})
+
+    def test_admin_creates_users_and_admins_in_its_shop(self):
+        user = self.new_user(self.admin).json()
+        admin = self.new_user(self.admin, role="admin").json()
+        self.assertEqual((user["shop_id"], user["role"]), (self.shop_id, "user"))
+        self.assertEqual((admin["shop_id"], admin["role"]), (self.shop_id, "admin"))
+
+    def test_users_cannot_create_users(self):
+        self.assertEqual(self.new_user(self.member).status_code, 403)
+
+    def test_users_only_edit_themselves(self):
+        other = self.new_user(self.admin).json()
+        response = self.member.put(f"/users/{other['id']}", json={"email": "x@example.com"})
+        self.assertEqual(response.status_code, 403)
+        response = self.member.put(f"/users/{other['id']}/change-password", json={"new_password": "new"})
+        self.assertEqual(response.status_code, 403)
+
+        users_collection.insert_one({"shop_id": self.shop_id, "id": "900", "username": f"{self.shop_id}-user",
+                                     "email": "me@example.com", "role": "user"})
+        response = self.member.put("/users/900", json={"email": "new@example.com"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["email"], "new@example.com")
+
+    def test_only_admins_delete_users(self):
+        other = self.new_user(self.admin).json()
+        self.assertEqual(self.member.delete(f"/users/{other['id']}").status_code, 403)
+        self.assertEqual(self.admin.delete(f"/users/{other['id']}").status_code, 200)
+
+    def test_shops_are_opened_by_main_shop_admins(self):
+        payload = {"shop_id": f"{self.shop_id}-branch",
+                   "admin": {"username": f"b-{uuid.uuid4().hex[:8]}", "email": "b@example.com", "password": "pw"}}
+        self.assertEqual(self.admin.post("/shops", json=payload).status_code, 403)  # not the main shop
+
+        main_admin = self.client(user_router)
+        token = create_access_token({"sub": "root", "shop": DEFAULT_SHOP_ID, "role": "admin"})
+        main_admin.headers["Authorization"] = f"Bearer {token}"
+        created = main_admin.post("/shops", json=payload)
+        self.assertEqual(created.status_code, 200)
+        self.assertEqual((created.json()["shop_id"], created.json()["role"]), (payload["shop_id"], "admin"))
+        self.assertEqual(main_admin.post("/shops", json=payload).status_code, 400)
+
+
+class PromoteAdminsTest(ShopTestCase):
+    def test_oldest_user_of_a_shop_without_admin_is_promoted(self):
+        users_collection.insert_many([
+            {"shop_id": self.shop_id, "id": "1", "username": f"{self.shop_id}-a"},
+            {"shop_id": self.shop_id, "id": "2", "username": f"{self.shop_id}-b"},
+        ])
+        promote_admins()
+        roles = {user["id"]: user.get("role") for user in users_collection.find({"shop_id": self.shop_id})}
+        self.assertEqual(roles, {"1": "admin", "2": None})
+
+        promote_admins()  # a shop that has an admin is left alone
+        self.assertEqual(users_collection.count_documents({"shop_id": self.shop_id, "role": "admin"}), 1)
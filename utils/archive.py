@@ -0,0 +1,262 @@
+#this moves old transactions to archive collections and keeps compact monthly summaries of them
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from pymongo.errors import BulkWriteError
+from database.config import (
+    sales_collection,
+    purchases_collection,
+    debts_collection,
+    expenditures_collection,
+    sales_archive_collection,
+    purchases_archive_collection,
+    debts_archive_collection,
+    expenditures_archive_collection,
+    summaries_collection,
+    archive_state_collection,
+    counters_collection,
+)
+from database.routing import reporting
+from utils.idincrement import seed_counter
+from utils.timebuckets import next_bucket, to_naive_utc, truncate
+
+# Transactions older than this (rounded down to a whole month) are archived
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = 1000
+
+# hot: where the routes write; archive: same documents, moved; only: extra condition to be archivable;
+# summary_fields: query fields a summary row can answer (anything else needs the archived documents)
+ARCHIVES = {
+    "sales": {
+        "hot": sales_collection,
+        "archive": sales_archive_collection,
+        "only": {},
+        "summary_fields": {"shop_id", "created_at", "customer_id"},
+    },
+    "purchases": {
+        "hot": purchases_collection,
+        "archive": purchases_archive_collection,
+        "only": {},
+        "summary_fields": {"shop_id", "created_at"},
+    },
+    "debts": {
+        "hot": debts_collection,
+        "archive": debts_archive_collection,
+        "only": {"cleared": True},  # open debts stay hot until paid off
+        "summary_fields": {"shop_id", "created_at", "customer_name"},
+    },
+    "expenditures": {
+        "hot": expenditures_collection,
+        "archive": expenditures_archive_collection,
+        "only": {},
+        "summary_fields": {"shop_id", "created_at", "category"},
+    },
+}
+
+
+def _state_key(shop_id: str, name: str) -> str:
+    return f"{shop_id}:{name}"
+
+
+def _summary_rows(name: str, shop_id: str, month: datetime) -> List[Dict]:
+    """Group one month of archived documents into summary rows shaped like the documents themselves."""
+    archive = ARCHIVES[name]["archive"]
+    match = {"$match": {"shop_id": shop_id, "created_at": {"$gte": month, "$lt": next_bucket(month, "month")}}}
+    base = {"shop_id": shop_id, "collection": name, "month": month, "created_at": month}
+
+    if name == "sales":
+        items: Dict[str, List[Dict]] = {}
+        for row in archive.aggregate([
+            match,
+            {"$unwind": "$items"},
+            {"$group": {
+                "_id": {"customer_id": "$customer_id", "product_id": "$items.product_id"},
+                "product_name": {"$last": "$items.product_name"},
+                "category": {"$last": "$items.category"},
+                "quantity": {"$sum": "$items.quantity"},
+                "total_price": {"$sum": "$items.total_price"},
+                "total_cost": {"$sum": "$items.total_cost"},
+            }},
+        ], allowDiskUse=True):
+            items.setdefault(row["_id"]["customer_id"], []).append({
+                "product_id": row["_id"]["product_id"],
+                "product_name": row["product_name"],
+                "category": row["category"],
+                "quantity": row["quantity"],
+                "total_price": row["total_price"],
+                "total_cost": row["total_cost"],
+            })
+        return [{
+            **base,
+            "customer_id": row["_id"],
+            "customer_name": row["customer_name"],
+            "total_amount": row["total_amount"],
+            "record_count": row["record_count"],
+            "items": items.get(row["_id"], []),
+        } for row in archive.aggregate([
+            match,
+            {"$group": {
+                "_id": "$customer_id",
+                "customer_name": {"$last": "$customer_name"},
+                "total_amount": {"$sum": "$total_amount"},
+                "record_count": {"$sum": 1},
+            }},
+        ])]
+
+    if name == "purchases":
+        return [{**base, "total_amount": row["total_amount"], "record_count": row["record_count"]}
+                for row in archive.aggregate([
+                    match,
+                    {"$group": {"_id": None, "total_amount": {"$sum": "$total_amount"}, "record_count": {"$sum": 1}}},
+                ])]
+
+    key = "customer_name" if name == "debts" else "category"
+    return [{**base, key: row["_id"], "amount": row["amount"], "record_count": row["record_count"]}
+            for row in archive.aggregate([
+                match,
+                {"$group": {"_id": f"${key}", "amount": {"$sum": "$amount"}, "record_count": {"$sum": 1}}},
+            ])]
+
+
+def rebuild_summary(name: str, shop_id: str, month: datetime):
+    """Recompute one month's summary rows from the archive (idempotent)."""
+    rows = _summary_rows(name, shop_id, month)
+    summaries_collection.delete_many({"shop_id": shop_id, "collection": name, "month": month})
+    if rows:
+        summaries_collection.insert_many(rows)
+
+
+def _copy_to_archive(archive, batch: List[Dict]):
+    try:
+        archive.insert_many(batch, ordered=False)
+    except BulkWriteError as e:
+        # Already copied by an earlier run that stopped before deleting; anything else is real
+        if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+
+def archive_old_records(older_than_days: int = ARCHIVE_AFTER_DAYS) -> Dict[str, int]:
+    """
+    Move whole months older than `older_than_days` from the hot collections to
+    the archive collections and rebuild the summaries of every month touched.
+
+    Each batch is copied before it is deleted and summaries are recomputed
+    from the archive, so an interrupted run is completed by running it again.
+
+    Returns:
+        dict: Number of documents archived per collection.
+    """
+    cutoff = truncate(to_naive_utc(datetime.now(timezone.utc) - timedelta(days=older_than_days)), "month")
+    moved = {}
+    for name, config in ARCHIVES.items():
+        hot, archive = config["hot"], config["archive"]
+        eligible = {**config["only"], "created_at": {"$lt": cutoff}}
+        # New ids come from id_counters; make sure it is seeded while the ids being moved are still here
+        if not counters_collection.find_one({"_id": f"{hot.name}.id"}):
+            seed_counter(hot)
+        moved[name] = 0
+        for shop_id in hot.distinct("shop_id", eligible):
+            months = set()
+            while True:
+                batch = list(hot.find({**eligible, "shop_id": shop_id}).limit(ARCHIVE_BATCH_SIZE))
+                if not batch:
+                    break
+                _copy_to_archive(archive, batch)
+                hot.delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}})
+                months |= {truncate(doc["created_at"], "month") for doc in batch}
+                moved[name] += len(batch)
+            for month in sorted(months):
+                rebuild_summary(name, shop_id, month)
+            state = archive_state_collection.find_one({"_id": _state_key(shop_id, name)})
+            if not state or state["archived_through"] < cutoff:
+                archive_state_collection.update_one(
+                    {"_id": _state_key(shop_id, name)}, {"$set": {"archived_through": cutoff}}, upsert=True
+                )
+    return moved
+
+
+def _month_ceiling(value: datetime) -> datetime:
+    month = truncate(value, "month")
+    return month if month == value else next_bucket(month, "month")
+
+
+def archived_records(name: str, shop_id: str, query: Dict) -> List[Dict]:
+    """
+    What the archive contributes to a query on a hot collection.
+
+    Months that lie entirely inside the query's created_at window come from
+    the summaries (when the query only filters on fields the summaries keep);
+    the partially covered months at the edges come from the archived
+    documents. Summary rows carry `record_count`, the number of documents
+    they stand for.
+
+    Args:
+        name (str): "sales", "purchases", "debts" or "expenditures".
+        shop_id (str): The shop being reported on.
+        query (dict): The query used on the hot collection.
+
+    Returns:
+        List[dict]: Archived documents and summary rows, to add to the hot results.
+    """
+    state = archive_state_collection.find_one({"_id": _state_key(shop_id, name)})
+    if not state:
+        return []
+    archived_through = state["archived_through"]
+    window = query.get("created_at") or {}
+    start = to_naive_utc(window["$gte"]) if window.get("$gte") else None
+    end = to_naive_utc(window["$lte"]) if window.get("$lte") else None
+    if start and start >= archived_through:
+        return []  # the window is entirely hot
+
+    config = ARCHIVES[name]
+    raw_query = query
+    records = []
+    full_start = _month_ceiling(start) if start else None
+    full_end = min(truncate(end, "month"), archived_through) if end else archived_through
+    if set(query) <= config["summary_fields"] and (full_start is None or full_start < full_end):
+        months = {"$lt": full_end}
+        if full_start:
+            months["$gte"] = full_start
+        summary_query = {key: value for key, value in query.items() if key != "created_at"}
+        records += reporting(summaries_collection).find({**summary_query, "collection": name, "month": months}, {"_id": 0})
+        outside = [{"created_at": {"$gte": full_end}}]
+        if full_start:
+            outside.append({"created_at": {"$lt": full_start}})
+        raw_query = {"$and": [query, {"$or": outside}]}
+    records += reporting(config["archive"]).find(raw_query, {"_id": 0})
+    return records
+
+
+def reaches_archive(name: str, shop_id: str, start: Optional[datetime]) -> bool:
+    """Whether a window starting at `start` (None: from the beginning) includes archived months."""
+    state = archive_state_collection.find_one({"_id": _state_key(shop_id, name)})
+    return bool(state) and (start is None or to_naive_utc(start) < state["archived_through"])
+
+
+def union_archive(name: str, stages: List[Dict]) -> Dict:
+    """
+    $unionWith stage running `stages` over the archived documents too, for
+    aggregations that need the documents themselves rather than summaries
+    (archived documents have the same shape as the hot ones).
+    """
+    return {"$unionWith": {"coll": ARCHIVES[name]["archive"].name, "pipeline": stages}}
+
+
+def archived_documents(name: str, shop_id: str, projection: Optional[Dict] = None) -> List[Dict]:
+    """Every archived document of a shop, for list endpoints called with include_archived."""
+    return list(reporting(ARCHIVES[name]["archive"]).find({"shop_id": shop_id}, projection or {"_id": 0}))
+
+
+def find_archived(name: str, shop_id: str, doc_id: str) -> Optional[Dict]:
+    """Lookup by id in the archive, for by-id endpoints once the hot copy is gone."""
+    return reporting(ARCHIVES[name]["archive"]).find_one({"shop_id": shop_id, "id": doc_id}, {"_id": 0})
+
+
+def record_count(records: List[Dict]) -> int:
+    """Number of documents a mix of documents and summary rows stands for."""
+    return sum(record.get("record_count", 1) for record in records)
+
+
+# python -m utils.archive  -> archive old transactions (schedule it, e.g. nightly)
+if __name__ == "__main__":
+    print(archive_old_records())
@@ -0,0 +1,243 @@
+#this is the pub/sub broker used by the live dashboard
+#
+# Each worker keeps one broker per shop. An event is applied to the publishing
+# worker's broker at once and also written to the shared dashboard_events
+# collection; every worker follows that collection with a change stream
+# (relay_shared_events) and applies the events the other workers published,
+# so an update reaches every connected dashboard within about a second.
+import asyncio
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+from pymongo.errors import PyMongoError
+from database.config import dashboard_events_collection
+
+logger = logging.getLogger("shopygenie.dashboard")
+
+# How long a client waits after the first event before a snapshot is pushed.
+# Events arriving inside the window are coalesced into one message.
+BATCH_WINDOW_SECONDS = 0.25
+
+# Totals are still reloaded from Mongo this often, which corrects them after any
+# event the change stream missed (e.g. while it was reconnecting).
+REFRESH_SECONDS = float(os.getenv("DASHBOARD_REFRESH_SECONDS", "10"))
+
+# Wait before reopening the change stream after an error
+RELAY_RETRY_SECONDS = 1.0
+
+# Tells this worker's own events apart on the shared stream
+WORKER_ID = uuid.uuid4().hex
+
+# Shared writes run here, in publish order, so publishing never waits on Mongo
+_outbox = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dashboard-outbox")
+
+
+class Subscriber:
+    """A connected dashboard client: pending events plus a wake-up flag."""
+
+    def __init__(self):
+        self.pending: List[Dict[str, Any]] = []
+        self.ready = asyncio.Event()
+
+    def push(self, event: Dict[str, Any]):
+        self.pending.append(event)
+        self.ready.set()
+
+    async def next_batch(self, window: float = BATCH_WINDOW_SECONDS) -> List[Dict[str, Any]]:
+        """
+        Wait for at least one event, then keep collecting for `window` seconds.
+
+        Returns:
+            List[Dict[str, Any]]: Every event received since the last batch.
+        """
+        await self.ready.wait()
+        await asyncio.sleep(window)
+        self.ready.clear()
+        batch, self.pending = self.pending, []
+        return batch
+
+
+class DashboardBroker:
+    """
+    Keeps today's running totals in memory and fans events out to subscribers.
+
+    There is one broker per shop inside each worker process. Events published
+    in this worker are applied at once, those of the other workers when they
+    arrive on the shared stream; the totals are also reloaded from Mongo every
+    REFRESH_SECONDS (and at the start of each day).
+    """
+
+    def __init__(self, shop_id: Optional[str] = None):
+        self.shop_id = shop_id
+        self.subscribers: List[Subscriber] = []
+        self.day: Optional[str] = None
+        self.totals: Dict[str, float] = {}
+        self.loaded_at: Optional[float] = None
+        self.loading = False
+
+    def _today(self) -> str:
+        return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+    def _roll_day(self):
+        today = self._today()
+        if self.day != today:
+            # A new day is reloaded too: other workers may already have recorded events in it.
+            self.day = today
+            self.loaded_at = None
+            self.totals = {
+                "sales_total": 0.0,
+                "sales_count": 0,
+                "cash_sales_total": 0.0,
+                "debt_sales_total": 0.0,
+                "purchases_total": 0.0,
+                "debt_payments_total": 0.0,
+                "expenditures_total": 0.0,
+            }
+
+    def needs_reload(self) -> bool:
+        self._roll_day()
+        if self.loading:
+            return False
+        return self.loaded_at is None or time.monotonic() - self.loaded_at >= REFRESH_SECONDS
+
+    def reload(self, loader: Callable[[datetime], Dict[str, float]]) -> bool:
+        """
+        Replace today's totals with what Mongo holds (every worker's writes).
+
+        Args:
+            loader (Callable): Called with the start of today (UTC), returns the totals.
+
+        Returns:
+            bool: Whether the totals changed.
+        """
+        self._roll_day()
+        day = self.day
+        self.loading = True
+        try:
+            start_of_day = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+            totals = loader(start_of_day)
+        finally:
+            self.loading = False
+        if self.day != day:
+            return False  # midnight passed while loading; the next reload covers the new day
+        changed = any(self.totals.get(name) != value for name, value in totals.items())
+        self.totals.update(totals)
+        self.loaded_at = time.monotonic()
+        return changed
+
+    def apply(self, kind: str, payload: Dict[str, Any]):
+        amount = float(payload.get("amount", 0.0))
+        if kind == "sale":
+            self.totals["sales_total"] += amount
+            self.totals["sales_count"] += 1
+            if payload.get("payment_method") == "debt":
+                self.totals["debt_sales_total"] += amount
+            else:
+                self.totals["cash_sales_total"] += amount
+        elif kind == "purchase":
+            self.totals["purchases_total"] += amount
+        elif kind == "debt_payment":
+            self.totals["debt_payments_total"] += amount
+        elif kind == "expenditure":
+            self.totals["expenditures_total"] += amount
+
+    def publish(self, kind: str, payload: Dict[str, Any]):
+        """
+        Record an event, notify every connected client and share it with the
+        other workers. Never blocks the caller.
+
+        Args:
+            kind (str): One of "sale", "purchase", "debt_payment", "expenditure".
+            payload (dict): Event data, at least an "amount".
+        """
+        if self.shop_id is not None:
+            _outbox.submit(_share, self.shop_id, kind, payload)
+        self.receive(kind, payload)
+
+    def receive(self, kind: str, payload: Dict[str, Any]):
+        """Apply an event (published here or by another worker) and notify every connected client."""
+        self._roll_day()
+        # Until the first load from Mongo, that load will count this event.
+        if self.loaded_at is not None:
+            self.apply(kind, payload)
+        if not self.subscribers:
+            return
+        event = {"type": kind, "at": datetime.now(timezone.utc).isoformat(), **payload}
+        for subscriber in self.subscribers:
+            subscriber.push(event)
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber()
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    def snapshot(self, events: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        self._roll_day()
+        return {
+            "day": self.day,
+            "totals": dict(self.totals),
+            "events": events or [],
+        }
+
+
+_brokers: Dict[str, DashboardBroker] = {}
+
+
+def get_broker(shop_id: str) -> DashboardBroker:
+    if shop_id not in _brokers:
+        _brokers[shop_id] = DashboardBroker(shop_id)
+    return _brokers[shop_id]
+
+
+def _share(shop_id: str, kind: str, payload: Dict[str, Any]):
+    try:
+        dashboard_events_collection.insert_one({
+            "shop_id": shop_id,
+            "type": kind,
+            "payload": payload,
+            "origin": WORKER_ID,
+            "created_at": datetime.now(timezone.utc),
+        })
+    except PyMongoError as e:
+        # The other workers catch up at their next reload
+        logger.warning("could not share dashboard event: %s", e)
+
+
+def _follow_shared_events(deliver: Callable[[Dict[str, Any]], None]):
+    """Blocking: pass every event inserted by another worker to `deliver`, resuming after errors."""
+    pipeline = [{"$match": {"operationType": "insert", "fullDocument.origin": {"$ne": WORKER_ID}}}]
+    resume_token = None
+    while True:
+        try:
+            with dashboard_events_collection.watch(pipeline, resume_after=resume_token) as stream:
+                for change in stream:
+                    resume_token = stream.resume_token
+                    deliver(change["fullDocument"])
+        except PyMongoError as e:
+            logger.warning("dashboard event stream failed: %s", e)
+            time.sleep(RELAY_RETRY_SECONDS)
+
+
+async def relay_shared_events():
+    """Background task: apply the events other workers publish to this worker's brokers."""
+    loop = asyncio.get_running_loop()
+
+    def apply(event: Dict[str, Any]):
+        # Only shops with a broker here (a dashboard connected at some point) need it
+        broker = _brokers.get(event["shop_id"])
+        if broker is not None:
+            broker.receive(event["type"], event["payload"])
+
+    def deliver(event: Dict[str, Any]):
+        # Brokers and subscribers belong to the event loop
+        loop.call_soon_threadsafe(apply, event)
+
+    await loop.run_in_executor(None, _follow_shared_events, deliver)
@@ -0,0 +1,59 @@
+#this encodes keyset-pagination positions as opaque, signed URL-safe strings
+#
+# Cursors can carry state the server trusts on the next page (e.g. a statement's
+# running balance), so each one is HMAC-signed and rejected if it was altered.
+import base64
+import hashlib
+import hmac
+import os
+from datetime import datetime
+from typing import Any, Dict
+import orjson
+from auth.auth import SECRET_KEY
+
+CURSOR_SECRET = os.getenv("CURSOR_SECRET", SECRET_KEY).encode()
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _signature(body: str) -> str:
+    return _b64(hmac.new(CURSOR_SECRET, body.encode(), hashlib.sha256).digest()[:16])
+
+
+def encode_cursor(position: Dict[str, Any]) -> str:
+    """
+    Pack the last-seen sort key (plus any carried state) into a signed cursor string.
+
+    Args:
+        position (dict): JSON-serialisable values; datetimes are stored as ISO strings.
+
+    Returns:
+        str: The cursor to hand back to the client.
+    """
+    body = _b64(orjson.dumps(position))
+    return f"{body}.{_signature(body)}"
+
+
+def decode_cursor(cursor: str, datetime_fields: tuple = ()) -> Dict[str, Any]:
+    """
+    Inverse of encode_cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed or its signature does not match.
+    """
+    try:
+        body, signature = cursor.split(".")
+        if not hmac.compare_digest(signature, _signature(body)):
+            raise ValueError
+        position = orjson.loads(_unb64(body))
+        for field in datetime_fields:
+            position[field] = datetime.fromisoformat(position[field])
+        return position
+    except Exception:
+        raise ValueError("Invalid cursor")
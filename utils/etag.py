@@ -0,0 +1,146 @@
+#this implements write-version ETags and cached list bodies for conditional GETs
+import gzip
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Tuple
+import orjson
+from fastapi import Request, Response
+from pymongo.collection import ReturnDocument
+from database.config import versions_collection
+
+# How long a worker trusts its cached version before re-reading it from Mongo.
+# Writes in the same worker are seen immediately; writes in other workers
+# become visible within this window.
+VERSION_CACHE_SECONDS = float(os.getenv("VERSION_CACHE_SECONDS", "1.0"))
+
+# Store a gzip copy of each cached list body and serve it to clients that accept gzip.
+PRECOMPRESS_LIST_BODIES = os.getenv("PRECOMPRESS_LIST_BODIES", "1") == "1"
+
+# Upper bound on the cached list bodies of this worker (raw + gzip bytes); every
+# shop x list x fields variant gets its own entry, the least recently served go first.
+LIST_CACHE_MAX_BYTES = int(os.getenv("LIST_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+_versions: Dict[str, Tuple[int, float]] = {}
+_bodies: "OrderedDict[str, Tuple[int, bytes, bytes]]" = OrderedDict()
+_bodies_size = 0
+_bodies_lock = threading.Lock()
+
+
+def _cached_body(key: str, version: int):
+    with _bodies_lock:
+        cached = _bodies.get(key)
+        if not cached or cached[0] != version:
+            return None
+        _bodies.move_to_end(key)
+        return cached
+
+
+def _store_body(key: str, version: int, raw: bytes, compressed: bytes):
+    global _bodies_size
+    size = len(raw) + len(compressed)
+    if size > LIST_CACHE_MAX_BYTES:
+        return  # would evict everything else
+    with _bodies_lock:
+        previous = _bodies.pop(key, None)
+        if previous:
+            _bodies_size -= len(previous[1]) + len(previous[2])
+        _bodies[key] = (version, raw, compressed)
+        _bodies_size += size
+        while _bodies_size > LIST_CACHE_MAX_BYTES:
+            _, (_, old_raw, old_compressed) = _bodies.popitem(last=False)
+            _bodies_size -= len(old_raw) + len(old_compressed)
+
+
+def _version_key(shop_id: str, name: str) -> str:
+    return f"{shop_id}:{name}"
+
+
+def bump_version(shop_id: str, name: str, count: int = 1) -> int:
+    """
+    Record a write to `name`; call after every insert, update or delete.
+
+    Args:
+        shop_id (str): The shop whose data changed.
+        name (str): Logical collection name, e.g. "products".
+        count (int): How many versions to advance by (to reserve a range at once).
+
+    Returns:
+        int: The new version.
+    """
+    key = _version_key(shop_id, name)
+    doc = versions_collection.find_one_and_update(
+        {"_id": key},
+        {"$inc": {"version": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    version = doc["version"]
+    _versions[key] = (version, time.monotonic())
+    return version
+
+
+def current_version(shop_id: str, name: str) -> int:
+    key = _version_key(shop_id, name)
+    cached = _versions.get(key)
+    if cached and time.monotonic() - cached[1] < VERSION_CACHE_SECONDS:
+        return cached[0]
+    doc = versions_collection.find_one({"_id": key})
+    version = doc["version"] if doc else 0
+    _versions[key] = (version, time.monotonic())
+    return version
+
+
+def make_etag(shop_id: str, name: str, version: int, variant: str = "") -> str:
+    suffix = f"-{variant}" if variant else ""
+    return f'"{name}-{shop_id}-v{version}{suffix}"'
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def conditional_list_response(request: Request, shop_id: str, name: str, loader: Callable[[], List[dict]],
+                              variant: str = "") -> Response:
+    """
+    Serve a whole-collection list with a strong ETag.
+
+    A matching If-None-Match returns 304 from memory. Otherwise the body is
+    served from the per-version cache, and `loader` only runs after a write.
+
+    Args:
+        request (Request): Incoming request (for If-None-Match / Accept-Encoding).
+        shop_id (str): The shop the list belongs to.
+        name (str): Logical collection name used for the version counter.
+        loader (Callable): Returns the JSON-ready list; may raise HTTPException.
+        variant (str): Distinguishes different shapes of the same list (e.g. a sparse fieldset).
+
+    Returns:
+        Response: 304, or 200 with the (optionally gzipped) JSON body.
+    """
+    key = _version_key(shop_id, name) + (f"|{variant}" if variant else "")
+    version = current_version(shop_id, name)
+    etag = make_etag(shop_id, name, version, variant)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+    if _matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+
+    cached = _cached_body(key, version)
+    if cached:
+        raw, compressed = cached[1], cached[2]
+    else:
+        # Version is read before loading, so a concurrent write can only make
+        # the cached body newer than its tag, never older.
+        raw = orjson.dumps(loader())
+        compressed = gzip.compress(raw, compresslevel=6) if PRECOMPRESS_LIST_BODIES else b""
+        _store_body(key, version, raw, compressed)
+
+    if compressed and "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=compressed, media_type="application/json", headers=headers)
+    return Response(content=raw, media_type="application/json", headers=headers)
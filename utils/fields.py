@@ -0,0 +1,74 @@
+#this implements sparse fieldsets (?fields=id,total_amount) for the list endpoints
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Type
+from fastapi import HTTPException, Response
+from pydantic import BaseModel, TypeAdapter, ValidationError, create_model
+
+FIELDS_DESCRIPTION = "Comma-separated fields to return (e.g. id,total_amount); all fields when omitted"
+
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[Tuple[str, ...]]:
+    """
+    Validate a `fields=` parameter against a response model.
+
+    Args:
+        fields (str): Raw query value, e.g. "id, total_amount".
+        model (BaseModel): The endpoint's full response model.
+
+    Returns:
+        tuple: The requested fields in model order, or None for "everything".
+    """
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(model.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(name for name in model.model_fields if name in requested)
+
+
+def projection(fields: Optional[Tuple[str, ...]]) -> Dict[str, int]:
+    """Mongo projection for the requested fields (whole documents minus _id when None)."""
+    if not fields:
+        return {"_id": 0}
+    return {"_id": 0, **{field: 1 for field in fields}}
+
+
+@lru_cache(maxsize=256)
+def list_adapter(model: Type[BaseModel], fields: Optional[Tuple[str, ...]] = None) -> TypeAdapter:
+    """Validator/serializer for a list of `model`, or of a lightweight model with only `fields`."""
+    if fields:
+        model = create_model(
+            f"{model.__name__}Fields",
+            **{name: (model.model_fields[name].annotation, model.model_fields[name]) for name in fields},
+        )
+    return TypeAdapter(List[model])
+
+
+def sparse_response(model: Type[BaseModel], docs: List[dict], fields: Tuple[str, ...]) -> Response:
+    """Validate and serialize `docs` with the lightweight model in one pass (no per-document objects)."""
+    adapter = list_adapter(model, fields)
+    return Response(content=adapter.dump_json(adapter.validate_python(docs)), media_type="application/json")
+
+
+def validate_list(model: Type[BaseModel], docs: List[dict], fields: Optional[Tuple[str, ...]] = None,
+                  skip_invalid: bool = False) -> List[dict]:
+    """
+    JSON-ready dicts for `docs`, validated as one list.
+
+    With `skip_invalid`, a list that fails validation is retried document by
+    document and the invalid ones are dropped (the slow path only runs then).
+    """
+    adapter = list_adapter(model, fields)
+    try:
+        return adapter.dump_python(adapter.validate_python(docs), mode="json")
+    except ValidationError:
+        if not skip_invalid:
+            raise
+    valid = []
+    for doc in docs:
+        try:
+            valid += adapter.dump_python(adapter.validate_python([doc]), mode="json")
+        except ValidationError:
+            continue
+    return valid
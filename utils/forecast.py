@@ -0,0 +1,174 @@
+#this turns daily sales history into demand forecasts and reorder suggestions (vectorized with NumPy)
+from datetime import datetime, timedelta, timezone
+from statistics import NormalDist
+from typing import Dict
+import numpy as np
+from database.config import sales_collection, products_collection
+from database.routing import reporting
+from utils.archive import reaches_archive, union_archive
+from utils.timebuckets import date_trunc_expression, to_naive_utc, truncate
+
+# Products need at least this many units in the history before their own weekday pattern is trusted
+SEASONALITY_MIN_UNITS = 28
+
+
+def daily_units(shop_id: str, index: Dict[str, int], start: datetime, days: int) -> np.ndarray:
+    """
+    Units sold per product per day, as a product x day matrix.
+
+    The grouping happens in Mongo, so only one row per (product, day) that had
+    sales crosses the wire; the matrix is filled with one scatter-add.
+
+    Args:
+        shop_id (str): The shop being forecast.
+        index (dict): product_id -> matrix row; sales of other (deleted) products are ignored.
+        start (datetime): First day of the history (naive UTC midnight).
+        days (int): Number of days in the history, ending yesterday.
+
+    Returns:
+        np.ndarray: float32 matrix of shape (len(index), days).
+    """
+    match = {"$match": {"shop_id": shop_id, "created_at": {"$gte": start, "$lt": start + timedelta(days=days)}}}
+    # Histories longer than ARCHIVE_AFTER_DAYS reach into the archived sales
+    archived = [union_archive("sales", [match])] if reaches_archive("sales", shop_id, start) else []
+    rows = [row for row in reporting(sales_collection).aggregate([
+        match,
+        *archived,
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": {"product_id": "$items.product_id", "day": date_trunc_expression("$created_at", "day")},
+            "units": {"$sum": "$items.quantity"},
+        }},
+    ], allowDiskUse=True) if row["_id"].get("product_id") in index]
+
+    product_index = np.fromiter((index[row["_id"]["product_id"]] for row in rows), dtype=np.int64, count=len(rows))
+    day_index = np.fromiter(((row["_id"]["day"] - start).days for row in rows), dtype=np.int64, count=len(rows))
+    units = np.fromiter((row["units"] for row in rows), dtype=np.float32, count=len(rows))
+
+    matrix = np.zeros((len(index), days), dtype=np.float32)
+    np.add.at(matrix, (product_index, day_index), units)
+    return matrix
+
+
+def weekday_factors(matrix: np.ndarray, start: datetime) -> np.ndarray:
+    """
+    Per product, how each weekday sells relative to an average day (7 columns, Monday first).
+
+    Products with little history are pulled towards the shop-wide pattern,
+    which is itself pulled towards flat (1.0) when the whole shop sells little.
+    """
+    products, days = matrix.shape
+    weekday = (np.arange(days) + start.weekday()) % 7
+    occurrences = np.bincount(weekday, minlength=7).astype(np.float32)
+    occurrences[occurrences == 0] = 1
+
+    # Sum of each product's sales per weekday, via one matrix product with a one-hot weekday map
+    one_hot = np.zeros((days, 7), dtype=np.float32)
+    one_hot[np.arange(days), weekday] = 1
+    per_weekday = (matrix @ one_hot) / occurrences
+    mean = matrix.mean(axis=1, keepdims=True)
+
+    totals = matrix.sum(axis=1, keepdims=True)
+    shop_mean = per_weekday.sum(axis=0) / max(float(mean.sum()), 1e-9)
+    shop_weight = min(float(totals.sum()) / (SEASONALITY_MIN_UNITS * 7), 1.0)
+    shop_factors = shop_weight * shop_mean + (1 - shop_weight)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        own = np.where(mean > 0, per_weekday / mean, 1.0)
+    weight = np.minimum(totals / SEASONALITY_MIN_UNITS, 1.0)
+    return weight * own + (1 - weight) * shop_factors
+
+
+def reorder_suggestions(
+    shop_id: str,
+    history_days: int,
+    velocity_days: int,
+    lead_time_days: int,
+    cover_days: int,
+    service_level: float,
+    only_needed: bool = True,
+) -> Dict:
+    """
+    Reorder point and quantity for every product, grouped by supplier.
+
+    velocity: average units per day over the last `velocity_days`.
+    forecast: velocity x weekday factors over the days being planned, scaled
+    by the trend (7-day over 28-day moving average, capped to [0.5, 2]).
+    reorder point: forecast demand over the lead time plus safety stock
+    (z(service_level) x daily deviation x sqrt(lead time)).
+    suggested quantity: enough to reach the reorder point plus `cover_days`
+    of forecast demand, from the current stock.
+
+    Returns:
+        dict: generated_at, history_days, and suppliers with their products.
+    """
+    today = truncate(to_naive_utc(datetime.now(timezone.utc)), "day")
+    start = today - timedelta(days=history_days)
+    products = list(products_collection.find(
+        {"shop_id": shop_id},
+        {"_id": 0, "id": 1, "name": 1, "supplier": 1, "current_stock": 1, "cost_price": 1, "low_stock_alert": 1},
+    ))
+    if not products:
+        return {"generated_at": datetime.now(timezone.utc), "history_days": history_days, "suppliers": []}
+
+    # One row per catalogue product, in catalogue order (products that never sold stay at zero)
+    history = daily_units(shop_id, {product["id"]: i for i, product in enumerate(products)}, start, history_days)
+
+    recent = history[:, -min(velocity_days, history_days):]
+    velocity = recent.mean(axis=1)
+    deviation = recent.std(axis=1)
+    moving_average_7 = history[:, -7:].mean(axis=1)
+    moving_average_28 = history[:, -28:].mean(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        trend = np.where(moving_average_28 > 0, moving_average_7 / moving_average_28, 1.0)
+    trend = np.clip(trend, 0.5, 2.0)
+
+    factors = weekday_factors(history, start)
+    horizon = lead_time_days + cover_days
+    upcoming = (np.arange(horizon) + today.weekday()) % 7
+    daily_forecast = (velocity * trend)[:, None] * factors[:, upcoming]
+    lead_time_demand = daily_forecast[:, :lead_time_days].sum(axis=1)
+    cover_demand = daily_forecast[:, lead_time_days:].sum(axis=1)
+
+    z = NormalDist().inv_cdf(service_level)
+    safety_stock = z * deviation * np.sqrt(lead_time_days)
+    # A hand-set low_stock_alert still acts as a floor
+    alerts = np.array([product.get("low_stock_alert") or 0 for product in products], dtype=np.float32)
+    reorder_point = np.maximum(np.ceil(lead_time_demand + safety_stock), alerts)
+    stock = np.array([product.get("current_stock", 0) for product in products], dtype=np.float32)
+    quantity = np.maximum(np.ceil(reorder_point + cover_demand - stock), 0)
+    needed = (stock <= reorder_point) & (quantity > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_of_stock = np.where(velocity > 0, stock / (velocity * trend), np.inf)
+
+    suppliers: Dict[str, Dict] = {}
+    for i in (np.flatnonzero(needed) if only_needed else range(len(products))):
+        product = products[i]
+        supplier = product.get("supplier") or "Unknown"
+        entry = suppliers.setdefault(supplier, {"supplier": supplier, "products": [], "total_cost": 0.0})
+        cost = float(quantity[i]) * product.get("cost_price", 0)
+        entry["products"].append({
+            "product_id": product["id"],
+            "name": product["name"],
+            "current_stock": int(stock[i]),
+            "low_stock_alert": product.get("low_stock_alert"),
+            "velocity": round(float(velocity[i]), 3),
+            "moving_average_7": round(float(moving_average_7[i]), 3),
+            "moving_average_28": round(float(moving_average_28[i]), 3),
+            "trend": round(float(trend[i]), 3),
+            "days_of_stock": None if np.isinf(days_of_stock[i]) else round(float(days_of_stock[i]), 1),
+            "safety_stock": round(float(safety_stock[i]), 2),
+            "reorder_point": int(reorder_point[i]),
+            "suggested_quantity": int(quantity[i]),
+            "estimated_cost": round(cost, 2),
+        })
+        entry["total_cost"] += cost
+
+    for entry in suppliers.values():
+        entry["products"].sort(key=lambda item: (item["days_of_stock"] is None, item["days_of_stock"] or 0))
+        entry["total_cost"] = round(entry["total_cost"], 2)
+    return {
+        "generated_at": datetime.now(timezone.utc),
+        "history_days": history_days,
+        "suppliers": sorted(suppliers.values(), key=lambda entry: -entry["total_cost"]),
+    }
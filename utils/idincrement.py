@@ -1,20 +1,48 @@
-from pymongo.collection import Collection
+from pymongo.collection import Collection, ReturnDocument
+from database.config import counters_collection
 
-def increment_id(collection: Collection, id_field: str = "id") -> str:
+
+def _highest_id(collection: Collection, id_field: str) -> int:
+    # Ids are stored as strings, so the numeric maximum has to be computed server-side
+    rows = list(collection.aggregate([
+        {"$group": {"_id": None, "max": {"$max": {"$convert": {
+            "input": f"${id_field}", "to": "long", "onError": 0, "onNull": 0,
+        }}}}},
+    ]))
+    return int(rows[0]["max"]) if rows else 0
+
+
+def seed_counter(collection: Collection, id_field: str = "id"):
+    """Start the collection's counter from the highest id stored (no-op once it is at least that)."""
+    # $max keeps a concurrent first caller's seeding (and anything reserved since) intact
+    counters_collection.update_one(
+        {"_id": f"{collection.name}.{id_field}"}, {"$max": {"seq": _highest_id(collection, id_field)}}, upsert=True
+    )
+
+
+def increment_id(collection: Collection, id_field: str = "id", count: int = 1) -> str:
     """
     Universal increment function for MongoDB collections.
 
+    Ids come from an atomic counter per collection, so writers running at the
+    same time never receive the same id. The counter starts from the highest
+    id already stored the first time a collection asks for one.
+
     Args:
         collection (Collection): The MongoDB collection to query.
         id_field (str): The field to increment (default "id").
+        count (int): How many consecutive ids to reserve (default 1).
 
     Returns:
-        str: The next ID as a string.
+        str: The next ID as a string (the first of the reserved block).
     """
-    max_doc = collection.find_one(sort=[(id_field, -1)], projection={id_field: 1})
-    if not max_doc or id_field not in max_doc:
-        return "1"  # Start from 1 if empty
-    try:
-        return str(int(max_doc[id_field]) + 1)
-    except (ValueError, TypeError):
-        raise ValueError(f"Invalid {id_field} value in collection: {max_doc[id_field]}")
+    key = f"{collection.name}.{id_field}"
+    counter = counters_collection.find_one_and_update(
+        {"_id": key}, {"$inc": {"seq": count}}, return_document=ReturnDocument.AFTER
+    )
+    if counter is None:
+        seed_counter(collection, id_field)
+        counter = counters_collection.find_one_and_update(
+            {"_id": key}, {"$inc": {"seq": count}}, return_document=ReturnDocument.AFTER
+        )
+    return str(counter["seq"] - count + 1)
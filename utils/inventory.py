@@ -0,0 +1,141 @@
+#this is the append-only stock movement ledger and its periodic snapshots
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from database.config import movements_collection, snapshots_collection, products_collection
+from schema.inventory import StockMovement, StockAtDate
+from utils.timebuckets import to_naive_utc
+
+SNAPSHOT_BATCH_SIZE = 1000
+# Snapshots are taken this far in the past, so no stock write before the cut-off is still in flight
+SNAPSHOT_SETTLE_SECONDS = 300
+
+
+def movement(shop_id: str, product_id: str, kind: str, quantity: int,
+             reference_id: Optional[str] = None, note: Optional[str] = None) -> Dict:
+    """Build a movement document; `quantity` is signed (negative when stock leaves)."""
+    return StockMovement(
+        shop_id=shop_id,
+        product_id=product_id,
+        type=kind,
+        quantity=quantity,
+        reference_id=reference_id,
+        note=note,
+        created_at=datetime.now(timezone.utc),
+    ).model_dump()
+
+
+def record_movements(movements: List[Dict]):
+    """Append all movements of one transaction in a single write."""
+    if movements:
+        movements_collection.insert_many(movements, ordered=False)
+
+
+def _sum_movements(shop_id: str, product_id: str, created_at: Dict) -> Dict:
+    result = list(movements_collection.aggregate([
+        {"$match": {"shop_id": shop_id, "product_id": product_id, "created_at": created_at}},
+        {"$group": {"_id": None, "quantity": {"$sum": "$quantity"}, "count": {"$sum": 1}}},
+    ]))
+    return result[0] if result else {"quantity": 0, "count": 0}
+
+
+def stock_at(shop_id: str, product_id: str, at: datetime) -> StockAtDate:
+    """
+    Stock level of a product at a point in time.
+
+    Reads the latest snapshot at or before `at` and replays the movements
+    after it. Products that only have later snapshots (created before the
+    ledger existed) are rewound from the earliest snapshot after `at`.
+
+    Args:
+        shop_id (str): The shop owning the product.
+        product_id (str): The product to look up.
+        at (datetime): The point in time.
+
+    Returns:
+        StockAtDate: The reconstructed stock level.
+    """
+    at = to_naive_utc(at)
+    query = {"shop_id": shop_id, "product_id": product_id}
+
+    snapshot = snapshots_collection.find_one({**query, "as_of": {"$lte": at}}, sort=[("as_of", -1)])
+    if snapshot:
+        tail = _sum_movements(shop_id, product_id, {"$gt": snapshot["as_of"], "$lte": at})
+        stock = snapshot["stock"] + tail["quantity"]
+    else:
+        snapshot = snapshots_collection.find_one({**query, "as_of": {"$gt": at}}, sort=[("as_of", 1)])
+        if snapshot:
+            tail = _sum_movements(shop_id, product_id, {"$gt": at, "$lte": snapshot["as_of"]})
+            stock = snapshot["stock"] - tail["quantity"]
+        else:
+            tail = _sum_movements(shop_id, product_id, {"$lte": at})
+            stock = tail["quantity"]
+
+    return StockAtDate(
+        product_id=product_id,
+        at=at,
+        stock=stock,
+        snapshot_as_of=snapshot["as_of"] if snapshot else None,
+        movements_applied=tail["count"],
+    )
+
+
+def _movement_totals(created_at: Dict) -> Dict[tuple, int]:
+    return {
+        (row["_id"]["shop_id"], row["_id"]["product_id"]): row["quantity"]
+        for row in movements_collection.aggregate([
+            {"$match": {"created_at": created_at}},
+            {"$group": {"_id": {"shop_id": "$shop_id", "product_id": "$product_id"}, "quantity": {"$sum": "$quantity"}}},
+        ], allowDiskUse=True)
+    }
+
+
+def take_snapshots() -> int:
+    """
+    Record every product's stock as of a fixed cut-off. Run periodically (e.g.
+    nightly) so point-in-time queries only replay a short tail of movements.
+
+    Snapshots are derived from the ledger: the previous snapshot plus the
+    movements up to the cut-off, which lies SNAPSHOT_SETTLE_SECONDS in the past
+    so that writes in flight have landed. A product without a previous snapshot
+    is seeded from current_stock minus the movements recorded after the cut-off.
+
+    Returns:
+        int: Number of snapshots written.
+    """
+    as_of = datetime.now(timezone.utc) - timedelta(seconds=SNAPSHOT_SETTLE_SECONDS)
+    latest = snapshots_collection.find_one({}, {"_id": 0, "as_of": 1}, sort=[("as_of", -1)])
+    previous: Dict[tuple, int] = {}
+    since: Dict = {"$lte": as_of}
+    if latest:
+        since["$gt"] = latest["as_of"]
+        previous = {
+            (snapshot["shop_id"], snapshot["product_id"]): snapshot["stock"]
+            for snapshot in snapshots_collection.find({"as_of": latest["as_of"]}, {"_id": 0, "shop_id": 1, "product_id": 1, "stock": 1})
+        }
+    deltas = _movement_totals(since)
+    # Read before the products: a movement is written after its stock change, so each one here is in current_stock
+    after = _movement_totals({"$gt": as_of})
+
+    written = 0
+    batch = []
+    cursor = products_collection.find({}, {"_id": 0, "shop_id": 1, "id": 1, "current_stock": 1})
+    for product in cursor:
+        key = (product.get("shop_id"), product["id"])
+        if key in previous:
+            stock = previous[key] + deltas.get(key, 0)
+        else:
+            stock = product.get("current_stock", 0) - after.get(key, 0)
+        batch.append({"shop_id": key[0], "product_id": key[1], "stock": stock, "as_of": as_of})
+        if len(batch) >= SNAPSHOT_BATCH_SIZE:
+            snapshots_collection.insert_many(batch, ordered=False)
+            written += len(batch)
+            batch = []
+    if batch:
+        snapshots_collection.insert_many(batch, ordered=False)
+        written += len(batch)
+    return written
+
+
+# python -m utils.inventory  -> snapshot every product's stock (schedule it, e.g. nightly)
+if __name__ == "__main__":
+    print(f"Wrote {take_snapshots()} stock snapshots")
@@ -0,0 +1,212 @@
+#this implements per-route-class concurrency lanes and per-client rate limiting
+import asyncio
+import ipaddress
+import math
+import os
+import re
+import time
+from typing import Dict, List, Tuple, Union
+import orjson
+from auth.auth import decode_access_token
+from database.budget import current_budget, start_budget
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _trusted_proxies() -> List[Union[ipaddress.IPv4Network, ipaddress.IPv6Network]]:
+    # TRUSTED_PROXIES=10.0.0.0/8,127.0.0.1 -> the reverse proxies allowed to set X-Forwarded-For
+    value = os.getenv("TRUSTED_PROXIES", "")
+    return [ipaddress.ip_network(entry.strip(), strict=False) for entry in value.split(",") if entry.strip()]
+
+
+def _is_trusted(address: str, proxies: List[Union[ipaddress.IPv4Network, ipaddress.IPv6Network]]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in proxies)
+
+
+class ConcurrencyLane:
+    """
+    At most `max_concurrent` requests run at once; up to `max_queue` more wait
+    (for at most `queue_timeout` seconds). Anything beyond that is shed.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.waiting = 0
+
+    async def acquire(self) -> bool:
+        if self.semaphore.locked() and self.waiting >= self.max_queue:
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        self.semaphore.release()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Consume one token; returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+# (method, path regex) -> lane. First match wins; everything else is "default".
+ROUTE_CLASSES: List[Tuple[str, re.Pattern, str]] = [
+    ("POST", re.compile(r"^/sale$"), "checkout"),
+    ("POST", re.compile(r"^/sales/batch$"), "checkout"),
+    ("POST", re.compile(r"^/purchase$"), "checkout"),
+    ("PUT", re.compile(r"^/debts/[^/]+/pay$"), "checkout"),
+    ("POST", re.compile(r"^/customers/[^/]+/payments$"), "checkout"),
+    ("POST", re.compile(r"^/stock/adjustments$"), "checkout"),
+    ("POST", re.compile(r"^/stock/reservations$"), "checkout"),
+    ("*", re.compile(r"^/report"), "report"),
+    ("GET", re.compile(r"^/sales(/timeseries)?$"), "report"),
+    ("GET", re.compile(r"^/purchases$"), "report"),
+    ("GET", re.compile(r"^/suppliers/analytics$"), "report"),
+    ("GET", re.compile(r"^/debts(/aging)?$"), "report"),
+    ("GET", re.compile(r"^/customers/[^/]+/statement$"), "report"),
+    ("GET", re.compile(r"^/stock/valuation$"), "report"),
+    ("GET", re.compile(r"^/stock/reorder-suggestions$"), "report"),
+]
+
+
+def classify(method: str, path: str) -> str:
+    for route_method, pattern, lane in ROUTE_CLASSES:
+        if (route_method == "*" or route_method == method) and pattern.match(path):
+            return lane
+    return "default"
+
+
+class LoadSheddingMiddleware:
+    """
+    ASGI middleware: rate-limits each client with a token bucket (429), then
+    admits the request through its route-class lane (503 when the lane and
+    its wait queue are full). Checkout has its own, larger lane, so a burst
+    of reports can never take its slots. Once admitted, the request's Mongo
+    reads run against its lane's time budget (database/budget.py).
+
+    Limits are read from the environment, e.g. LANE_REPORT_CONCURRENCY=2,
+    LANE_REPORT_QUEUE=8, LANE_REPORT_TIMEOUT=5, RATE_LIMIT_PER_SECOND=20,
+    RATE_LIMIT_BURST=40. Set RATE_LIMIT_PER_SECOND=0 to disable rate limiting.
+    Anonymous clients are keyed by their address; X-Forwarded-For is only
+    believed when the connection comes from one of TRUSTED_PROXIES.
+    """
+
+    DEFAULTS = {
+        "checkout": (64, 256, 10.0),
+        "report": (2, 8, 5.0),
+        "default": (32, 128, 5.0),
+    }
+    MAX_BUCKETS = 10000
+
+    def __init__(self, app):
+        self.app = app
+        self.lanes: Dict[str, ConcurrencyLane] = {}
+        for name, (concurrency, queue, timeout) in self.DEFAULTS.items():
+            prefix = f"LANE_{name.upper()}"
+            self.lanes[name] = ConcurrencyLane(
+                name,
+                _env_int(f"{prefix}_CONCURRENCY", concurrency),
+                _env_int(f"{prefix}_QUEUE", queue),
+                _env_float(f"{prefix}_TIMEOUT", timeout),
+            )
+        self.rate = _env_float("RATE_LIMIT_PER_SECOND", 20.0)
+        self.burst = _env_float("RATE_LIMIT_BURST", 40.0)
+        self.trusted_proxies = _trusted_proxies()
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    def client_key(self, scope) -> str:
+        headers = dict(scope.get("headers") or [])
+        authorization = headers.get(b"authorization", b"").decode()
+        if authorization.lower().startswith("bearer "):
+            payload = decode_access_token(authorization[7:])
+            if payload and payload.get("sub"):
+                return f"user:{payload['sub']}"
+        client = scope.get("client")
+        address = client[0] if client else "unknown"
+        if self.trusted_proxies and _is_trusted(address, self.trusted_proxies):
+            # Walk the chain from the nearest hop: the first address our own proxies did not
+            # add is the client (anything further left was written by the client itself)
+            hops = [hop.strip() for hop in headers.get(b"x-forwarded-for", b"").decode().split(",") if hop.strip()]
+            while hops and _is_trusted(address, self.trusted_proxies):
+                address = hops.pop()
+        return f"ip:{address}"
+
+    def rate_limited(self, key: str) -> float:
+        if self.rate <= 0:
+            return 0.0
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.MAX_BUCKETS:
+                # forget clients that have been idle long enough to be full again
+                idle = time.monotonic() - self.burst / self.rate
+                self.buckets = {k: b for k, b in self.buckets.items() if b.updated > idle}
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+        return bucket.take()
+
+    async def reject(self, send, status: int, retry_after: float, detail: str):
+        body = orjson.dumps({"detail": detail})
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        wait = self.rate_limited(self.client_key(scope))
+        if wait:
+            await self.reject(send, 429, wait, "Too many requests")
+            return
+
+        lane = self.lanes[classify(scope["method"], scope["path"])]
+        if not await lane.acquire():
+            await self.reject(send, 503, lane.queue_timeout, f"Server busy ({lane.name}), retry later")
+            return
+        token = current_budget.set(start_budget(scope["method"], scope["path"], lane.name))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_budget.reset(token)
+            lane.release()
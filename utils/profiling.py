@@ -0,0 +1,208 @@
+#this implements opt-in per-request profiling by sampling the stack of the endpoint serving the request
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from auth.auth import decode_access_token
+from database.config import profiles_collection
+from database.slowqueries import current_scope, route_label
+
+logger = logging.getLogger("shopygenie.profiling")
+
+# Fraction of requests profiled without being asked to (0 = only on request)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_MS", "2")) / 1000
+# Sampling costs CPU on every thread; never run more than this many at once
+PROFILE_MAX_CONCURRENT = int(os.getenv("PROFILE_MAX_CONCURRENT", "2"))
+
+PROFILE_HEADER = b"x-profile"
+MAX_STORED_STACKS = 500
+TOP_FUNCTIONS = 50
+
+# Id of the profile being taken, visible wherever the request's context is (threadpool included)
+profiled_request: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("profiled_request", default=None)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    cwd = os.getcwd()
+    if filename.startswith(cwd):
+        filename = filename[len(cwd) + 1:]
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _belongs_to(frame, request_frame, profile_id: str) -> bool:
+    """Whether the stack from `frame` upwards is serving the profiled request."""
+    # Async endpoints: the request's await chain, middleware included, is on the stack
+    walk = frame
+    while walk is not None:
+        if walk is request_frame:
+            return True
+        walk = walk.f_back
+    # Plain def endpoints: the threadpool runs them in a copy of the request's context
+    walk = frame
+    while walk is not None:
+        for value in walk.f_locals.values():
+            if isinstance(value, contextvars.Context) and value.get(profiled_request) == profile_id:
+                return True
+        walk = walk.f_back
+    return False
+
+
+class StackSampler(threading.Thread):
+    """
+    Every `interval` seconds, records the stack below the request's endpoint
+    function on the thread serving this request: the event loop thread for
+    async endpoints, a threadpool thread for plain `def` endpoints. Other
+    requests running the same endpoint at the same time are left out. Time
+    spent waiting on Mongo is included, so it is a wall-clock profile.
+    """
+
+    def __init__(self, scope: dict, interval: float, request_frame, profile_id: str):
+        super().__init__(daemon=True)
+        self.scope = scope
+        self.interval = interval
+        self.request_frame = request_frame
+        self.profile_id = profile_id
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.done = threading.Event()
+
+    def run(self):
+        own_thread = threading.get_ident()
+        while not self.done.wait(self.interval):
+            endpoint = self.scope.get("endpoint")  # set by the router once the request is matched
+            code = getattr(endpoint, "__code__", None)
+            if code is None:
+                continue
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame)
+                    if frame.f_code is code:
+                        break
+                    frame = frame.f_back
+                if frame is None:
+                    continue  # this thread is not serving the endpoint
+                if not _belongs_to(frame, self.request_frame, self.profile_id):
+                    continue  # the same endpoint, serving another request
+                self.stacks[";".join(_frame_label(f) for f in reversed(stack))] += 1
+                self.samples += 1
+
+    def stop(self):
+        self.done.set()
+        self.join()
+
+
+def summarize(stacks: Counter) -> List[Dict]:
+    """Per function: samples where it was running (self) and on the stack (total)."""
+    own: Counter = Counter()
+    total: Counter = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for label in set(frames):
+            total[label] += count
+    return [
+        {"function": label, "self": own[label], "total": count}
+        for label, count in total.most_common(TOP_FUNCTIONS)
+    ]
+
+
+def collapsed(profile: Dict) -> str:
+    """The stored stacks in collapsed format (one "a;b;c count" line each), for flamegraph tools."""
+    return "\n".join(f"{entry['stack']} {entry['count']}" for entry in profile.get("stacks", [])) + "\n"
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware: publishes the request scope to the slow-query logger and
+    profiles a request when an admin sends `X-Profile: 1` or it is picked by
+    PROFILE_SAMPLE_RATE. Profiled responses carry `X-Profile-Id`; the profile
+    is downloadable from /admin/profiles/{id}.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.active = 0
+
+    def requested(self, scope) -> bool:
+        headers = dict(scope.get("headers") or [])
+        if headers.get(PROFILE_HEADER) != b"1":
+            return False
+        authorization = headers.get(b"authorization", b"").decode()
+        if not authorization.lower().startswith("bearer "):
+            return False
+        payload = decode_access_token(authorization[7:])
+        return bool(payload) and payload.get("role") == "admin"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = current_scope.set(scope)
+        try:
+            profile = (self.active < PROFILE_MAX_CONCURRENT
+                       and (self.requested(scope) or random.random() < PROFILE_SAMPLE_RATE))
+            if profile:
+                await self.profiled(scope, receive, send)
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            current_scope.reset(token)
+
+    async def profiled(self, scope, receive, send):
+        profile_id = uuid.uuid4().hex
+        status: Optional[int] = None
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        self.active += 1
+        sampler = StackSampler(scope, PROFILE_INTERVAL_SECONDS, sys._getframe(), profile_id)
+        token = profiled_request.set(profile_id)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            sampler.stop()
+            profiled_request.reset(token)
+            self.active -= 1
+            duration_ms = (time.perf_counter() - started) * 1000
+            # Stored off the event loop; the response has already been sent
+            asyncio.get_running_loop().run_in_executor(None, _store_profile, {
+                "id": profile_id,
+                "route": route_label(scope),
+                "path": scope.get("path"),
+                "status": status,
+                "duration_ms": round(duration_ms, 1),
+                "interval_ms": PROFILE_INTERVAL_SECONDS * 1000,
+                "samples": sampler.samples,
+                "functions": summarize(sampler.stacks),
+                "stacks": [{"stack": stack, "count": count} for stack, count in sampler.stacks.most_common(MAX_STORED_STACKS)],
+                "created_at": datetime.now(timezone.utc),
+            })
+
+
+def _store_profile(profile: Dict):
+    try:
+        profiles_collection.insert_one(profile)
+    except Exception as e:
+        logger.warning("could not store profile %s: %s", profile["id"], e)
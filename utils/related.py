@@ -0,0 +1,120 @@
+#this keeps "frequently bought together" counts: how many baskets contain each pair of products
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List
+from pymongo import UpdateOne
+from database.config import product_pairs_collection, sales_collection, sales_archive_collection, products_collection
+from database.routing import reporting
+
+# Baskets with more distinct products than this are left out (a bulk order says little about affinity
+# and costs n*(n-1) counter updates); the rebuild applies the same rule
+MAX_BASKET_PRODUCTS = 30
+REBUILD_BATCH_SIZE = 5000
+
+
+def _basket(product_ids: Iterable[str]) -> List[str]:
+    basket = sorted(set(product_ids))
+    return basket if len(basket) <= MAX_BASKET_PRODUCTS else []
+
+
+def record_baskets(shop_id: str, baskets: List[Iterable[str]]):
+    """
+    Count new sales into the pair counters, one upsert per (product, companion).
+
+    A product paired with itself counts the baskets containing it, which
+    turns pair counts into "bought X, also bought Y" ratios.
+
+    Args:
+        shop_id (str): The shop the sales belong to.
+        baskets (List): Product ids of each sale.
+    """
+    counts: Dict[tuple, int] = {}
+    for product_ids in baskets:
+        basket = _basket(product_ids)
+        for product_id in basket:
+            for related_id in basket:
+                counts[(product_id, related_id)] = counts.get((product_id, related_id), 0) + 1
+    if not counts:
+        return
+    now = datetime.now(timezone.utc)
+    product_pairs_collection.bulk_write([
+        UpdateOne(
+            {"shop_id": shop_id, "product_id": product_id, "related_id": related_id},
+            {"$inc": {"count": count}, "$set": {"updated_at": now}},
+            upsert=True,
+        )
+        for (product_id, related_id), count in counts.items()
+    ], ordered=False)
+
+
+def related_products(shop_id: str, product_id: str, limit: int) -> List[Dict]:
+    """
+    The products most often sold together with `product_id`, from the pair counters (two index reads).
+
+    Returns:
+        List[dict]: product_id, name, count (shared baskets) and confidence
+        (share of this product's baskets that also held the other product).
+    """
+    baskets = product_pairs_collection.find_one(
+        {"shop_id": shop_id, "product_id": product_id, "related_id": product_id}, {"_id": 0, "count": 1}
+    )
+    if not baskets:
+        return []
+    pairs = list(product_pairs_collection.find(
+        {"shop_id": shop_id, "product_id": product_id, "related_id": {"$ne": product_id}},
+        {"_id": 0, "related_id": 1, "count": 1},
+    ).sort("count", -1).limit(limit))
+    names = {p["id"]: p["name"] for p in products_collection.find(
+        {"shop_id": shop_id, "id": {"$in": [pair["related_id"] for pair in pairs]}}, {"_id": 0, "id": 1, "name": 1}
+    )}
+    return [
+        {
+            "product_id": pair["related_id"],
+            "name": names[pair["related_id"]],
+            "count": pair["count"],
+            "confidence": round(pair["count"] / baskets["count"], 4),
+        }
+        for pair in pairs if pair["related_id"] in names  # deleted products are not suggested
+    ]
+
+
+def rebuild_pairs(shop_id: str) -> int:
+    """
+    Recount a shop's pairs from every sale, hot and archived (idempotent).
+
+    Sales recorded while the rebuild runs may be counted twice or not at
+    all; run it when the shop is quiet.
+
+    Returns:
+        int: Number of pair counters written.
+    """
+    rows = reporting(sales_collection).aggregate([
+        {"$match": {"shop_id": shop_id}},
+        {"$unionWith": {"coll": sales_archive_collection.name, "pipeline": [{"$match": {"shop_id": shop_id}}]}},
+        {"$project": {"_id": 0, "basket": {"$setUnion": ["$items.product_id", []]}}},
+        {"$match": {"$expr": {"$lte": [{"$size": "$basket"}, MAX_BASKET_PRODUCTS]}}},
+        {"$project": {"product_id": "$basket", "related_id": "$basket"}},
+        {"$unwind": "$product_id"},
+        {"$unwind": "$related_id"},
+        {"$group": {"_id": {"product_id": "$product_id", "related_id": "$related_id"}, "count": {"$sum": 1}}},
+    ], allowDiskUse=True)
+
+    now = datetime.now(timezone.utc)
+    product_pairs_collection.delete_many({"shop_id": shop_id})
+    written = 0
+    batch = []
+    for row in rows:
+        batch.append({"shop_id": shop_id, **row["_id"], "count": row["count"], "updated_at": now})
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            product_pairs_collection.insert_many(batch, ordered=False)
+            written += len(batch)
+            batch = []
+    if batch:
+        product_pairs_collection.insert_many(batch, ordered=False)
+        written += len(batch)
+    return written
+
+
+# python -m utils.related  -> recount every shop's pairs from its sales
+if __name__ == "__main__":
+    for shop in sales_collection.distinct("shop_id"):
+        print(shop, rebuild_pairs(shop))
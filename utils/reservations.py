@@ -0,0 +1,217 @@
+#this holds stock for multi-step checkouts and gives it back when a hold is released or expires
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from fastapi import HTTPException
+from pymongo.collection import ReturnDocument
+from database.config import products_collection, holds_collection
+from database.routing import money
+from utils.etag import bump_version
+from utils.inventory import movement, record_movements
+from utils.sync import next_change_versions
+from utils.valuation import apply_valuation_delta
+
+# How often the sweeper looks for expired holds
+HOLD_SWEEP_SECONDS = 15
+SWEEP_BATCH_SIZE = 500
+
+logger = logging.getLogger("shopygenie.reservations")
+
+
+def _return_stock(shop_id: str, items: List[Dict], hold_id: str, kind: str = "release"):
+    """Put held quantities back on the shelf (the reverse of what reserve() took)."""
+    if not items:
+        return
+    versions = next_change_versions(shop_id, "products", len(items))
+    movements = []
+    for item, version in zip(items, versions):
+        product = money(products_collection).find_one_and_update(
+            {"shop_id": shop_id, "id": item["product_id"]},
+            {"$inc": {"current_stock": item["quantity"]},
+             "$set": {"updated_at": datetime.now(timezone.utc), "change_version": version}},
+            projection={"_id": 0, "category": 1, "cost_price": 1},
+        )
+        if product:
+            apply_valuation_delta(shop_id, product.get("category"), item["quantity"] * product.get("cost_price", 0))
+            movements.append(movement(shop_id, item["product_id"], kind, item["quantity"], reference_id=hold_id))
+    record_movements(movements)
+    bump_version(shop_id, "products")
+
+
+def reserve(shop_id: str, items: List[Dict], ttl_seconds: int) -> Dict:
+    """
+    Take the requested quantities off the shelf with conditional decrements and record a hold.
+
+    Either every line is held or none is: if one product is short, the lines
+    already taken are put back and a 409 says which product ran out.
+
+    Args:
+        shop_id (str): The shop selling the stock.
+        items (List[dict]): product_id / quantity pairs.
+        ttl_seconds (int): How long the hold lasts before it is released automatically.
+
+    Returns:
+        dict: The hold document.
+    """
+    merged: Dict[str, int] = {}
+    for item in items:
+        merged[item["product_id"]] = merged.get(item["product_id"], 0) + item["quantity"]
+
+    hold_id = uuid.uuid4().hex
+    now = datetime.now(timezone.utc)
+    versions = next_change_versions(shop_id, "products", len(merged))
+    taken = []
+    valuation_deltas: Dict[Optional[str], float] = {}
+    for (product_id, quantity), version in zip(merged.items(), versions):
+        product = money(products_collection).find_one_and_update(
+            {"shop_id": shop_id, "id": product_id, "current_stock": {"$gte": quantity}},
+            {"$inc": {"current_stock": -quantity}, "$set": {"updated_at": now, "change_version": version}},
+            projection={"_id": 0, "name": 1, "category": 1, "cost_price": 1, "current_stock": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if not product:
+            undo_decrements(shop_id, taken)
+            current = products_collection.find_one({"shop_id": shop_id, "id": product_id}, {"_id": 0, "name": 1, "current_stock": 1})
+            if not current:
+                raise HTTPException(status_code=404, detail=f"Product with ID {product_id} not found")
+            raise HTTPException(
+                status_code=409,
+                detail=f"Not enough stock for product {current['name']}. "
+                       f"Available: {current.get('current_stock', 0)}, requested: {quantity}"
+            )
+        taken.append({"product_id": product_id, "quantity": quantity})
+        category = product.get("category")
+        valuation_deltas[category] = valuation_deltas.get(category, 0.0) - quantity * product.get("cost_price", 0)
+
+    for category, delta in valuation_deltas.items():
+        apply_valuation_delta(shop_id, category, delta)
+    record_movements([movement(shop_id, item["product_id"], "reservation", -item["quantity"], reference_id=hold_id)
+                      for item in taken])
+    bump_version(shop_id, "products")
+
+    hold = {
+        "id": hold_id,
+        "shop_id": shop_id,
+        "items": taken,
+        "status": "active",
+        "expires_at": now + timedelta(seconds=ttl_seconds),
+        "sale_id": None,
+        "created_at": now,
+    }
+    holds_collection.insert_one(hold)
+    hold.pop("_id", None)
+    return hold
+
+
+def undo_decrements(shop_id: str, taken: List[Dict]):
+    """Roll back stock decrements of a checkout that could not be completed (nothing was recorded yet)."""
+    if not taken:
+        return
+    # The decrement already moved the product's change version and ETag; so must its reversal
+    versions = next_change_versions(shop_id, "products", len(taken))
+    for item, version in zip(taken, versions):
+        money(products_collection).update_one(
+            {"shop_id": shop_id, "id": item["product_id"]},
+            {"$inc": {"current_stock": item["quantity"]},
+             "$set": {"updated_at": datetime.now(timezone.utc), "change_version": version}},
+        )
+    bump_version(shop_id, "products")
+
+
+def claim(shop_id: str, hold_id: str, requested: Dict[str, int], sale_id: str) -> Dict:
+    """
+    Confirm a hold for a sale. The sale may use less than was held (the rest goes back
+    on the shelf) but not more, and each hold confirms exactly one sale.
+
+    Args:
+        shop_id (str): The shop selling the stock.
+        hold_id (str): The reservation id.
+        requested (dict): product_id -> quantity the sale needs.
+        sale_id (str): The sale confirming the hold.
+
+    Returns:
+        dict: The confirmed hold.
+    """
+    now = datetime.now(timezone.utc)
+    hold = holds_collection.find_one({"shop_id": shop_id, "id": hold_id}, {"_id": 0})
+    if not hold:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    held = {item["product_id"]: item["quantity"] for item in hold["items"]}
+    for product_id, quantity in requested.items():
+        if held.get(product_id, 0) < quantity:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Reservation {hold_id} holds {held.get(product_id, 0)} of product {product_id}, sale needs {quantity}"
+            )
+
+    # Only one of confirm / release / expire can move a hold out of "active"
+    confirmed = holds_collection.find_one_and_update(
+        {"shop_id": shop_id, "id": hold_id, "status": "active", "expires_at": {"$gt": now}},
+        {"$set": {"status": "confirmed", "sale_id": sale_id, "finished_at": now}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not confirmed:
+        raise HTTPException(status_code=409, detail="Reservation expired or already used")
+
+    leftover = [
+        {"product_id": product_id, "quantity": quantity - requested.get(product_id, 0)}
+        for product_id, quantity in held.items() if quantity > requested.get(product_id, 0)
+    ]
+    _return_stock(shop_id, leftover, hold_id)
+    return confirmed
+
+
+def release(shop_id: str, hold_id: str) -> Optional[Dict]:
+    """Cancel an active hold and put its stock back; None when it is no longer active."""
+    hold = holds_collection.find_one_and_update(
+        {"shop_id": shop_id, "id": hold_id, "status": "active"},
+        {"$set": {"status": "released", "finished_at": datetime.now(timezone.utc)}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if hold:
+        _return_stock(shop_id, hold["items"], hold_id)
+    return hold
+
+
+def release_expired() -> int:
+    """
+    Release every active hold past its expiry. Safe to run from several
+    workers at once: each hold is flipped to "expired" by exactly one of them.
+
+    Returns:
+        int: Number of holds released.
+    """
+    released = 0
+    now = datetime.now(timezone.utc)
+    for candidate in list(holds_collection.find(
+        {"status": "active", "expires_at": {"$lte": now}}, {"_id": 0, "shop_id": 1, "id": 1}
+    ).limit(SWEEP_BATCH_SIZE)):
+        hold = holds_collection.find_one_and_update(
+            {"shop_id": candidate["shop_id"], "id": candidate["id"], "status": "active"},
+            {"$set": {"status": "expired", "finished_at": now}},
+            projection={"_id": 0},
+        )
+        if hold:
+            _return_stock(hold["shop_id"], hold["items"], hold["id"])
+            released += 1
+    return released
+
+
+async def sweep_expired_holds():
+    """Background task: release expired holds every HOLD_SWEEP_SECONDS (the Mongo work runs in a thread)."""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, release_expired)
+        except Exception as e:
+            logger.warning("expired hold sweep failed: %s", e)
+        await asyncio.sleep(HOLD_SWEEP_SECONDS)
+
+
+# python -m utils.reservations  -> release expired holds once (the API also sweeps every HOLD_SWEEP_SECONDS)
+if __name__ == "__main__":
+    print(f"Released {release_expired()} expired holds")
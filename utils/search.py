@@ -0,0 +1,318 @@
+#this is the in-memory prefix index behind the product / customer typeahead endpoints
+#
+# Each worker keeps its own index. Its own writes apply immediately. Writes made
+# through another worker move the shared search version; a lookup checks it when
+# the last check is older than VERSION_CHECK_SECONDS, and while the index is
+# behind, lookups are answered from Mongo until a rebuild catches up.
+import heapq
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Set, Tuple
+from database.config import products_collection, customers_collection
+from utils.etag import bump_version, current_version
+
+# Fields kept per document (what the typeahead returns) and fields that are tokenized
+SEARCH_CONFIG = {
+    "products": {
+        "collection": products_collection,
+        "fields": ["id", "name", "category", "unit", "selling_price"],
+        "tokenized": ["name", "category"],
+        "lowered": ["name", "category"],
+    },
+    "customers": {
+        "collection": customers_collection,
+        "fields": ["id", "name", "phone"],
+        "tokenized": ["name", "phone"],
+        "lowered": ["name"],
+    },
+}
+
+# How long a lookup trusts the last check of the shared search version: bounds how long
+# another worker's write can stay invisible to this worker's typeahead
+VERSION_CHECK_SECONDS = 1.0
+
+# A stale index (written to from another worker) is rebuilt in the background at most this
+# often; lookups go to Mongo in the meantime
+REBUILD_SECONDS = 10.0
+
+# Upper bound on candidates gathered for very short prefixes like "a"
+MAX_CANDIDATES = 2000
+
+_TOKEN_RE = re.compile(r"[0-9a-z]+")
+
+
+def tokenize(value) -> List[str]:
+    if value is None:
+        return []
+    text = str(value).lower()
+    tokens = _TOKEN_RE.findall(text)
+    digits = "".join(ch for ch in text if ch.isdigit())
+    if len(digits) > 3 and digits not in tokens:
+        tokens.append(digits)  # "+255 712 345" is also searchable as "255712345"
+    return tokens
+
+
+def within_distance(a: str, b: str, max_distance: int) -> bool:
+    """Levenshtein distance <= max_distance, abandoning rows that already exceed it."""
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > max_distance:
+            return False
+        previous = current
+    return previous[-1] <= max_distance
+
+
+def fuzzy_prefix_match(term: str, token: str, max_distance: int) -> bool:
+    """True when some prefix of `token` is within `max_distance` edits of `term`."""
+    head = token[:len(term) + max_distance]
+    # Cheap rejection before the quadratic check: too many letters missing entirely
+    if len(set(term) - set(head)) > max_distance:
+        return False
+    return any(
+        within_distance(term, token[:length], max_distance)
+        for length in range(max(1, len(term) - max_distance), len(term) + max_distance + 1)
+    )
+
+
+class PrefixIndex:
+    """Sorted token list + token -> ids map for one shop and one collection."""
+
+    def __init__(self, name: str, version: int = 0):
+        self.name = name
+        self.version = version
+        self.built_at = time.monotonic()
+        self.checked_at = self.built_at
+        self.stale = False
+        self.docs: Dict[str, dict] = {}
+        self.names: Dict[str, str] = {}  # lowercased, for ranking
+        self.doc_tokens: Dict[str, Set[str]] = {}
+        self.token_ids: Dict[str, Set[str]] = {}
+        self.tokens: List[str] = []
+
+    def upsert(self, doc: dict):
+        doc_id = str(doc["id"])
+        self.remove(doc_id)
+        config = SEARCH_CONFIG[self.name]
+        self.docs[doc_id] = {field: doc.get(field) for field in config["fields"]}
+        self.names[doc_id] = str(doc.get("name") or "").lower()
+        tokens = {token for field in config["tokenized"] for token in tokenize(doc.get(field))}
+        self.doc_tokens[doc_id] = tokens
+        for token in tokens:
+            if token not in self.token_ids:
+                self.token_ids[token] = set()
+                insort(self.tokens, token)
+            self.token_ids[token].add(doc_id)
+
+    def remove(self, doc_id: str):
+        for token in self.doc_tokens.pop(doc_id, ()):
+            ids = self.token_ids.get(token)
+            if ids is None:
+                continue
+            ids.discard(doc_id)
+            if not ids:
+                del self.token_ids[token]
+                position = bisect_left(self.tokens, token)
+                if position < len(self.tokens) and self.tokens[position] == token:
+                    self.tokens.pop(position)
+        self.docs.pop(doc_id, None)
+        self.names.pop(doc_id, None)
+
+    def _prefix_ids(self, prefix: str) -> Set[str]:
+        ids: Set[str] = set()
+        position = bisect_left(self.tokens, prefix)
+        while position < len(self.tokens) and self.tokens[position].startswith(prefix):
+            token_ids = self.token_ids[self.tokens[position]]
+            if len(ids) + len(token_ids) > MAX_CANDIDATES:
+                for doc_id in token_ids:
+                    ids.add(doc_id)
+                    if len(ids) >= MAX_CANDIDATES:
+                        return ids
+            ids |= token_ids
+            position += 1
+        return ids
+
+    def _has_prefix(self, doc_id: str, prefix: str) -> bool:
+        return any(token.startswith(prefix) for token in self.doc_tokens.get(doc_id, ()))
+
+    def _fuzzy_ids(self, term: str) -> Set[str]:
+        max_distance = 2 if len(term) >= 7 else 1
+        ids: Set[str] = set()
+        # Only tokens sharing the first two letters are compared; typos rarely hit
+        # them and this keeps the scan to a few hundred tokens even on big catalogs
+        head = term[:2]
+        position = bisect_left(self.tokens, head)
+        while position < len(self.tokens) and self.tokens[position].startswith(head):
+            token = self.tokens[position]
+            if fuzzy_prefix_match(term, token, max_distance):
+                ids |= self.token_ids[token]
+            position += 1
+        return ids
+
+    def search(self, query: str, limit: int, fuzzy: bool = True) -> List[dict]:
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        # Candidates come from the longest (most selective) term, the others filter them
+        ordered = sorted(terms, key=len, reverse=True)
+        candidates = {
+            doc_id for doc_id in self._prefix_ids(ordered[0])
+            if all(self._has_prefix(doc_id, term) for term in ordered[1:])
+        }
+
+        if fuzzy and len(candidates) < limit and len(terms[-1]) >= 3:
+            candidates |= {
+                doc_id for doc_id in self._fuzzy_ids(terms[-1])
+                if all(self._has_prefix(doc_id, term) for term in terms[:-1])
+            }
+
+        lowered = query.strip().lower()
+
+        def rank(doc_id: str) -> Tuple[int, int, str]:
+            name = self.names[doc_id]
+            return (0 if name.startswith(lowered) else 1, len(name), name)
+
+        return [self.docs[doc_id] for doc_id in heapq.nsmallest(limit, candidates, key=rank)]
+
+
+_indexes: Dict[Tuple[str, str], PrefixIndex] = {}
+_building: Set[Tuple[str, str]] = set()
+_lock = threading.Lock()
+
+
+def _search_version_name(name: str) -> str:
+    # Separate from the list ETag version so stock-only writes do not invalidate the index
+    return f"{name}_search"
+
+
+def _build(shop_id: str, name: str):
+    key = (shop_id, name)
+    try:
+        # Read the version first: a write racing the load only makes the index look stale
+        version = current_version(shop_id, _search_version_name(name))
+        config = SEARCH_CONFIG[name]
+        projection = {"_id": 0, **{field: 1 for field in config["fields"]}}
+        index = PrefixIndex(name, version)
+        for doc in config["collection"].find({"shop_id": shop_id}, projection):
+            index.upsert(doc)
+        _indexes[key] = index
+    finally:
+        with _lock:
+            _building.discard(key)
+
+
+def _build_in_background(shop_id: str, name: str):
+    key = (shop_id, name)
+    with _lock:
+        if key in _building:
+            return
+        _building.add(key)
+    threading.Thread(target=_build, args=(shop_id, name), daemon=True).start()
+
+
+def record_search_write(shop_id: str, name: str, doc: Optional[dict] = None, removed_id: Optional[str] = None):
+    """
+    Apply a create/update/delete to this worker's index and bump the shared search version.
+
+    Args:
+        shop_id (str): The shop the document belongs to.
+        name (str): "products" or "customers".
+        doc (dict): The new document state (create/update).
+        removed_id (str): The deleted document's id (delete).
+    """
+    version = bump_version(shop_id, _search_version_name(name))
+    index = _indexes.get((shop_id, name))
+    if index is None:
+        return
+    if doc is not None:
+        index.upsert(doc)
+    if removed_id is not None:
+        index.remove(str(removed_id))
+    if version == index.version + 1:
+        index.version = version  # nobody else wrote in between, still in sync
+
+
+def search_keys(name: str, doc: dict) -> dict:
+    """
+    Lowercased copies of the searchable fields present in `doc`, stored as `<field>_lower`.
+
+    The Mongo fallback matches prefixes on these case-sensitively, which keeps
+    the lookup a tight range scan on the (shop_id, <field>_lower) index.
+    """
+    return {
+        f"{field}_lower": str(doc[field]).lower() if doc[field] is not None else None
+        for field in SEARCH_CONFIG[name]["lowered"] if field in doc
+    }
+
+
+def _mongo_search(shop_id: str, name: str, query: str, limit: int) -> List[dict]:
+    """Anchored prefix match on the lowercased-field indexes, used while warming up."""
+    config = SEARCH_CONFIG[name]
+    prefix = "^" + re.escape(query.strip().lower())
+    conditions = [
+        {f"{field}_lower" if field in config["lowered"] else field: {"$regex": prefix}}
+        for field in config["tokenized"]
+    ]
+    projection = {"_id": 0, **{field: 1 for field in config["fields"]}}
+    return list(config["collection"].find({"shop_id": shop_id, "$or": conditions}, projection).limit(limit))
+
+
+def backfill_search_keys() -> Dict[str, int]:
+    """
+    Fill the `<field>_lower` copies on documents written before they existed.
+
+    Returns:
+        dict: Number of documents updated per collection.
+    """
+    updated = {}
+    for name, config in SEARCH_CONFIG.items():
+        lowered = config["lowered"]
+        result = config["collection"].update_many(
+            {"$or": [{f"{field}_lower": {"$exists": False}} for field in lowered]},
+            [{"$set": {f"{field}_lower": {"$toLower": f"${field}"} for field in lowered}}],
+        )
+        updated[name] = result.modified_count
+    return updated
+
+
+def search(shop_id: str, name: str, query: str, limit: int = 10, fuzzy: bool = True) -> List[dict]:
+    """
+    Typeahead lookup by prefix (and optionally typo-tolerant) over names, categories and phones.
+
+    Args:
+        shop_id (str): The shop to search in.
+        name (str): "products" or "customers".
+        query (str): What the cashier typed so far.
+        limit (int): Maximum number of results.
+        fuzzy (bool): Also match tokens within a small edit distance.
+
+    Returns:
+        List[dict]: Matching documents, best match first. Documents written
+        through another worker may be missing for up to VERSION_CHECK_SECONDS.
+    """
+    index = _indexes.get((shop_id, name))
+    if index is None:
+        _build_in_background(shop_id, name)
+        return _mongo_search(shop_id, name, query, limit)
+
+    now = time.monotonic()
+    if not index.stale and now - index.checked_at > VERSION_CHECK_SECONDS:
+        index.checked_at = now
+        index.stale = current_version(shop_id, _search_version_name(name)) != index.version
+    if index.stale:
+        if now - index.built_at > REBUILD_SECONDS:
+            _build_in_background(shop_id, name)
+        return _mongo_search(shop_id, name, query, limit)
+    return index.search(query, limit, fuzzy)
+
+
+# python -m utils.search  -> add the lowercased search fields to existing products / customers
+if __name__ == "__main__":
+    print(backfill_search_keys())
@@ -0,0 +1,58 @@
+#this assigns pre-existing documents (written before shops existed) to the default shop
+# and gives every shop an admin
+from auth.auth import DEFAULT_SHOP_ID
+from database.config import (
+    users_collection,
+    products_collection,
+    purchases_collection,
+    sales_collection,
+    customers_collection,
+    debts_collection,
+    expenditures_collection,
+    ensure_indexes,
+)
+
+
+def assign_default_shop(shop_id: str = DEFAULT_SHOP_ID) -> dict:
+    """
+    Set shop_id on every document that does not have one yet.
+
+    Args:
+        shop_id (str): The shop to assign legacy data to.
+
+    Returns:
+        dict: Number of documents updated per collection.
+    """
+    updated = {}
+    for collection in (users_collection, products_collection, purchases_collection, sales_collection,
+                       customers_collection, debts_collection, expenditures_collection):
+        result = collection.update_many({"shop_id": {"$exists": False}}, {"$set": {"shop_id": shop_id}})
+        updated[collection.name] = result.modified_count
+    updated["admins_promoted"] = promote_admins()
+    ensure_indexes()
+    return updated
+
+
+def promote_admins() -> int:
+    """
+    Make the oldest user of every shop without an admin its admin.
+
+    Users created before roles existed have none, and creating users
+    requires an admin once any user exists.
+
+    Returns:
+        int: Number of users promoted.
+    """
+    promoted = 0
+    for shop_id in users_collection.distinct("shop_id"):
+        if users_collection.find_one({"shop_id": shop_id, "role": "admin"}):
+            continue
+        oldest = users_collection.find_one({"shop_id": shop_id}, sort=[("_id", 1)])
+        users_collection.update_one({"_id": oldest["_id"]}, {"$set": {"role": "admin"}})
+        promoted += 1
+    return promoted
+
+
+# python -m utils.shop_migration  -> run once after upgrading, then python -m utils.valuation
+if __name__ == "__main__":
+    print(assign_default_shop())
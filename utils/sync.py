@@ -0,0 +1,173 @@
+#this maintains the per-document change versions and tombstones behind the delta sync API
+#
+# A version is reserved before the write that carries it lands, so writes can become
+# visible out of version order: B reserves 8 after A reserved 7, and B's document is
+# stored first. A client pulling in between would see 8, resume from it, and never
+# receive 7. Pulls therefore stop below the oldest reservation that may still be in
+# flight (the watermark); a reservation counts as in flight for SYNC_GRACE_SECONDS.
+import os
+from datetime import datetime, timezone
+from typing import Dict, List
+from pymongo import UpdateOne
+from pymongo.collection import ReturnDocument
+from database.config import products_collection, customers_collection, tombstones_collection, versions_collection
+
+SYNC_COLLECTIONS = {
+    "products": products_collection,
+    "customers": customers_collection,
+}
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Longest expected gap between reserving a version and the write carrying it being stored.
+# Changes show up in pulls at most this much later; a write slower than this can be missed.
+SYNC_GRACE_SECONDS = float(os.getenv("SYNC_GRACE_SECONDS", "5"))
+
+
+def _counter_key(shop_id: str, name: str) -> str:
+    # Separate from the list ETag version, which is bumped after the write lands
+    return f"{shop_id}:{name}_changes"
+
+
+def _in_flight(grace_ms: int) -> dict:
+    # Reservations younger than the grace period, measured on the server clock
+    return {"$filter": {
+        "input": {"$ifNull": ["$pending", []]},
+        "cond": {"$gt": ["$$this.at", {"$subtract": ["$$NOW", grace_ms]}]},
+    }}
+
+
+def next_change_versions(shop_id: str, name: str, count: int) -> List[int]:
+    """
+    Reserve `count` consecutive change versions in one round trip.
+
+    Args:
+        shop_id (str): The shop being written to.
+        name (str): "products" or "customers".
+        count (int): How many documents the write touches.
+
+    Returns:
+        List[int]: Versions to stamp on the documents, ascending.
+    """
+    if count <= 0:
+        return []
+    # One pipeline update: advance the counter and log the reservation (dropping expired ones)
+    previous = {"$ifNull": ["$version", 0]}
+    doc = versions_collection.find_one_and_update(
+        {"_id": _counter_key(shop_id, name)},
+        [{"$set": {
+            "version": {"$add": [previous, count]},
+            "pending": {"$concatArrays": [
+                _in_flight(int(SYNC_GRACE_SECONDS * 1000)),
+                [{"low": {"$add": [previous, 1]}, "at": "$$NOW"}],
+            ]},
+        }}],
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    top = doc["version"]
+    return list(range(top - count + 1, top + 1))
+
+
+def next_change_version(shop_id: str, name: str) -> int:
+    """Version to $set as `change_version` on a single-document write."""
+    return next_change_versions(shop_id, name, 1)[0]
+
+
+def record_tombstone(shop_id: str, name: str, doc_id: str):
+    """Remember a hard delete so clients syncing from an older version drop the document."""
+    tombstones_collection.insert_one({
+        "shop_id": shop_id,
+        "collection": name,
+        "id": str(doc_id),
+        "change_version": next_change_version(shop_id, name),
+        "deleted_at": datetime.now(timezone.utc),
+    })
+
+
+def safe_version(shop_id: str, name: str) -> int:
+    """
+    Highest version below every reservation that may still be in flight.
+
+    Every version up to it is either stored or will never be; returns the
+    counter itself when nothing was reserved within SYNC_GRACE_SECONDS.
+    """
+    rows = list(versions_collection.aggregate([
+        {"$match": {"_id": _counter_key(shop_id, name)}},
+        {"$project": {"version": 1, "in_flight": _in_flight(int(SYNC_GRACE_SECONDS * 1000))}},
+        {"$project": {"version": 1, "oldest": {"$min": "$in_flight.low"}}},
+    ]))
+    if not rows:
+        return 0
+    oldest = rows[0].get("oldest")
+    return oldest - 1 if oldest is not None else rows[0]["version"]
+
+
+def changes_since(shop_id: str, name: str, since: int, limit: int) -> Dict:
+    """
+    Documents written and deleted after `since`, in change-version order.
+
+    Args:
+        shop_id (str): The shop to sync.
+        name (str): "products" or "customers".
+        since (int): The version the client already has (0 for a full download).
+        limit (int): Maximum number of changes (writes + deletes) to return.
+
+    Only versions up to the watermark (safe_version) are served, so a version
+    still being written is never skipped by a client resuming from `version`.
+
+    Returns:
+        dict: changed, deleted, version (pass back as `since`) and has_more.
+    """
+    query = {"shop_id": shop_id, "change_version": {"$gt": since, "$lte": safe_version(shop_id, name)}}
+    changed = list(SYNC_COLLECTIONS[name].find(query, {"_id": 0}).sort("change_version", 1).limit(limit + 1))
+    deleted = list(tombstones_collection.find(
+        {**query, "collection": name}, {"_id": 0, "id": 1, "change_version": 1, "deleted_at": 1}
+    ).sort("change_version", 1).limit(limit + 1))
+
+    # Merge both streams and cut at `limit`, so the next page starts exactly where this one ends
+    merged = sorted([(doc["change_version"], 0, doc) for doc in changed] +
+                    [(doc["change_version"], 1, doc) for doc in deleted], key=lambda entry: entry[:2])
+    has_more = len(merged) > limit
+    merged = merged[:limit]
+    changed = [doc for _, kind, doc in merged if kind == 0]
+    # An id deleted and then reused by a newer document is only reported as changed
+    recreated = {str(doc["id"]) for doc in changed}
+    return {
+        "changed": changed,
+        "deleted": [doc for _, kind, doc in merged if kind == 1 and doc["id"] not in recreated],
+        "version": merged[-1][0] if merged else since,
+        "has_more": has_more,
+    }
+
+
+def backfill_change_versions() -> Dict[str, int]:
+    """
+    Stamp a change version on documents written before versions existed,
+    so a full download (since=0) includes them.
+
+    Returns:
+        dict: Number of documents stamped per collection.
+    """
+    stamped = {}
+    for name, collection in SYNC_COLLECTIONS.items():
+        stamped[name] = 0
+        for shop_id in collection.distinct("shop_id", {"change_version": {"$exists": False}}):
+            while True:
+                ids = [doc["_id"] for doc in collection.find(
+                    {"shop_id": shop_id, "change_version": {"$exists": False}}, {"_id": 1}
+                ).limit(BACKFILL_BATCH_SIZE)]
+                if not ids:
+                    break
+                versions = next_change_versions(shop_id, name, len(ids))
+                collection.bulk_write([
+                    UpdateOne({"_id": _id}, {"$set": {"change_version": version}})
+                    for _id, version in zip(ids, versions)
+                ], ordered=False)
+                stamped[name] += len(ids)
+    return stamped
+
+
+# python -m utils.sync  -> run once after upgrading (after python -m utils.shop_migration)
+if __name__ == "__main__":
+    print(backfill_change_versions())
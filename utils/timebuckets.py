@@ -0,0 +1,85 @@
+#this contains the date-bucketing helpers shared by the time-series endpoints
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+GRANULARITIES = ("hour", "day", "week", "month")
+
+# Default look-back when the client does not send a start date
+DEFAULT_SPANS = {
+    "hour": timedelta(hours=48),
+    "day": timedelta(days=90),
+    "week": timedelta(weeks=52),
+    "month": timedelta(days=730),
+}
+
+MAX_BUCKETS = 20000
+
+
+def to_naive_utc(value: datetime) -> datetime:
+    """Mongo returns naive UTC datetimes, so bucket keys are kept naive UTC too."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def truncate(value: datetime, granularity: str) -> datetime:
+    """
+    Round a datetime down to the start of its bucket (weeks start on Monday).
+
+    Args:
+        value (datetime): Naive UTC datetime.
+        granularity (str): "hour", "day", "week" or "month".
+
+    Returns:
+        datetime: The bucket start.
+    """
+    if granularity == "hour":
+        return value.replace(minute=0, second=0, microsecond=0)
+    day = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def next_bucket(value: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return value + timedelta(hours=1)
+    if granularity == "day":
+        return value + timedelta(days=1)
+    if granularity == "week":
+        return value + timedelta(weeks=1)
+    if value.month == 12:
+        return value.replace(year=value.year + 1, month=1)
+    return value.replace(month=value.month + 1)
+
+
+def bucket_range(start: datetime, end: datetime, granularity: str) -> List[datetime]:
+    """Every bucket start from `start` up to (but excluding) `end`."""
+    buckets = []
+    current = truncate(start, granularity)
+    while current < end:
+        buckets.append(current)
+        if len(buckets) > MAX_BUCKETS:
+            raise ValueError(f"Range too large: more than {MAX_BUCKETS} {granularity} buckets")
+        current = next_bucket(current, granularity)
+    return buckets
+
+
+def date_trunc_expression(field: str, granularity: str) -> dict:
+    """Server-side equivalent of `truncate` ($dateTrunc, MongoDB 5.0+)."""
+    expression = {"date": field, "unit": granularity, "timezone": "UTC"}
+    if granularity == "week":
+        expression["startOfWeek"] = "monday"
+    return {"$dateTrunc": expression}
+
+
+def shift_months(value: datetime, months: int) -> datetime:
+    """Move a datetime by whole calendar months, clamping the day (Mar 31 - 1 month = Feb 28/29)."""
+    month_index = value.month - 1 + months
+    year = value.year + month_index // 12
+    month = month_index % 12 + 1
+    next_month_start = datetime(year + (month == 12), month % 12 + 1, 1)
+    last_day = (next_month_start - timedelta(days=1)).day
+    return value.replace(year=year, month=month, day=min(value.day, last_day))
@@ -0,0 +1,109 @@
+#this keeps the stock valuation (current_stock × cost_price) up to date incrementally
+from typing import Dict, Optional
+from pymongo import ReplaceOne, UpdateOne
+from database.config import products_collection, valuation_collection
+
+TOTAL_KEY = "__total__"
+
+
+def product_valuation(product: Optional[Dict]) -> float:
+    if not product:
+        return 0.0
+    return float(product.get("current_stock", 0) or 0) * float(product.get("cost_price", 0) or 0)
+
+
+def apply_valuation_delta(shop_id: str, category: Optional[str], delta: float):
+    """
+    Atomically add `delta` to the shop total and to the product's category.
+
+    Args:
+        shop_id (str): The shop owning the product.
+        category (str): The product category (None is stored as "uncategorized").
+        delta (float): Change in valuation, negative when stock leaves.
+    """
+    if not delta:
+        return
+    valuation_collection.bulk_write([
+        UpdateOne({"shop_id": shop_id, "category": TOTAL_KEY}, {"$inc": {"valuation": delta}}, upsert=True),
+        UpdateOne({"shop_id": shop_id, "category": category or "uncategorized"}, {"$inc": {"valuation": delta}}, upsert=True),
+    ], ordered=False)
+
+
+def apply_product_change(shop_id: str, before: Optional[Dict], after: Optional[Dict]):
+    """
+    Move a product's valuation from its old state to its new one.
+
+    Args:
+        shop_id (str): The shop owning the product.
+        before (dict): Product document before the write (None on create).
+        after (dict): Product document after the write (None on delete).
+    """
+    old_category = before.get("category") if before else None
+    new_category = after.get("category") if after else None
+    old_value = product_valuation(before)
+    new_value = product_valuation(after)
+
+    if before and after and old_category == new_category:
+        apply_valuation_delta(shop_id, new_category, new_value - old_value)
+        return
+    if before:
+        apply_valuation_delta(shop_id, old_category, -old_value)
+    if after:
+        apply_valuation_delta(shop_id, new_category, new_value)
+
+
+def get_valuation_totals(shop_id: str) -> Dict:
+    """Read the maintained totals; one small collection, no product scan."""
+    docs = list(valuation_collection.find({"shop_id": shop_id}))
+    total = 0.0
+    categories = {}
+    for doc in docs:
+        if doc["category"] == TOTAL_KEY:
+            total = doc.get("valuation", 0.0)
+        else:
+            categories[doc["category"]] = doc.get("valuation", 0.0)
+    return {"total_valuation": total, "category_valuations": categories}
+
+
+def reconcile_valuation() -> Dict:
+    """
+    Recompute every valuation from the products collection and overwrite the stored totals.
+
+    Returns:
+        dict: The freshly computed totals, per shop.
+    """
+    rows = list(products_collection.aggregate([
+        {"$group": {
+            "_id": {"shop_id": "$shop_id", "category": {"$ifNull": ["$category", "uncategorized"]}},
+            "valuation": {"$sum": {"$multiply": [
+                {"$ifNull": ["$current_stock", 0]},
+                {"$ifNull": ["$cost_price", 0]},
+            ]}},
+        }},
+    ]))
+    docs = []
+    shop_totals = {}
+    for row in rows:
+        shop_id = row["_id"]["shop_id"]
+        shop_totals[shop_id] = shop_totals.get(shop_id, 0.0) + row["valuation"]
+        docs.append({"shop_id": shop_id, "category": row["_id"]["category"], "valuation": row["valuation"]})
+    docs += [{"shop_id": shop_id, "category": TOTAL_KEY, "valuation": total} for shop_id, total in shop_totals.items()]
+
+    # Overwrite key by key: live $inc upserts keep finding their document (emptying the
+    # collection first let them recreate it and break the insert on the unique index)
+    if docs:
+        valuation_collection.bulk_write([
+            ReplaceOne({"shop_id": doc["shop_id"], "category": doc["category"]}, doc, upsert=True)
+            for doc in docs
+        ], ordered=False)
+    # Then drop categories (and shops) that no longer have products
+    for shop_id in shop_totals:
+        categories = [doc["category"] for doc in docs if doc["shop_id"] == shop_id]
+        valuation_collection.delete_many({"shop_id": shop_id, "category": {"$nin": categories}})
+    valuation_collection.delete_many({"shop_id": {"$nin": list(shop_totals)}})
+    return {shop_id: get_valuation_totals(shop_id) for shop_id in shop_totals}
+
+
+# python -m utils.valuation  -> rebuild the valuation totals from scratch
+if __name__ == "__main__":
+    print(reconcile_valuation())